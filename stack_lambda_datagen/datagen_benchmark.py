@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import lambda_function
+
+"""
+Benchmark suite for the Graph data generator: the streaming pipeline of the Lambda function and datagen_local.py
+(stream_scooter_dataset; i.e. chunked generation, edge derivation, writers and compression), writing to a temporary
+local directory instead of S3, at fixed scale tiers. Every tier runs in its own process, so that peak RSS is the tier's own.
+
+    Usage (from this directory):
+    $ python datagen_benchmark.py --tiers 1k 10k 100k --save-baseline      # record a baseline
+    $ python datagen_benchmark.py --tiers 1k 10k 100k                      # compare with it; exit code 1 if regressed
+
+    Metrics per tier: wall time (best of --repeat runs), vertices/sec, peak RSS and tracemalloc peak (one extra run,
+    traced). A tier regresses when its throughput drops, or its memory grows, past --max-regression (default 20%).
+    Memory stays flat with the number of scooters (one chunk at a time), so the 1m tier runs on a build box too; it
+    writes ~1 GB of CSV to the temporary directory, though. Baselines are machine-specific, and only compared with
+    results of the same parts, chunk size and output options: record them on the box that runs the comparison.
+"""
+
+# Number of scooters per tier
+BENCHMARK_TIERS = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+DEFAULT_TIERS = ['1k', '10k', '100k']
+DEFAULT_BASELINE_FILE_NAME = 'datagen_benchmark_baseline.json'
+DEFAULT_MAX_REGRESSION = 0.2
+
+# Metric -> True if higher is better
+BENCHMARK_METRICS = {'vertices_per_second': True, 'peak_rss_mb': False, 'tracemalloc_peak_mb': False}
+# Run settings; results are only compared with a baseline of the same settings
+BENCHMARK_SETTINGS = ['parts_per_scooter', 'chunk_size', 'output_options']
+
+
+def peak_rss_mb():
+    """
+    :return: peak resident set size of this process, in MiB; None where unavailable (e.g. Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, KiB on Linux
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def generate_scooter_graph(number_of_scooters, number_of_parts_per_scooter, chunk_size=lambda_function.DATAGEN_CHUNK_SIZE, output_options=None):
+    """
+    Streams the dataset to a temporary directory, deleted afterwards; same seed for every run.
+
+    :return: dict with the number of vertices and edges written, and the bytes written
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        dataset_counts = lambda_function.stream_scooter_dataset(number_of_scooters, number_of_parts_per_scooter, None, None, False,
+                                                                chunk_size=chunk_size, output_dir=output_dir, seed=0, output_options=output_options)
+
+    return {'vertices': dataset_counts['vertices'], 'edges': dataset_counts['edges'], 'bytes': sum(file['bytes'] for file in dataset_counts['files'])}
+
+
+def benchmark_tier(tier, number_of_parts_per_scooter=10, repeat=1, chunk_size=lambda_function.DATAGEN_CHUNK_SIZE, output_options=None):
+    """
+    Runs one tier; to run in a fresh process, for peak RSS to be the tier's own. See run_benchmarks
+    :param tier: tier name; see BENCHMARK_TIERS
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param repeat: number of timed runs; the fastest one is kept
+    :param chunk_size: how many scooters are generated at a time
+    :param output_options: optional dict with the output format, compression, etc.; see lambda_function.DEFAULT_OUTPUT_OPTIONS
+
+    :return: dict with the tier's metrics
+    """
+    number_of_scooters = BENCHMARK_TIERS[tier]
+    durations = []
+
+    for _ in range(max(int(repeat), 1)):
+        start_time = time.perf_counter()
+        counts = generate_scooter_graph(number_of_scooters, number_of_parts_per_scooter, chunk_size, output_options)
+        durations.append(time.perf_counter() - start_time)
+
+    rss_mb = peak_rss_mb()
+
+    # Traced separately: tracemalloc slows allocations down
+    tracemalloc.start()
+    try:
+        generate_scooter_graph(number_of_scooters, number_of_parts_per_scooter, chunk_size, output_options)
+        _, tracemalloc_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    wall_seconds = min(durations)
+    vertices = counts['vertices']
+
+    return {
+        'scooters': number_of_scooters,
+        'parts_per_scooter': int(number_of_parts_per_scooter),
+        'chunk_size': int(chunk_size),
+        'output_options': dict(lambda_function.DEFAULT_OUTPUT_OPTIONS, **(output_options or {})),
+        'vertices': int(vertices),
+        'edges': int(counts['edges']),
+        'output_mb': round(counts['bytes'] / (1024 * 1024), 1),
+        'wall_seconds': round(wall_seconds, 4),
+        'vertices_per_second': round(vertices / wall_seconds, 1),
+        'peak_rss_mb': round(rss_mb, 1) if rss_mb is not None else None,
+        'tracemalloc_peak_mb': round(tracemalloc_peak / (1024 * 1024), 1)
+        }
+
+
+def run_benchmarks(tiers, number_of_parts_per_scooter=10, repeat=1, chunk_size=lambda_function.DATAGEN_CHUNK_SIZE, output_options=None):
+    """
+    :param tiers: list of tier names; see BENCHMARK_TIERS
+    :param chunk_size: how many scooters are generated at a time
+    :param output_options: optional dict; see lambda_function.DEFAULT_OUTPUT_OPTIONS
+
+    :return: dict of tier -> metrics
+    """
+    results = {}
+
+    for tier in tiers:
+        # One process per tier, one at a time: tiers do not compete for CPU or memory
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[tier] = executor.submit(benchmark_tier, tier, number_of_parts_per_scooter, repeat, chunk_size, output_options).result()
+
+        print('{}: {}'.format(tier, json.dumps(results[tier])))
+
+    return results
+
+
+def compare_to_baseline(results, baseline, max_regression=DEFAULT_MAX_REGRESSION):
+    """
+    :param results: dict of tier -> metrics; see run_benchmarks
+    :param baseline: dict of tier -> metrics, from a previous run
+    :param max_regression: max relative drop of throughput, or growth of memory; e.g. 0.2 for 20%
+
+    :return: list of regressions; e.g. ['100k: vertices_per_second 61234.0 vs. 80110.2 (-23.6%)']
+    """
+    regressions = []
+
+    for tier, metrics in results.items():
+        baseline_metrics = baseline.get(tier)
+
+        # Tiers run with other settings (e.g. another number of parts, or output format) are not comparable
+        if not baseline_metrics or any(baseline_metrics.get(setting) != metrics.get(setting) for setting in BENCHMARK_SETTINGS):
+            continue
+
+        for metric, higher_is_better in BENCHMARK_METRICS.items():
+            value, baseline_value = metrics.get(metric), baseline_metrics.get(metric)
+
+            if not value or not baseline_value:
+                continue
+
+            change = (value - baseline_value) / baseline_value
+            if (-change if higher_is_better else change) > max_regression:
+                regressions.append('{}: {} {} vs. {} ({:+.1%})'.format(tier, metric, value, baseline_value, change))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the scooters graph data generator, at fixed scale tiers.')
+    parser.add_argument('--tiers', nargs='+', choices=list(BENCHMARK_TIERS), default=DEFAULT_TIERS, help='scale tiers to run')
+    parser.add_argument('--parts', type=int, default=10, help='number of parts per scooter')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per tier; the fastest one is kept')
+    parser.add_argument('--chunk-size', type=int, default=lambda_function.DATAGEN_CHUNK_SIZE, help='scooters generated at a time')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv', help='csv (Neptune bulk loader) or parquet (analytics)')
+    parser.add_argument('--compression', default=None, help='CSV: gzip or none (default); Parquet: snappy (default), zstd, gzip or none')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE_NAME, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to the baseline file, instead of comparing')
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION, help='max relative regression; e.g. 0.2 for 20%%')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.tiers, args.parts, args.repeat, args.chunk_size, {'format': args.output_format, 'compression': args.compression})
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if args.save_baseline:
+        # Tiers not run this time are kept
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=4)
+
+        print('OK: baseline written to {}'.format(args.baseline))
+        return
+
+    if not baseline:
+        print('No baseline at {}; record one with --save-baseline'.format(args.baseline))
+        return
+
+    regressions = compare_to_baseline(results, baseline, args.max_regression)
+
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression))
+
+    if regressions:
+        sys.exit(1)
+
+    print('OK: no regression past {:.0%}'.format(args.max_regression))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+import lambda_function
+from datagen_profiler import RunProfiler
+
+"""
+Local (offline) entry point for the Graph data generator; e.g. to create large seed datasets on a build box.
+The scooters are split across a pool of processes, i.e. one shard per worker. Every chunk of scooters draws from
+its own RNG stream, keyed by the seed and the chunk's first scooter; see generate_scooter_chunks.
+
+    Usage (from this directory):
+    $ python datagen_local.py --vehicles 1000000 --parts 10 --workers 8 --output-dir ./data
+
+    Output: vertices-<shard>.csv and edges-<shard>.csv files (same schema as the Lambda function), plus a manifest.json.
+    Use --merge to concatenate them into a single vertices.csv and edges.csv instead (plain CSV only); the per-shard
+    files are then deleted, so that bulk-loading the output directory loads every row once.
+    Use --profile to write cProfile and tracemalloc reports of every worker, under <output-dir>/_profile/.
+
+    Use --delta to grow the dataset at --output-dir instead, per its manifest.json; e.g. 1% more scooters, and new
+    events for the existing ones, under <output-dir>/delta-<generation>/. See lambda_function.stream_scooter_delta
+    $ python datagen_local.py --delta --new-vehicles 10000 --output-dir ./data
+"""
+
+MANIFEST_FILE_NAME = lambda_function.DATASET_MANIFEST_FILE_NAME
+
+
+def generate_local_shard(shard_id, shard_count, number_of_scooters, number_of_parts_per_scooter, output_dir, chunk_size, seed, asset_pools=None, output_options=None, profile=False):
+    """
+    Worker: generates and writes one shard of the dataset, to local part files.
+    :param seed: dataset seed; shared by all workers, for their IDs not to collide
+    :param profile: boolean flag to profile the shard; see datagen_profiler.py
+
+    :return: dict with this shard's counts and files
+    """
+    shard_start, shard_scooters = lambda_function.shard_scooter_range(number_of_scooters, shard_count, shard_id)
+
+    if profile:
+        with RunProfiler() as profiler:
+            dataset_counts = generate_local_shard(shard_id, shard_count, number_of_scooters, number_of_parts_per_scooter, output_dir, chunk_size, seed, asset_pools, output_options)
+
+        dataset_counts['profile'] = profiler.write('datagen-shard-{:05d}'.format(shard_id), output_dir=output_dir)
+        return dataset_counts
+
+    dataset_counts = lambda_function.stream_scooter_dataset(number_of_scooters=shard_scooters,
+                                                            number_of_parts_per_scooter=number_of_parts_per_scooter,
+                                                            s3_bucket_name=None,
+                                                            s3_prefix=None,
+                                                            write_to_s3=False,
+                                                            chunk_size=chunk_size,
+                                                            shard_id=shard_id,
+                                                            output_dir=output_dir,
+                                                            seed=seed,
+                                                            first_scooter_number=shard_start,
+                                                            asset_pools=asset_pools,
+                                                            output_options=output_options)
+    dataset_counts.update({'shard_id': shard_id, 'scooters': shard_scooters})
+
+    return dataset_counts
+
+
+def merge_dataset_files(file_paths, merged_file_path):
+    """
+    Concatenates CSV part files into a single file, keeping the header of the first one only.
+    :param file_paths: list of CSV files, in order
+    :param merged_file_path: target CSV file
+    """
+    with open(merged_file_path, 'wb') as merged_file:
+        for i, file_path in enumerate(file_paths):
+            with open(file_path, 'rb') as part_file:
+                header = part_file.readline()
+                if i == 0:
+                    merged_file.write(header)
+                shutil.copyfileobj(part_file, merged_file)
+
+
+def is_mergeable(output_options=None):
+    """
+    :param output_options: optional dict; see lambda_function.DEFAULT_OUTPUT_OPTIONS
+
+    :return: True if every shard writes a single, plain CSV file per dataset; i.e. files that --merge can concatenate
+    """
+    output_options = dict(lambda_function.DEFAULT_OUTPUT_OPTIONS, **(output_options or {}))
+
+    return output_options['format'] == 'csv' and output_options['compression'] in (None, 'none') \
+        and not (output_options['partition_by_label'] or output_options['max_rows_per_file'] or output_options['max_bytes_per_file'])
+
+
+def generate_local_dataset(number_of_scooters, number_of_parts_per_scooter, output_dir, workers=None, chunk_size=lambda_function.DATAGEN_CHUNK_SIZE, seed=None, merge=False, asset_pools=None, output_options=None, profile=False):
+    """
+    Generates the scooters dataset in parallel, with a process pool, and writes a manifest of all the generated files.
+    :param number_of_scooters: how many scooters we want to generate for this dummy data
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param output_dir: local directory for the part files and manifest
+    :param workers: number of worker processes; defaults to the number of CPUs, up to number_of_scooters
+    :param seed: optional seed, for a reproducible dataset; a random one is drawn (and saved in the manifest) if None
+    :param merge: boolean flag to merge all part files into vertices.csv and edges.csv, and delete them; see is_mergeable
+    :param asset_pools: optional dict to override the pool size of shared assets; e.g. {"manufacturer": 20}
+    :param output_options: optional dict with the output format, compression, etc.; see lambda_function.DEFAULT_OUTPUT_OPTIONS
+    :param profile: boolean flag to profile every worker; reports are written under output_dir/_profile/
+
+    :return: dict with the manifest
+    """
+    if merge and not is_mergeable(output_options):
+        raise ValueError('Only plain CSV files, one per shard, can be merged; got output options {}'.format(output_options))
+
+    # One shard per worker; no more than scooters, for every shard to write non-empty files
+    workers = lambda_function.effective_shard_count(number_of_scooters, workers or os.cpu_count() or 1)
+    seed = lambda_function.ScooterIdAllocator(seed).seed
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_local_shard, shard_id, workers, number_of_scooters, number_of_parts_per_scooter,
+                                   output_dir, chunk_size, seed, asset_pools, output_options, profile)
+                   for shard_id in range(workers)]
+        shards = [future.result() for future in futures]
+
+    # Seed, counters and pools, for deltas to carry on from this dataset; see generate_local_delta
+    manifest = lambda_function.dataset_manifest(seed, number_of_scooters, number_of_parts_per_scooter, asset_pools, output_options)
+    manifest.update({
+        'workers': workers,
+        'vertices': sum(shard['vertices'] for shard in shards),
+        'edges': sum(shard['edges'] for shard in shards),
+        'duration_seconds': round(time.time() - start_time, 3),
+        'shards': shards
+        })
+
+    if merge:
+        manifest['files'] = []
+
+        for dataset in ('vertices', 'edges'):
+            shard_file_paths = [os.path.join(output_dir, lambda_function.dataset_file_name(dataset, shard['shard_id'])) for shard in shards]
+            merged_file_path = os.path.join(output_dir, lambda_function.dataset_file_name(dataset))
+            merge_dataset_files(shard_file_paths, merged_file_path)
+
+            # Only the merged files are left, for a bulk load of output_dir not to load every row twice
+            for file_path in shard_file_paths:
+                os.remove(file_path)
+
+            manifest['files'].append({'path': merged_file_path, 'rows': manifest[dataset], 'bytes': os.path.getsize(merged_file_path)})
+
+        for shard in shards:
+            shard.pop('files')
+
+    with open(os.path.join(output_dir, MANIFEST_FILE_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+    return manifest
+
+
+def generate_local_delta(output_dir, number_of_new_scooters=None, chunk_size=lambda_function.DATAGEN_CHUNK_SIZE, asset_pools=None, event_rates=None):
+    """
+    Generates a delta on top of the dataset at output_dir, per its manifest; and updates the manifest.
+    - Deltas are a fraction of the dataset: one process, no shards.
+    :param output_dir: local directory of the dataset, with its manifest.json; see generate_local_dataset
+    :param number_of_new_scooters: how many scooters to add; defaults to 1% of the existing ones, if None
+    :param asset_pools: optional dict to grow the pool size of shared assets; e.g. {"warehouse": 20}
+    :param event_rates: optional dict to override the share of existing scooters with a new event; see lambda_function.DEFAULT_DELTA_EVENT_RATES
+
+    :return: dict with the updated manifest
+    """
+    start_time = time.time()
+    manifest = lambda_function.read_dataset_manifest(None, None, output_dir=output_dir)
+
+    delta_counts, manifest = lambda_function.stream_scooter_delta(manifest=manifest,
+                                                                  number_of_new_scooters=number_of_new_scooters,
+                                                                  s3_bucket_name=None,
+                                                                  s3_prefix=None,
+                                                                  write_to_s3=False,
+                                                                  chunk_size=chunk_size,
+                                                                  output_dir=output_dir,
+                                                                  asset_pools=asset_pools,
+                                                                  event_rates=event_rates)
+    delta_counts['duration_seconds'] = manifest['generations'][-1]['duration_seconds'] = round(time.time() - start_time, 3)
+
+    lambda_function.write_dataset_manifest(manifest, None, None, output_dir=output_dir)
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates the scooters graph dataset locally, in parallel.')
+    parser.add_argument('--vehicles', type=int, default=None, help='number of scooters')
+    parser.add_argument('--parts', type=int, default=10, help='number of parts per scooter')
+    parser.add_argument('--output-dir', default='./data', help='local directory for the generated files')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes; defaults to the number of CPUs')
+    parser.add_argument('--chunk-size', type=int, default=lambda_function.DATAGEN_CHUNK_SIZE, help='scooters generated at a time, per worker')
+    parser.add_argument('--seed', type=int, default=None, help='seed, for a reproducible dataset')
+    parser.add_argument('--merge', action='store_true', help='merge all part files into vertices.csv and edges.csv, deleting the part files; plain CSV only')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv', help='csv (Neptune bulk loader) or parquet (analytics)')
+    parser.add_argument('--compression', default=None, help='CSV: gzip or none (default); Parquet: snappy (default), zstd, gzip or none')
+    parser.add_argument('--partition-by-label', action='store_true', help='write one file per ~label, under <dataset>/label=<~label>/')
+    parser.add_argument('--max-rows-per-file', type=int, default=None, help='split the output into part files of up to N rows')
+    parser.add_argument('--max-bytes-per-file', type=int, default=None, help='split the output into part files of about N bytes')
+    parser.add_argument('--profile', action='store_true', help='write cProfile and tracemalloc reports of every worker, under <output-dir>/_profile/')
+    parser.add_argument('--asset-pools', type=json.loads, default=None, help='pool size of shared assets; e.g. \'{"manufacturer": 20}\'')
+    parser.add_argument('--delta', action='store_true', help='grow the dataset at --output-dir with a delta, instead of generating a new one')
+    parser.add_argument('--new-vehicles', type=int, default=None, help='with --delta, number of new scooters; defaults to 1%% of the existing ones')
+    parser.add_argument('--event-rates', type=json.loads, default=None, help='with --delta, share of scooters with a new event; e.g. \'{"fault": 0.02}\'')
+    args = parser.parse_args()
+
+    if args.delta:
+        manifest = generate_local_delta(output_dir=args.output_dir,
+                                        number_of_new_scooters=args.new_vehicles,
+                                        chunk_size=args.chunk_size,
+                                        asset_pools=args.asset_pools,
+                                        event_rates=args.event_rates)
+        delta_counts = manifest['generations'][-1]
+
+        print('OK: delta {} with {} new scooters, {} vertices and {} edges generated at {}, in {}s'.format(
+            delta_counts['dataset_generation'], delta_counts['new_scooters'], delta_counts['vertices'], delta_counts['edges'],
+            args.output_dir, delta_counts['duration_seconds']))
+        return
+
+    if args.vehicles is None:
+        parser.error('--vehicles is required, unless --delta')
+
+    output_options = {'format': args.output_format,
+                      'compression': args.compression,
+                      'partition_by_label': args.partition_by_label,
+                      'max_rows_per_file': args.max_rows_per_file,
+                      'max_bytes_per_file': args.max_bytes_per_file}
+
+    if args.merge and not is_mergeable(output_options):
+        parser.error('--merge only works with plain CSV files; i.e. without --output-format parquet, --compression gzip, --partition-by-label or --max-*-per-file')
+
+    manifest = generate_local_dataset(number_of_scooters=args.vehicles,
+                                      number_of_parts_per_scooter=args.parts,
+                                      output_dir=args.output_dir,
+                                      workers=args.workers,
+                                      chunk_size=args.chunk_size,
+                                      seed=args.seed,
+                                      merge=args.merge,
+                                      asset_pools=args.asset_pools,
+                                      profile=args.profile,
+                                      output_options=output_options)
+
+    print('OK: {} vertices and {} edges generated at {}, in {}s'.format(manifest['vertices'], manifest['edges'], args.output_dir, manifest['duration_seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+"""
+Per-stage metrics of the data generator (vertex generation, DataFrame build, edge derivation, writes), in CloudWatch
+Embedded Metric Format (EMF): one JSON log line per flush, which CloudWatch turns into metrics; no API calls.
+    - Every metric keeps all its values until the next flush (e.g. one per chunk); EMF takes up to 100 values per
+      metric, so a flush happens on its own when one metric reaches them, with the same dimensions and properties.
+    - On by default in Lambda (i.e. OS variable AWS_LAMBDA_FUNCTION_NAME is set), off (no-op) elsewhere; e.g. local
+      runs and tests. OS variable metrics_enabled (true/false) overrides it.
+"""
+
+METRICS_NAMESPACE = 'ScootersGraph/DataGenerator'
+# EMF limit of values per metric, per log line
+MAX_VALUES_PER_METRIC = 100
+
+
+class MetricsLogger:
+    """
+    Buffers metric values and writes them as EMF log lines.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE, enabled=None, emit=print):
+        """
+        :param namespace: CloudWatch namespace
+        :param enabled: boolean flag; defaults to OS variable metrics_enabled, or True in Lambda only
+        :param emit: function that writes a log line; e.g. print, which Lambda sends to CloudWatch Logs
+        """
+        if enabled is None:
+            enabled = os.environ.get('metrics_enabled', str('AWS_LAMBDA_FUNCTION_NAME' in os.environ)).lower() == 'true'
+
+        self.namespace = namespace
+        self.enabled = enabled
+        self.emit = emit
+
+        # name -> {'unit': ..., 'values': [...]}
+        self._metrics = {}
+        # Dimensions and properties of every log line, until the next explicit flush; see set_context
+        self._dimensions, self._properties = {}, {}
+        self._lock = threading.Lock()
+
+    def set_context(self, dimensions=None, **properties):
+        """
+        Sets the dimensions and properties of every log line until the next explicit flush (included); i.e. automatic
+        flushes land in the same CloudWatch series as the last one.
+        :param dimensions: optional dict of dimensions, besides FunctionName; e.g. {"path": "/getScooter"}
+        :param properties: optional fields of the log line, not metrics; e.g. shard_id
+        """
+        with self._lock:
+            self._dimensions, self._properties = dict(dimensions or {}), properties
+
+    def put_metric(self, name, value, unit='Count'):
+        """
+        :param name: metric name; e.g. vertices_write_rows
+        :param value: number
+        :param unit: CloudWatch unit; e.g. Count, Bytes, Milliseconds
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            metric = self._metrics.setdefault(name, {'unit': unit, 'values': []})
+            metric['values'].append(value)
+            full = len(metric['values']) >= MAX_VALUES_PER_METRIC
+
+        if full:
+            self._flush()
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Times the wrapped block, in milliseconds; e.g. with metrics.timer('edge_derivation_ms'): ...
+        :param name: metric name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put_metric(name, round((time.perf_counter() - started_at) * 1000, 3), 'Milliseconds')
+
+    def flush(self, dimensions=None, **properties):
+        """
+        Writes all buffered metrics as one EMF log line, and clears them and the context; see set_context.
+        :param dimensions: optional dict of dimensions, besides FunctionName and the context's ones
+        :param properties: optional fields of the log line, not metrics; e.g. shard_id, for CloudWatch Logs Insights
+        """
+        self._flush(dimensions, properties)
+
+        with self._lock:
+            self._dimensions, self._properties = {}, {}
+
+    def _flush(self, dimensions=None, properties=None):
+        """
+        Writes all buffered metrics as one EMF log line, with the context's dimensions and properties; keeps the context.
+        """
+        with self._lock:
+            metrics, self._metrics = self._metrics, {}
+            dimensions = dict(self._dimensions, **(dimensions or {}))
+            properties = dict(self._properties, **(properties or {}))
+
+        if not (self.enabled and metrics):
+            return
+
+        dimensions = dict({'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')}, **dimensions)
+        log_line = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': metric['unit']} for name, metric in metrics.items()]
+                    }]
+                }
+            }
+        log_line.update(properties)
+        log_line.update(dimensions)
+        log_line.update({name: metric['values'] if len(metric['values']) > 1 else metric['values'][0] for name, metric in metrics.items()})
+
+        self.emit(json.dumps(log_line, default=str))
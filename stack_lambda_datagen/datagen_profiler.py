@@ -0,0 +1,133 @@
+import io
+import marshal
+import os
+import time
+from datagen_writers import S3MultipartUpload, LocalFileUpload
+
+"""
+Opt-in profiling of a data generator run, to see where the time and memory went; e.g. a slow, or out-of-memory, run.
+    - cProfile for CPU time, tracemalloc for allocations (incl. NumPy arrays); both slow the run down, so they are
+      only imported and started when profiling is requested; i.e. zero overhead otherwise.
+    - Reports are written next to the generated data, under <s3_prefix>/_profile/ (or <output_dir>/_profile/ locally):
+      <run>.pstats, to load with pstats or snakeviz, and <run>-report.txt, with the top functions by cumulative time
+      and the top allocations by source line.
+    - Chunk data is freed by the end of a run: allocations are snapshotted at the highest profiler_checkpoint call
+      (e.g. once per chunk), if higher than at the end.
+"""
+
+PROFILE_FOLDER = '_profile'
+DEFAULT_TOP_N = 30
+# Stack frames kept per allocation; more frames, more overhead
+DEFAULT_TRACE_FRAMES = 1
+
+# Running profilers; see profiler_checkpoint
+_active_profilers = []
+
+
+def profiler_checkpoint():
+    """
+    Snapshots allocations for the running RunProfiler, if any, when traced memory is the highest so far; no-op otherwise.
+    """
+    if _active_profilers:
+        _active_profilers[-1].checkpoint()
+
+
+class RunProfiler:
+    """
+    Context manager that profiles the wrapped block with cProfile and tracemalloc; e.g.
+        with RunProfiler() as profiler:
+            stream_scooter_dataset(...)
+        profiler.write('shard-00003', s3_bucket_name, s3_prefix)
+    """
+
+    def __init__(self, top_n=DEFAULT_TOP_N, trace_frames=DEFAULT_TRACE_FRAMES):
+        """
+        :param top_n: number of functions, and allocation sites, in the text report
+        :param trace_frames: stack frames kept per allocation
+        """
+        self.top_n = int(top_n)
+        self.trace_frames = int(trace_frames)
+        self.duration_seconds = None
+
+        self._profiler = None
+        self._snapshot = None
+        self._snapshot_bytes = 0
+        self._peak_bytes = None
+        self._started_at = None
+
+    def __enter__(self):
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.start(self.trace_frames)
+        self._profiler = cProfile.Profile()
+        self._started_at = time.perf_counter()
+        self._profiler.enable()
+        _active_profilers.append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        import tracemalloc
+
+        self._profiler.disable()
+        _active_profilers.remove(self)
+        self.duration_seconds = time.perf_counter() - self._started_at
+        self.checkpoint()
+        _, self._peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    def checkpoint(self):
+        """
+        Snapshots allocations, if traced memory is the highest of all checkpoints so far.
+        """
+        import tracemalloc
+
+        traced_bytes, _ = tracemalloc.get_traced_memory()
+
+        if self._snapshot is None or traced_bytes > self._snapshot_bytes:
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_bytes = traced_bytes
+
+    def reports(self):
+        """
+        :return: dict of file suffix -> bytes; i.e. .pstats and -report.txt
+        """
+        import pstats
+
+        # Same format as cProfile.Profile.dump_stats
+        self._profiler.create_stats()
+        pstats_bytes = marshal.dumps(self._profiler.stats)
+
+        report = io.StringIO()
+        report.write('Duration: {:.3f}s; tracemalloc peak: {:.1f} MiB\n\n'.format(self.duration_seconds, self._peak_bytes / (1024 * 1024)))
+        report.write('Top {} functions, by cumulative time\n'.format(self.top_n))
+        pstats.Stats(self._profiler, stream=report).sort_stats('cumulative').print_stats(self.top_n)
+
+        report.write('\nTop {} allocations at the highest checkpoint ({:.1f} MiB traced), by source line\n'.format(self.top_n, self._snapshot_bytes / (1024 * 1024)))
+        for statistic in self._snapshot.statistics('lineno')[:self.top_n]:
+            report.write('{}\n'.format(statistic))
+
+        return {'.pstats': pstats_bytes, '-report.txt': report.getvalue().encode('utf-8')}
+
+    def write(self, run_name, s3_bucket_name=None, s3_prefix=None, output_dir=None, s3_client=None):
+        """
+        Writes the reports under the _profile folder; in S3, or in a local directory.
+        :param run_name: report file name, without extension; e.g. datagen-shard-00003-20240101T120000
+        :param output_dir: optional local directory; if set, reports are written there instead of S3
+        :param s3_client: optional boto3 S3 client
+
+        :return: list of report paths
+        """
+        paths = []
+
+        for suffix, data in self.reports().items():
+            file_name = run_name + suffix
+            sink = LocalFileUpload(os.path.join(output_dir, PROFILE_FOLDER, file_name)) if output_dir \
+                else S3MultipartUpload(s3_bucket_name, '{}/{}/{}'.format(s3_prefix, PROFILE_FOLDER, file_name), s3_client=s3_client)
+
+            sink.write(data)
+            sink.close()
+            paths.append(sink.path)
+
+        return paths
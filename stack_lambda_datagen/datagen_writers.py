@@ -0,0 +1,440 @@
+import gzip
+import io
+import os
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+"""
+Streaming writers for the Graph data generator: chunks of vertices/edges are written as they are generated,
+so memory stays flat no matter how many scooters are requested.
+    - Sinks (S3MultipartUpload, LocalFileUpload) take bytes, and write them to S3 or to a local file.
+    - Dataset writers (CsvDatasetWriter, ParquetDatasetWriter) encode pandas dataframes into a sink.
+    - PartitionedDatasetWriter splits the dataframes by ~label, into one dataset writer per label.
+    - RollingDatasetWriter starts a new part file every max_rows_per_file rows, or max_bytes_per_file bytes.
+"""
+
+# Amazon S3 multipart uploads require parts of at least 5 MiB, except for the last one
+S3_MIN_PART_SIZE_BYTES = 5 * 1024 * 1024
+S3_DEFAULT_PART_SIZE_BYTES = 16 * 1024 * 1024
+
+# Supported output formats. CSV is the Neptune bulk loader format; Parquet is for analytics (e.g. Athena, pandas)
+OUTPUT_FORMATS = ['csv', 'parquet']
+PARQUET_COMPRESSIONS = ['snappy', 'zstd', 'gzip', 'none']
+# Neptune bulk loader accepts gzip CSV files, one CSV per archive
+CSV_COMPRESSIONS = ['gzip', 'none']
+# zlib's default level; level 9 (gzip module default) is ~3x slower, for a few % smaller files
+GZIP_COMPRESS_LEVEL = 6
+
+
+def get_s3_client():
+    """
+    boto3 S3 client. Set the s3_endpoint_url OS variable to use a local S3 stand-in instead; e.g. MinIO or moto_server
+    """
+    return boto3.client('s3', endpoint_url=os.environ.get('s3_endpoint_url') or None)
+
+
+class S3MultipartUpload:
+    """
+    Writable, file-like sink to a single Amazon S3 object, via a multipart upload.
+    - Buffered data is uploaded as a new part, every time it reaches part_size_bytes.
+    - Small files (i.e. a single part) are written with a plain PutObject call.
+    """
+
+    def __init__(self, s3_bucket_name, s3_key, part_size_bytes=S3_DEFAULT_PART_SIZE_BYTES, s3_client=None):
+        """
+        :param s3_bucket_name: target S3 bucket
+        :param s3_key: target S3 key; e.g. scooters-graph-demo/neptune/data/vertices.csv
+        :param part_size_bytes: size of every uploaded part; min 5 MiB
+        :param s3_client: optional boto3 S3 client
+        """
+        self.s3_bucket_name = s3_bucket_name
+        self.s3_key = s3_key
+        self.part_size_bytes = max(int(part_size_bytes), S3_MIN_PART_SIZE_BYTES)
+        self.s3_client = s3_client if s3_client is not None else get_s3_client()
+        self.bytes_written = 0
+        self.closed = False
+
+        self._buffer = io.BytesIO()
+        self._upload_id = None
+        self._parts = []
+
+    @property
+    def path(self):
+        return 's3://{}/{}'.format(self.s3_bucket_name, self.s3_key)
+
+    def write(self, data):
+        self._buffer.write(data)
+        self.bytes_written += len(data)
+
+        if self._buffer.tell() >= self.part_size_bytes:
+            self._upload_part()
+
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Uploads any buffered data and completes the multipart upload.
+        """
+        if self.closed:
+            return
+
+        if self._upload_id is None:
+            # Single part: no need for a multipart upload
+            self.s3_client.put_object(Bucket=self.s3_bucket_name, Key=self.s3_key, Body=self._buffer.getvalue())
+
+        else:
+            if self._buffer.tell() > 0:
+                self._upload_part()
+
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.s3_bucket_name,
+                Key=self.s3_key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts}
+            )
+
+        self._buffer = io.BytesIO()
+        self.closed = True
+
+    def abort(self):
+        """
+        Aborts the multipart upload, if any, so no orphan parts are kept (and billed) in S3.
+        """
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.s3_bucket_name, Key=self.s3_key, UploadId=self._upload_id)
+            self._upload_id = None
+
+        self._buffer = io.BytesIO()
+        self.closed = True
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.s3_bucket_name, Key=self.s3_key)
+            self._upload_id = response['UploadId']
+
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.s3_bucket_name,
+            Key=self.s3_key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=self._buffer.getvalue()
+        )
+
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self._buffer = io.BytesIO()
+
+
+class LocalFileUpload:
+    """
+    Writable, file-like sink to a local file; same interface as S3MultipartUpload, for local runs.
+    """
+
+    def __init__(self, file_path):
+        """
+        :param file_path: target file; parent directories are created if needed
+        """
+        self.file_path = file_path
+        self.bytes_written = 0
+        self.closed = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self._file = open(file_path, 'wb')
+
+    @property
+    def path(self):
+        return self.file_path
+
+    def write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+        self.closed = True
+
+    def abort(self):
+        """
+        Closes and removes the (incomplete) file.
+        """
+        self._file.close()
+        os.remove(self.file_path)
+        self.closed = True
+
+
+class CsvDatasetWriter:
+    """
+    Streams pandas dataframes, as a single CSV file, into a sink. The CSV header is written once, with the first chunk.
+    - With gzip compression, bytes_written is the compressed size, as uploaded.
+    """
+
+    def __init__(self, sink, compression='none'):
+        """
+        :param sink: S3MultipartUpload or LocalFileUpload
+        :param compression: gzip or none
+        """
+        if compression not in CSV_COMPRESSIONS:
+            raise ValueError('CSV compression must be one of {}, got {}'.format(CSV_COMPRESSIONS, compression))
+
+        self.sink = sink
+        self.compression = compression
+        self.rows_written = 0
+        self._write_header = True
+        self._stream = gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=GZIP_COMPRESS_LEVEL) if compression == 'gzip' else sink
+
+    @property
+    def path(self):
+        return self.sink.path
+
+    @property
+    def bytes_written(self):
+        return self.sink.bytes_written
+
+    @property
+    def files(self):
+        return [{'path': self.path, 'rows': self.rows_written, 'bytes': self.bytes_written}]
+
+    def write(self, df):
+        """
+        Appends a dataframe to the CSV file. All chunks must share the same columns.
+        :param df: pandas dataframe
+        """
+        self._stream.write(df.to_csv(header=self._write_header, index=False).encode('utf-8'))
+        self._write_header = False
+        self.rows_written += len(df.index)
+
+    def close(self):
+        if self._stream is not self.sink:
+            # Flushes the gzip trailer into the sink
+            self._stream.close()
+
+        self.sink.close()
+
+    def abort(self):
+        self.sink.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ParquetDatasetWriter:
+    """
+    Streams pandas dataframes, as a single Parquet file, into a sink; one row group per chunk.
+    - All columns are strings. The ~label column is dictionary-encoded, as it only has a few distinct values.
+    """
+
+    def __init__(self, sink, compression='snappy'):
+        """
+        :param sink: S3MultipartUpload or LocalFileUpload
+        :param compression: snappy, zstd, gzip or none
+        """
+        if compression not in PARQUET_COMPRESSIONS:
+            raise ValueError('Parquet compression must be one of {}, got {}'.format(PARQUET_COMPRESSIONS, compression))
+
+        self.sink = sink
+        self.compression = compression
+        self.rows_written = 0
+        self._parquet_writer = None
+
+    @property
+    def path(self):
+        return self.sink.path
+
+    @property
+    def bytes_written(self):
+        return self.sink.bytes_written
+
+    @property
+    def files(self):
+        return [{'path': self.path, 'rows': self.rows_written, 'bytes': self.bytes_written}]
+
+    def write(self, df):
+        """
+        Appends a dataframe to the Parquet file, as a new row group. All chunks must share the same columns.
+        :param df: pandas dataframe
+        """
+        schema = pa.schema([(column, pa.dictionary(pa.int32(), pa.string()) if column == '~label' else pa.string()) for column in df.columns])
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.sink, schema, compression=self.compression)
+
+        self._parquet_writer.write_table(table)
+        self.rows_written += len(df.index)
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+        self.sink.close()
+
+    def abort(self):
+        self.sink.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PartitionedDatasetWriter:
+    """
+    Splits every chunk by the value of a column (e.g. ~label), and streams each partition to its own writer.
+    - Writers are opened lazily, the first time a partition value shows up.
+    """
+
+    def __init__(self, open_partition_writer, partition_column='~label'):
+        """
+        :param open_partition_writer: function that takes a partition value and returns a new dataset writer
+        :param partition_column: column to partition by
+        """
+        self.open_partition_writer = open_partition_writer
+        self.partition_column = partition_column
+        self.writers = {}
+
+    @property
+    def rows_written(self):
+        return sum(writer.rows_written for writer in self.writers.values())
+
+    @property
+    def bytes_written(self):
+        return sum(writer.bytes_written for writer in self.writers.values())
+
+    @property
+    def files(self):
+        return [file for writer in self.writers.values() for file in writer.files]
+
+    def write(self, df):
+        """
+        Appends every partition of a dataframe to its own writer.
+        :param df: pandas dataframe
+        """
+        for partition_value, df_partition in df.groupby(self.partition_column, sort=False):
+            if partition_value not in self.writers:
+                self.writers[partition_value] = self.open_partition_writer(partition_value)
+
+            self.writers[partition_value].write(df_partition)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def abort(self):
+        for writer in self.writers.values():
+            writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class RollingDatasetWriter:
+    """
+    Streams pandas dataframes into a series of part files; a new part is started when the current one is full.
+    - Parts are numbered from 1 on; e.g. vertices-00001.csv.gz, vertices-00002.csv.gz, etc.
+    - max_rows_per_file is exact: chunks are split across parts if needed.
+    - max_bytes_per_file is checked after every chunk, so a part can exceed it by up to one (compressed) chunk.
+    """
+
+    def __init__(self, open_part_writer, max_rows_per_file=None, max_bytes_per_file=None):
+        """
+        :param open_part_writer: function that takes a part number (1, 2, ...) and returns a new dataset writer
+        :param max_rows_per_file: optional max number of rows per part
+        :param max_bytes_per_file: optional max size per part, in bytes
+        """
+        self.open_part_writer = open_part_writer
+        self.max_rows_per_file = int(max_rows_per_file) if max_rows_per_file else None
+        self.max_bytes_per_file = int(max_bytes_per_file) if max_bytes_per_file else None
+        self.writers = []
+
+    @property
+    def rows_written(self):
+        return sum(writer.rows_written for writer in self.writers)
+
+    @property
+    def bytes_written(self):
+        return sum(writer.bytes_written for writer in self.writers)
+
+    @property
+    def files(self):
+        return [file for writer in self.writers for file in writer.files]
+
+    def write(self, df):
+        """
+        Appends a dataframe to the current part, rolling over to new parts as they fill up.
+        :param df: pandas dataframe
+        """
+        while len(df.index) > 0:
+            writer = self._current_writer()
+            rows = len(df.index)
+
+            if self.max_rows_per_file:
+                rows = min(rows, self.max_rows_per_file - writer.rows_written)
+
+            writer.write(df.iloc[:rows])
+            df = df.iloc[rows:]
+
+    def close(self):
+        for writer in self.writers:
+            if not writer.sink.closed:
+                writer.close()
+
+    def abort(self):
+        for writer in self.writers:
+            if not writer.sink.closed:
+                writer.abort()
+
+    def _current_writer(self):
+        if self.writers:
+            writer = self.writers[-1]
+            rows_full = self.max_rows_per_file and writer.rows_written >= self.max_rows_per_file
+            bytes_full = self.max_bytes_per_file and writer.bytes_written >= self.max_bytes_per_file
+
+            if not (rows_full or bytes_full):
+                return writer
+
+            # Full parts are completed right away: their upload buffers are released
+            writer.close()
+
+        self.writers.append(self.open_part_writer(len(self.writers) + 1))
+
+        return self.writers[-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
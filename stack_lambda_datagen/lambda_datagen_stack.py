@@ -2,6 +2,8 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_lambda_python_alpha as _alambda,
     aws_s3 as s3,
+    aws_iam as iam,
+    aws_ssm as ssm,
     Stack, Fn, CfnOutput, Duration, Aws,
 )
 from constructs import Construct
@@ -14,10 +16,14 @@ class ScootersDataStack(Stack):
         # AWS-maintained layer. Do not Change account ID. See aws-sdk-pandas.readthedocs.io/en/stable/layers.html
         sdk_lambda_layer_arn = f"arn:aws:lambda:{Aws.REGION}:336392948345:layer:AWSSDKPandas-Python39:3"
         
+        # Explicit name, so the function's own ARN is known before it exists; see the self-invoke grant below
+        datagen_function_name = f"{construct_id}-datagen"
+
         # Create function, using SDK for Pandas, as a Lambda layer (aws-managed)
         lambda_fn = _alambda.PythonFunction(
             self,
             "lambda_fn",
+            function_name=datagen_function_name,
             entry="./stack_lambda_datagen/",
             runtime=_lambda.Runtime.PYTHON_3_9,
             index="lambda_function.py",
@@ -39,12 +45,29 @@ class ScootersDataStack(Stack):
         # Grant Lambda to read and write on new bucket:
         s3_bucket.grant_read_write(lambda_fn)
 
+        # Grant Lambda to invoke itself, for the sharded fan-out mode: the coordinator invokes one worker per shard.
+        # ARN built from the name, not lambda_fn.function_arn, for the role not to depend on the function (circular).
+        # Qualified ARNs too (:<version or alias>), as the coordinator invokes the ARN it was invoked with
+        datagen_function_arn = f"arn:aws:lambda:{Aws.REGION}:{Aws.ACCOUNT_ID}:function:{datagen_function_name}"
+        lambda_fn.add_to_role_policy(iam.PolicyStatement(
+            actions=["lambda:InvokeFunction"],
+            resources=[datagen_function_arn, f"{datagen_function_arn}:*"]
+            ))
+
+        # Fetch dataset generation (see S3 stack), and grant Lambda to bump it once a run is written: the query Lambda
+        # no longer serves cached results of the previous dataset
+        dataset_generation = ssm.StringParameter.from_string_parameter_attributes(self, "DatasetGeneration",
+                                                                                  parameter_name=Fn.import_value("dataset-generation-parameter"),
+                                                                                  simple_name=True)
+        dataset_generation.grant_write(lambda_fn)
+
         # Add OS default vars
         input_lambda_bucket = '{}'.format(s3_bucket.bucket_name)
         lambda_fn.add_environment(key='s3_bucket_name', value=input_lambda_bucket)
         lambda_fn.add_environment(key='s3_prefix', value=input_metadata['s3_prefix_scooters_data_loc'])
         lambda_fn.add_environment(key='datagen_num_of_vehicles', value=input_metadata['lambda_datagen_num_vehicles'])
         lambda_fn.add_environment(key='datagen_num_of_parts_per_vehicle', value=input_metadata['lambda_datagen_num_parts'])
+        lambda_fn.add_environment(key='dataset_generation_parameter', value=dataset_generation.parameter_name)
 
         """
         @ Output begin
@@ -1,22 +1,71 @@
 import awswrangler as wr
+import itertools
 import os
+import numpy as np
 import pandas as pd
 import random
 import string
+import time
 import traceback
 import json
 import uuid
+import boto3
 from anytree import Node, RenderTree
+from datagen_writers import (
+    OUTPUT_FORMATS, S3_DEFAULT_PART_SIZE_BYTES, S3_MIN_PART_SIZE_BYTES,
+    S3MultipartUpload, LocalFileUpload, CsvDatasetWriter, ParquetDatasetWriter, PartitionedDatasetWriter, RollingDatasetWriter,
+    get_s3_client,
+)
+from datagen_metrics import MetricsLogger
+from datagen_profiler import RunProfiler, profiler_checkpoint
 
 """
-Important:  This Lambda function is not intended for production environments, nor for high volumes; 
-            i.e. Millions of data points. It's just for demo-purposes.
+Important:  This Lambda function is not intended for production environments. It's just for demo-purposes.
 
     Volume and performance estimate (this fn can be executed in parallel, if required)
-    - For 100 scooters and 5 parts each, duration = ~0.5s. These params are defined in our CDK/app.py project
-    - For 10,000 scooters and 10 parts each, duration = ~18s. This generates ~360,000 connected nodes, incl. scooters, parts, manufacturers, faults, etc. 
+    - Vertices are drawn in batches with NumPy (see generate_scooter_batch), instead of one AnyTree Node per vertex.
+    - For 10,000 scooters and 10 parts each, generation = ~0.4s. This generates ~360,000 connected nodes, incl. scooters, parts, manufacturers, faults, etc. 
+    - For 275,000 scooters and 10 parts each (~10M vertices), generation = ~10s; CSV serialization to S3 takes most of the run.
+    - When show_tree_on_screen is set (i.e. small, local tests), the whole dataset is generated in memory, with the same
+      batch generator, and every scooter's hierarchy tree is printed with AnyTree (see print_scooter_trees).
+    - The Lambda handler generates and streams the dataset in chunks of scooters (see stream_scooter_dataset); memory stays flat.
+    - For larger datasets, invoke it with {"shard_count": K}: it then fans out K parallel invocations (see invoke_scooter_shards).
+    - To grow an existing dataset, invoke it with {"incremental": true}: only the new scooters and events are generated,
+      as delta files on top of the previous run (see stream_scooter_delta); i.e. the cost scales with the delta.
+    - Per-stage timings, row counts and bytes are logged as CloudWatch EMF metrics, once per run; see datagen_metrics.py.
 """
 
+# Per-stage metrics, flushed at the end of every run; no-op outside Lambda, unless OS variable metrics_enabled is set
+metrics = MetricsLogger()
+
+# How many scooters are generated, and kept in memory, at a time. ~10,000 scooters with 10 parts each = ~360,000 vertices
+DATAGEN_CHUNK_SIZE = 10000
+
+# Output options of the streaming pipeline. Event key output_options overrides any of them; e.g. {"format": "parquet"}
+# - format: csv (Neptune bulk loader) or parquet (analytics; e.g. Athena, pandas)
+# - compression: CSV, gzip or none (default); Parquet, snappy (default), zstd, gzip or none
+# - partition_by_label: boolean flag to write one file per ~label, under <dataset>/label=<~label>/
+# - max_rows_per_file, max_bytes_per_file: optional limits; files are then split into numbered parts, e.g. vertices-00001.csv.gz.
+#   The Neptune bulk loader loads the files of a prefix in parallel.
+DEFAULT_OUTPUT_OPTIONS = {'format': 'csv', 'compression': None, 'partition_by_label': False, 'max_rows_per_file': None, 'max_bytes_per_file': None}
+
+# Scooter parts; a part vertex is named part_<part>-<suffix>
+SCOOTER_PARTS = ['front_tyre','back_tyre','axle','transmission','suspension','battery','steering','catalytic_converter','ignition_pipe','brake']
+PART_ID_PREFIXES = np.array(['part_{}-'.format(part).encode() for part in SCOOTER_PARTS])
+PART_LABELS = np.array(['part_{}'.format(part) for part in SCOOTER_PARTS], dtype=object)
+
+# Characters used to randomize asset names
+ASSET_SUFFIX_CHARS = string.ascii_uppercase + string.digits
+
+# Shared vertices. Their odds are if/elif/else chains of randomize_chances() checks; see cascade_probabilities
+WEATHER_VERTICES = ['weather_sunny-ws1', 'weather_cloudy-wc3', 'weather_rainy-wr2']
+WEATHER_ODDS = [3, 2]
+PAYMENT_METHOD_VERTICES = ['payment_method-credit-card-visa', 'payment_method-credit-card-mastercard', 'payment_method-google-pay', 'payment_method-apple-pay']
+PAYMENT_METHOD_ODDS = [4, 3, 3]
+FLEET_OWNER_VERTICES = ['fleet_owner-pegasus-scooters', 'fleet_owner-pineapple-scooters', 'fleet_owner-evfast-scooters']
+FLEET_OWNER_ODDS = [4, 3]
+
+
 def randomize_scooter_asset(asset, num_chars=6):
     """
     To make this dummy dataset more realistic, we randomize all scooter asset names
@@ -26,12 +75,10 @@ def randomize_scooter_asset(asset, num_chars=6):
     """
 
     # Generate random suffix
-    random_string = ''.join(random.choices(string.ascii_uppercase + string.digits, k=num_chars))
+    random_string = ''.join(random.choices(ASSET_SUFFIX_CHARS, k=num_chars))
 
     if asset == 'part':
-        # Define some scooter parts
-        parts = ['front_tyre','back_tyre','axle','transmission','suspension','battery','steering','catalytic_converter','ignition_pipe','brake']
-        random_asset = '{}_{}-{}'.format(asset, random.choice(parts), random_string)
+        random_asset = '{}_{}-{}'.format(asset, random.choice(SCOOTER_PARTS), random_string)
 
     else:
         random_asset = '{}-{}'.format(asset, random_string)
@@ -56,114 +103,454 @@ def randomize_chances(odds_one_to_many=4):
     return random.choice(odds_picker)
 
 
-def generate_scooter_vertices(number_of_scooters, number_of_parts_per_scooter, s3_bucket_name, s3_prefix, write_to_s3, show_tree_on_screen):
+def cascade_probabilities(odds_chain):
     """
-    Generates, and optionally writes, scooters Vertices dataset in Gremlin for Neptune format.
-        @Note: This code is not optimized for large volumes of data, e.g. millions. 
+    Converts a chain of randomize_chances() checks into the probability of each branch; 
+    i.e. if randomize_chances(odds_chain[0]) == 1, elif randomize_chances(odds_chain[1]) == 1, ..., else
+    :param odds_chain: list of odds_one_to_many, one per if/elif check
+
+    :return: list of probabilities, one per if/elif check, plus a last one for the else branch
+    """
+    probabilities = []
+    remaining = 1.0
+
+    for odds_one_to_many in odds_chain:
+        branch_probability = remaining / (odds_one_to_many + 1)
+        probabilities.append(branch_probability)
+        remaining -= branch_probability
+
+    probabilities.append(remaining)
+
+    return probabilities
+
+
+# Scooter's location branches. First branch is in_transit_journey with weather, last one without weather
+LOCATION_ASSETS = ['in_transit_journey', 'warehouse', 'parking_station', 'maintenance_center', 'in_transit_journey']
+LOCATION_PROBABILITIES = [3 / 4] + [p / 4 for p in cascade_probabilities([10, 2, 10])]
+
+# Shared assets, drawn from a fixed-size pool instead of random suffixes: {asset: pool size}
+SHARED_ASSET_POOLS = {'manufacturer': 100, 'warehouse': 10, 'parking_station': 500, 'maintenance_center': 50}
+
+# Labels of shared vertices; i.e. written once per dataset, and referenced by edges only
+SHARED_VERTEX_LABELS = sorted(set([name.split('-', 1)[0] for name in WEATHER_VERTICES + PAYMENT_METHOD_VERTICES + FLEET_OWNER_VERTICES]) | set(SHARED_ASSET_POOLS))
+
+# Length of the ID suffix of unique assets; i.e. up to 36^6 (~2.1B) IDs per asset
+ASSET_ID_NUM_CHARS = 6
+
+# Incremental (delta) generation, on top of a previous run; see stream_scooter_delta
+# - The manifest of a dataset, next to its files, keeps what the next delta needs: seed, counters and shared pools.
+# - A delta's files are written under <s3_prefix>/delta-<generation>/; e.g. delta-00001/vertices.csv
+DATASET_MANIFEST_FILE_NAME = 'manifest.json'
+DELTA_FOLDER_NAME = 'delta-{:05d}'
+# Share of the existing scooters that get a new event, per delta. Event key event_rates overrides any of them
+DEFAULT_DELTA_EVENT_RATES = {'fault': 0.01, 'incident': 0.005, 'in_transit_journey': 0.05}
+# Fleet growth per delta, if the number of new scooters is not set; i.e. 1%
+DEFAULT_DELTA_GROWTH = 0.01
+# Events of a delta are numbered from here on, by their own counter; the base dataset numbers them after their scooter
+DELTA_EVENT_FIRST_NUMBER = len(ASSET_SUFFIX_CHARS) ** ASSET_ID_NUM_CHARS // 2
+# Keys of a manifest that describe a single run (e.g. set by datagen_local), not the dataset; kept per generation, see stream_scooter_delta
+DATASET_RUN_KEYS = ('workers', 'vertices', 'edges', 'duration_seconds', 'shards', 'files')
+
+
+def encode_asset_numbers(numbers, num_chars):
+    """
+    Encodes non-negative integers as fixed-width strings, using ASSET_SUFFIX_CHARS as digits (base 36)
+    :param numbers: numpy integer array
+    :param num_chars: number of digits
+
+    :return: numpy bytes array; e.g. b'AAAAAB' for number 1
+    """
+    alphabet = np.frombuffer(ASSET_SUFFIX_CHARS.encode(), dtype='S1')
+    powers = len(alphabet) ** np.arange(num_chars - 1, -1, -1, dtype=np.int64)
+    digits = (np.asarray(numbers, dtype=np.int64)[:, None] // powers) % len(alphabet)
+
+    return np.ascontiguousarray(alphabet[digits]).view('S{}'.format(num_chars)).ravel()
+
+
+class ScooterIdAllocator:
+    """
+    Allocates collision-free, reproducible vertex IDs.
+    - Unique assets (scooters, parts, drivers, faults, etc.) get their ID from a global number; e.g. the 3rd part of
+      scooter #42 is part #42*parts_per_scooter+2. Numbers are scrambled with a seeded bijection over all the suffixes,
+      so IDs look random, yet never collide across chunks, shards or workers that share the same seed.
+    - ASSET_ID_NUM_CHARS must be even, i.e. the two halves of a Feistel network.
+    - Shared assets (manufacturers, warehouses, etc.) are drawn from a fixed-size pool; see SHARED_ASSET_POOLS.
+      Together with weather, payment methods and fleet owners, they are the registry of shared vertices; see shared_vertices.
+    """
+
+    def __init__(self, seed=None, asset_pools=None):
+        """
+        :param seed: integer seed; a random one is drawn if None. Use the same seed in all shards of a dataset.
+        :param asset_pools: optional dict to override the pool size of shared assets; e.g. {"manufacturer": 20}
+        """
+        self.seed = int(seed) if seed is not None else int(np.random.SeedSequence().entropy)
+        self.asset_pools = dict(SHARED_ASSET_POOLS, **(asset_pools or {}))
+        self.max_asset_number = len(ASSET_SUFFIX_CHARS) ** ASSET_ID_NUM_CHARS
+
+        # Round keys of the Feistel network that scrambles asset numbers; see scramble_asset_numbers
+        self._round_keys = [int(key) for key in np.random.default_rng(self.seed).integers(0, 2 ** 32, size=4)]
+        self._pools = {}
+
+    def scramble_asset_numbers(self, numbers):
+        """
+        Seeded bijection over [0, 36^N): a balanced Feistel network, over the two halves of the base-36 digits.
+        - Every round is reversible whatever the round function is, so different numbers never get the same ID.
+        :param numbers: numpy int64 array
+
+        :return: numpy int64 array with scrambled numbers
+        """
+        half = len(ASSET_SUFFIX_CHARS) ** (ASSET_ID_NUM_CHARS // 2)
+        left, right = numbers // half, numbers % half
+
+        for round_key in self._round_keys:
+            # Round function: multiplicative hash of the right half; uint64 arithmetic wraps on purpose
+            round_hash = ((right.astype(np.uint64) ^ np.uint64(round_key)) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+            left, right = right, (left + (round_hash % np.uint64(half)).astype(np.int64)) % half
+
+        return left * half + right
+
+    def asset_ids(self, asset, numbers, prefixes=None):
+        """
+        :param asset: unique asset; e.g. scooter
+        :param numbers: numpy integer array with the global number of every asset
+        :param prefixes: optional numpy bytes array with one name prefix per asset; e.g. part_axle-
+
+        :return: numpy object array with asset IDs; e.g. scooter-7QK2ZD
+        """
+        numbers = np.asarray(numbers, dtype=np.int64)
+        if len(numbers) and numbers.max() >= self.max_asset_number:
+            raise ValueError('Too many {} vertices: only {} unique IDs are available per asset'.format(asset, self.max_asset_number))
+
+        if prefixes is None:
+            prefixes = '{}-'.format(asset).encode()
+
+        return np.char.add(prefixes, encode_asset_numbers(self.scramble_asset_numbers(numbers), ASSET_ID_NUM_CHARS)).astype(str).astype(object)
+
+    def part_types(self, part_numbers):
+        """
+        Part type of every part, derived from its global number (not drawn), so that later runs can find any part's ID;
+        e.g. the part a new fault is attached to, in a delta. See generate_scooter_events
+        :param part_numbers: numpy integer array
+
+        :return: numpy int64 array of indexes into SCOOTER_PARTS
+        """
+        return self.scramble_asset_numbers(np.asarray(part_numbers, dtype=np.int64)) % len(SCOOTER_PARTS)
+
+    def part_ids(self, part_numbers):
+        """
+        :param part_numbers: numpy integer array
+
+        :return: tuple with labels and IDs arrays; e.g. part_axle, part_axle-7QK2ZD
+        """
+        part_types = self.part_types(part_numbers)
+
+        return PART_LABELS[part_types], self.asset_ids('part', part_numbers, prefixes=PART_ID_PREFIXES[part_types])
+
+    def pool_size(self, asset):
+        return int(self.asset_pools[asset])
+
+    def shared_asset_ids(self, asset, choices):
+        """
+        :param asset: shared asset; e.g. manufacturer
+        :param choices: numpy integer array with the picked pool member, from 0 to pool_size-1
+
+        :return: numpy object array with asset IDs; e.g. manufacturer-0B
+        """
+        if asset not in self._pools:
+            num_chars = 1
+            while len(ASSET_SUFFIX_CHARS) ** num_chars < self.pool_size(asset):
+                num_chars += 1
+
+            pool_numbers = np.arange(self.pool_size(asset))
+            self._pools[asset] = np.char.add('{}-'.format(asset).encode(), encode_asset_numbers(pool_numbers, num_chars)).astype(str).astype(object)
+
+        return self._pools[asset][choices]
+
+    def shared_vertices(self, previous_pools=None):
+        """
+        Registry of shared vertices: every pool member, weather, payment method and fleet owner, once.
+        :param previous_pools: optional dict of asset -> pool size already written; e.g. by the base dataset of a delta.
+                               Only the new pool members are then returned.
+
+        :return: Pandas dataframe with Vertices in Gremlin Neptune format
+        """
+        if previous_pools is None:
+            vertex_blocks = [(asset, self.shared_asset_ids(asset, np.arange(self.pool_size(asset)))) for asset in sorted(self.asset_pools)]
+            vertex_blocks += [(name.split('-', 1)[0], np.array([name], dtype=object)) for name in WEATHER_VERTICES + PAYMENT_METHOD_VERTICES + FLEET_OWNER_VERTICES]
+        else:
+            vertex_blocks = [(asset, self.shared_asset_ids(asset, np.arange(int(previous_pools.get(asset, 0)), self.pool_size(asset)))) for asset in sorted(self.asset_pools)]
+
+        ids = np.concatenate([ids for _, ids in vertex_blocks])
+
+        return pd.DataFrame({
+            '~label': np.concatenate([np.full(len(ids), label, dtype=object) for label, ids in vertex_blocks]),
+            '~id': ids,
+            'parent_id': np.full(len(ids), 'None', dtype=object),
+            'name': ids
+            })
+
+
+def shared_vertex_block(vertex_names, choices, parent_ids):
+    """
+    Builds a block of constant-name vertices; e.g. weather, payment methods or fleet owners
+    :param vertex_names: list of vertex names to pick from
+    :param choices: numpy array with the index of the picked vertex name, per parent
+
+    :return: tuple with labels, ids and parent ids arrays
+    """
+    names = np.array(vertex_names, dtype=object)
+    labels = np.array([name.split('-', 1)[0] for name in vertex_names], dtype=object)
+
+    return labels[choices], names[choices], parent_ids
+
+
+def generate_scooter_batch(number_of_scooters, number_of_parts_per_scooter, rng=None, id_allocator=None, first_scooter_number=0):
+    """
+    Generates scooters Vertices for a whole batch of scooters, drawing every branch of the hierarchy as NumPy arrays.
+    - Same graph shape and probabilities as the original one-scooter-at-a-time generator (see cascade_probabilities),
+      without building one AnyTree Node per vertex.
     :param number_of_scooters: how many scooters we want to generate for this dummy data
     :param number_of_parts_per_scooter: how many parts per scooter
-    :param write_to_s3: boolean flag to write to s3
+    :param rng: optional numpy random Generator
+    :param id_allocator: optional ScooterIdAllocator; share it among batches of the same dataset
+    :param first_scooter_number: global number of the first scooter of this batch; see ScooterIdAllocator
+
+    :return: Pandas dataframe with Vertices in Gremlin Neptune format
+    """
+    generation_started_at = time.perf_counter()
+    rng = rng if rng is not None else np.random.default_rng()
+    id_allocator = id_allocator if id_allocator is not None else ScooterIdAllocator(seed=rng.integers(2 ** 63))
+    number_of_scooters = int(number_of_scooters)
+    number_of_parts_per_scooter = int(number_of_parts_per_scooter)
+    scooter_numbers = np.arange(first_scooter_number, first_scooter_number + number_of_scooters, dtype=np.int64)
+
+    # Blocks of vertices (label, ids, parent ids), one per asset type
+    vertex_blocks = []
+
+    # Begin: Scooters
+    scooters = id_allocator.asset_ids('scooter', scooter_numbers)
+    vertex_blocks.append(('scooter', scooters, np.full(number_of_scooters, 'None', dtype=object)))
+
+    # Begin: Scooters Incidents
+    incident_mask = rng.random(number_of_scooters) < 1 / 11
+    incidents = id_allocator.asset_ids('incident', scooter_numbers[incident_mask])
+    vertex_blocks.append(('incident', incidents, scooters[incident_mask]))
+    vertex_blocks.append(('legal_case', id_allocator.asset_ids('legal_case', scooter_numbers[incident_mask]), incidents))
+
+    # Begin: Scooters Parts, manufacturers and legal warranties
+    number_of_parts = number_of_scooters * number_of_parts_per_scooter
+    part_numbers = (scooter_numbers[:, None] * number_of_parts_per_scooter + np.arange(number_of_parts_per_scooter)).ravel()
+    part_labels, parts = id_allocator.part_ids(part_numbers)
+    vertex_blocks.append((part_labels, parts, np.repeat(scooters, number_of_parts_per_scooter)))
+    manufacturers = id_allocator.shared_asset_ids('manufacturer', rng.integers(0, id_allocator.pool_size('manufacturer'), size=number_of_parts))
+    vertex_blocks.append(('manufacturer', manufacturers, parts))
+    vertex_blocks.append(('legal_warranty', id_allocator.asset_ids('legal_warranty', part_numbers), parts))
+
+    # Begin: Scooter's Location
+    locations = rng.choice(len(LOCATION_ASSETS), size=number_of_scooters, p=LOCATION_PROBABILITIES)
+    in_transit_mask = (locations == 0) | (locations == len(LOCATION_ASSETS) - 1)
+    journeys = id_allocator.asset_ids('in_transit_journey', scooter_numbers[in_transit_mask])
+    vertex_blocks.append(('in_transit_journey', journeys, scooters[in_transit_mask]))
+
+    # Begin: Weather, only for the first in_transit_journey branch
+    weather_parents = journeys[locations[in_transit_mask] == 0]
+    weather = rng.choice(len(WEATHER_VERTICES), size=len(weather_parents), p=cascade_probabilities(WEATHER_ODDS))
+    vertex_blocks.append(shared_vertex_block(WEATHER_VERTICES, weather, weather_parents))
+
+    # Begin: less-likely locations
+    for location in range(1, len(LOCATION_ASSETS) - 1):
+        asset = LOCATION_ASSETS[location]
+        location_mask = locations == location
+        location_choices = rng.integers(0, id_allocator.pool_size(asset), size=int(location_mask.sum()))
+        vertex_blocks.append((asset, id_allocator.shared_asset_ids(asset, location_choices), scooters[location_mask]))
+
+    # Begin: Driver's payments
+    drivers = id_allocator.asset_ids('driver', scooter_numbers)
+    vertex_blocks.append(('driver', drivers, scooters))
+    payment_methods = rng.choice(len(PAYMENT_METHOD_VERTICES), size=number_of_scooters, p=cascade_probabilities(PAYMENT_METHOD_ODDS))
+    vertex_blocks.append(shared_vertex_block(PAYMENT_METHOD_VERTICES, payment_methods, drivers))
+
+    # Begin: Faulty parts. Faults are attached to the scooter's last part
+    if number_of_parts_per_scooter > 0:
+        last_parts = parts[number_of_parts_per_scooter - 1::number_of_parts_per_scooter]
+        fault_mask = rng.random(number_of_scooters) < 1 / 5
+        fault_numbers = scooter_numbers[fault_mask]
+        part_faults = id_allocator.asset_ids('fault', fault_numbers)
+        vertex_blocks.append(('fault', part_faults, last_parts[fault_mask]))
+        vertex_blocks.append(('warranty', id_allocator.asset_ids('warranty', fault_numbers), part_faults))
+
+        # From those with a fault, only some will have a claim
+        claim_mask = rng.random(len(part_faults)) < 1 / 5
+        vertex_blocks.append(('claim_fault', id_allocator.asset_ids('claim_fault', fault_numbers[claim_mask]), part_faults[claim_mask]))
+
+    # Begin: Fleet Owners
+    fleet_owners = rng.choice(len(FLEET_OWNER_VERTICES), size=number_of_scooters, p=cascade_probabilities(FLEET_OWNER_ODDS))
+    vertex_blocks.append(shared_vertex_block(FLEET_OWNER_VERTICES, fleet_owners, scooters))
+
+    metrics.put_metric('vertex_generation_ms', round((time.perf_counter() - generation_started_at) * 1000, 3), 'Milliseconds')
+    # All the vertex blocks are in memory, if profiling; no-op otherwise
+    profiler_checkpoint()
+
+    return build_vertex_dataframe(vertex_blocks)
+
+
+def build_vertex_dataframe(vertex_blocks):
+    """
+    Builds the Vertices dataframe out of blocks of vertices, one column at a time.
+    :param vertex_blocks: list of tuples with label (or labels array), ids and parent ids arrays; one per asset type
+
+    :return: Pandas dataframe with Vertices in Gremlin Neptune format
+    """
+    with metrics.timer('dataframe_build_ms'):
+        labels = [np.full(len(ids), label, dtype=object) if isinstance(label, str) else label for label, ids, _ in vertex_blocks]
+        ids = np.concatenate([ids for _, ids, _ in vertex_blocks])
+
+        df_scooters = pd.DataFrame({
+            '~label': np.concatenate(labels),
+            '~id': ids,
+            'parent_id': np.concatenate([parent_ids for _, _, parent_ids in vertex_blocks]),
+            'name': ids
+            })
+
+    metrics.put_metric('vertices_generated', len(df_scooters.index))
+
+    return df_scooters
+
+
+def generate_scooter_events(number_of_scooters, number_of_parts_per_scooter, event_counters, rng=None, id_allocator=None, first_scooter_number=0, event_rates=None):
+    """
+    Generates new events for a batch of existing scooters, in a delta: faults (with their warranty and, for some, a claim),
+    incidents (with their legal case) and in-transit journeys (with their weather).
+    - Events hang from existing vertices, found by their global number: the scooter, or its last part for faults.
+    - Event numbers are taken from event_counters, which are advanced in place; see DELTA_EVENT_FIRST_NUMBER
+    :param number_of_scooters: how many existing scooters in this batch
+    :param number_of_parts_per_scooter: how many parts per scooter, in the base dataset
+    :param event_counters: dict of event -> next event number; e.g. {"fault": 1088391168}
+    :param rng: optional numpy random Generator
+    :param id_allocator: ScooterIdAllocator with the dataset's seed
+    :param first_scooter_number: global number of the first scooter of this batch
+    :param event_rates: optional dict to override the share of scooters with a new event; see DEFAULT_DELTA_EVENT_RATES
 
     :return: Pandas dataframe with Vertices in Gremlin Neptune format
     """
-    # Placeholder array to save all generated data
-    all_scooters = []
+    rng = rng if rng is not None else np.random.default_rng()
+    event_rates = dict(DEFAULT_DELTA_EVENT_RATES, **(event_rates or {}))
+    number_of_parts_per_scooter = int(number_of_parts_per_scooter)
+    scooter_numbers = np.arange(first_scooter_number, first_scooter_number + int(number_of_scooters), dtype=np.int64)
+
+    def draw_events(event):
+        # Scooters with a new event (at most one each), and the numbers of the new events
+        event_scooter_numbers = np.sort(rng.choice(scooter_numbers, size=rng.binomial(len(scooter_numbers), event_rates[event]), replace=False))
+        first_event_number = int(event_counters[event])
+        event_counters[event] = first_event_number + len(event_scooter_numbers)
+
+        return event_scooter_numbers, np.arange(first_event_number, event_counters[event], dtype=np.int64)
+
+    # Blocks of vertices (label, ids, parent ids), one per asset type
+    vertex_blocks = []
+
+    # Begin: Faulty parts. As in generate_scooter_batch, faults are attached to the scooter's last part
+    if number_of_parts_per_scooter > 0:
+        fault_scooter_numbers, fault_numbers = draw_events('fault')
+        _, faulty_parts = id_allocator.part_ids(fault_scooter_numbers * number_of_parts_per_scooter + number_of_parts_per_scooter - 1)
+        part_faults = id_allocator.asset_ids('fault', fault_numbers)
+        vertex_blocks.append(('fault', part_faults, faulty_parts))
+        vertex_blocks.append(('warranty', id_allocator.asset_ids('warranty', fault_numbers), part_faults))
+
+        claim_mask = rng.random(len(part_faults)) < 1 / 5
+        vertex_blocks.append(('claim_fault', id_allocator.asset_ids('claim_fault', fault_numbers[claim_mask]), part_faults[claim_mask]))
+
+    # Begin: Scooters Incidents
+    incident_scooter_numbers, incident_numbers = draw_events('incident')
+    incidents = id_allocator.asset_ids('incident', incident_numbers)
+    vertex_blocks.append(('incident', incidents, id_allocator.asset_ids('scooter', incident_scooter_numbers)))
+    vertex_blocks.append(('legal_case', id_allocator.asset_ids('legal_case', incident_numbers), incidents))
+
+    # Begin: Journeys, with their weather
+    journey_scooter_numbers, journey_numbers = draw_events('in_transit_journey')
+    journeys = id_allocator.asset_ids('in_transit_journey', journey_numbers)
+    vertex_blocks.append(('in_transit_journey', journeys, id_allocator.asset_ids('scooter', journey_scooter_numbers)))
+    weather = rng.choice(len(WEATHER_VERTICES), size=len(journeys), p=cascade_probabilities(WEATHER_ODDS))
+    vertex_blocks.append(shared_vertex_block(WEATHER_VERTICES, weather, journeys))
+
+    return build_vertex_dataframe(vertex_blocks)
+
+
+def print_scooter_trees(input_df):
+    """
+    Prints the hierarchy tree of every scooter, with AnyTree; shared vertices (e.g. manufacturers) under each parent.
+    :param input_df: pandas dataframe with scooters vertices dataset, i.e. one row per parent reference
+    """
+    children = {}
+    for vertex_id, parent_id in zip(input_df['~id'], input_df['parent_id']):
+        children.setdefault(parent_id, []).append(vertex_id)
+
+    def add_children(node):
+        for child_id in children.get(node.name, []):
+            add_children(Node(child_id, parent=node))
+
+    for scooter in input_df.loc[input_df['~label'] == 'scooter', '~id']:
+        root = Node(scooter)
+        add_children(root)
+
+        # @ Example to show all assets, in a hierarchy tree format>
+        for pre, fill, node in RenderTree(root):
+            print("%s %s" % (pre, node.name))
+
+
+def generate_scooter_tree(number_of_parts_per_scooter, show_tree_on_screen, id_allocator=None, scooter_number=0):
+    """
+    Generates a single scooter hierarchy with the batch generator, i.e. the same IDs, shared asset pools and
+    probabilities as the streamed dataset: the same as scooter_number's rows of generate_scooter_chunks with
+    chunk_size=1, for the same seed. AnyTree Nodes are only built to show the hierarchy tree on screen.
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param show_tree_on_screen: boolean flag to print the hierarchy tree
+    :param id_allocator: optional ScooterIdAllocator, with the dataset's seed
+    :param scooter_number: global number of the scooter
+
+    :return: list of dicts with Vertices in Gremlin Neptune format
+    """
+    df_scooter = next(generate_scooter_chunks(1, number_of_parts_per_scooter, 1, id_allocator, scooter_number))
+
+    if show_tree_on_screen:
+        print_scooter_trees(df_scooter)
+
+    return df_scooter.to_dict('records')
 
+
+def generate_scooter_vertices(number_of_scooters, number_of_parts_per_scooter, s3_bucket_name, s3_prefix, write_to_s3, show_tree_on_screen, seed=None, asset_pools=None, chunk_size=DATAGEN_CHUNK_SIZE):
+    """
+    Generates, and optionally writes, scooters Vertices dataset in Gremlin for Neptune format.
+    :param number_of_scooters: how many scooters we want to generate for this dummy data
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param write_to_s3: boolean flag to write to s3
+    :param show_tree_on_screen: boolean flag to print every scooter's tree; see print_scooter_trees
+    :param seed: optional seed; the same seed, asset_pools and chunk_size generate the same vertices as stream_scooter_dataset
+    :param asset_pools: optional dict to override the pool size of shared assets; e.g. {"manufacturer": 20}
+    :param chunk_size: how many scooters to draw at a time; see generate_scooter_chunks
+
+    :return: Pandas dataframe with Vertices in Gremlin Neptune format; one row per parent reference, to build the edges.
+             Shared vertices are written to S3 once; see deduplicate_shared_vertices
+    """
     try:
-        # Create X number of scooters and randomize names
-        for x in range(1, int(number_of_scooters)+1):
-            scooter = Node(randomize_scooter_asset('scooter'))
-
-            # Begin: Scooters Incidents
-            if randomize_chances(odds_one_to_many=10) == 1:
-                incident = Node(randomize_scooter_asset('incident'), parent=scooter)
-                legal_case = Node(randomize_scooter_asset('legal_case'), parent=incident)
-
-            # Begin: Scooters Parts, manufacturers and legal warranties
-            for i in range(1, int(number_of_parts_per_scooter)+1):
-                part = Node(randomize_scooter_asset('part'), parent=scooter)
-                part_manufacturer = Node(randomize_scooter_asset('manufacturer',2), parent=part)
-                part_legal_warranty = Node(randomize_scooter_asset('legal_warranty'), parent=part)
-
-            # Begin: Scooter's Location
-            if randomize_chances(odds_one_to_many=3) == 0:
-                scooter_in_transit = Node(randomize_scooter_asset('in_transit_journey'), parent=scooter)
-                
-                # Begin: Weather
-                if randomize_chances(odds_one_to_many=3) == 1:
-                    weather = Node('weather_sunny-ws1', parent=scooter_in_transit)
-                elif randomize_chances(odds_one_to_many=2) == 1:
-                    weather = Node('weather_cloudy-wc3', parent=scooter_in_transit)
-                else:
-                    weather = Node('weather_rainy-wr2', parent=scooter_in_transit)
-
-            # Begin: less-likely locations
-            elif randomize_chances(odds_one_to_many=10) == 1:
-                loc_warehouse = Node(randomize_scooter_asset('warehouse',1), parent=scooter)
-            elif randomize_chances(odds_one_to_many=2) == 1:
-                loc_parking_station = Node(randomize_scooter_asset('parking_station',2), parent=scooter)
-            elif randomize_chances(odds_one_to_many=10) == 1:
-                loc_maintenance_center = Node(randomize_scooter_asset('maintenance_center',2), parent=scooter)
-            else:
-                # If none was selected by N random functions, we place it back on the streets: 
-                scooter_in_transit = Node(randomize_scooter_asset('in_transit_journey'), parent=scooter)
-
-            # Begin: Driver's payments
-            driver = Node(randomize_scooter_asset('driver'), parent=scooter)
-            if randomize_chances(odds_one_to_many=4) == 1:
-                payment_method = Node('payment_method-credit-card-visa', parent=driver)
-            elif randomize_chances(odds_one_to_many=3) == 1:
-                payment_method = Node('payment_method-credit-card-mastercard', parent=driver)
-            elif randomize_chances(odds_one_to_many=3) == 1:
-                payment_method = Node('payment_method-google-pay', parent=driver)
-            else:
-                payment_method = Node('payment_method-apple-pay', parent=driver)
-
-            # Begin: Faulty parts
-            if randomize_chances(odds_one_to_many=4) == 1:
-                part_fault = Node(randomize_scooter_asset('fault',2), parent=part)
-                fault_warranty = Node(randomize_scooter_asset('warranty'), parent=part_fault)
-                
-                # From those with a fault, only some will have a claim
-                if randomize_chances(odds_one_to_many=4) == 1:
-                    claim_fault = Node(randomize_scooter_asset('claim_fault'), parent=part_fault)
-
-            # Begin: Fleet Owners
-            if randomize_chances(odds_one_to_many=4) == 1:
-                fleet_owner = Node('fleet_owner-pegasus-scooters', parent=scooter)
-            elif randomize_chances(odds_one_to_many=3) == 1:
-                fleet_owner = Node('fleet_owner-pineapple-scooters', parent=scooter)
-            else:
-                fleet_owner = Node('fleet_owner-evfast-scooters', parent=scooter)
-
-            # Begin: Building dataset
-            if show_tree_on_screen:
-                # @ Example to show all assets, in a hierarchy tree format>
-                for pre, fill, node in RenderTree(scooter):
-                    print("%s %s" % (pre, node.name))
-
-            for pre, fill, node in RenderTree(scooter):
-                # AnyTree doesn't seem to have a better way to return specific elements from Node.Parent;
-                #   i.e. immediate parent and not all hierarchy
-                parent_node = str(node.parent).split('/', -1)[-1]
-                parent_node = parent_node.replace("'", "").replace(")", "")
-                node_asset_label = node.name.split('-', 1)[0]
-                
-                # Dict init, which will hold all scooter data
-                scooter_dict = {'~label': node_asset_label, '~id': node.name, 'parent_id': parent_node, 'name': node.name}
-                all_scooters.append(scooter_dict)
-            
-        # Populate DF
-        df_scooters = pd.DataFrame.from_records(all_scooters)
+        id_allocator = ScooterIdAllocator(seed, asset_pools)
+        df_scooters = pd.concat(generate_scooter_chunks(number_of_scooters, number_of_parts_per_scooter, chunk_size, id_allocator), ignore_index=True)
+
+        if show_tree_on_screen:
+            print_scooter_trees(df_scooters)
 
         if write_to_s3:
+            df_vertices = deduplicate_shared_vertices(df_scooters)
+
             # Storing data to s3; for local tests use boto3_session=boto3_session
-            wr.s3.to_csv(
-                df=df_scooters,
-                path='s3://{}/{}/vertices.csv'.format(s3_bucket_name, s3_prefix),
-                dataset=False,
-                index=False
-            )
+            with metrics.timer('vertices_write_ms'):
+                wr.s3.to_csv(
+                    df=df_vertices,
+                    path='s3://{}/{}/vertices.csv'.format(s3_bucket_name, s3_prefix),
+                    dataset=False,
+                    index=False
+                )
+            metrics.put_metric('vertices_write_rows', len(df_vertices.index))
 
         return df_scooters
 
@@ -172,6 +559,45 @@ def generate_scooter_vertices(number_of_scooters, number_of_parts_per_scooter, s
         traceback.print_exc()
 
 
+def deduplicate_shared_vertices(input_df):
+    """
+    Keeps a single row per shared vertex (weather, payment methods, fleet owners, manufacturers, etc.); their
+    references are kept as edges only. Shared vertices have no parent_id, since they have many parents.
+    :param input_df: pandas dataframe with scooters vertices dataset, i.e. one row per parent reference
+
+    :return: Pandas dataframe with Vertices in Gremlin Neptune format
+    """
+    shared_mask = input_df['~label'].isin(SHARED_VERTEX_LABELS)
+    df_shared = input_df[shared_mask].drop_duplicates('~id').assign(parent_id='None')
+
+    return pd.concat([input_df[~shared_mask], df_shared], ignore_index=True)
+
+
+def build_scooter_edges(input_df):
+    """
+    Derives the scooters Edges from a Vertices dataframe, in Gremlin for Neptune format. The input dataframe is not modified.
+    :param input_df: pandas dataframe with scooters vertices dataset
+
+    :return: Pandas dataframe with Edges in Gremlin Neptune format
+    """
+    # remove root vertices (no parent)
+    df_scooters = input_df[input_df.parent_id != 'None']
+
+    # rename columns only, to generate pseudo-columns for Gremlin loader
+    # - to invert graph direction, swap id and parent; e.g. {'~id': '~from', 'parent_id': '~to'}
+    df_scooters = df_scooters.rename({'~id': '~to', 'parent_id': '~from'}, axis=1)
+
+    # add Edge label. This can be changed to CASE-WHEN, to change it for every case:  
+    # - e.g. has_claim, has_fault, has_manufactures, etc.
+    df_scooters['~label'] = 'has'
+
+    # add id, for the Neptune loader: <from>-><to>. Deterministic, so reloading the same dataset (same seed) updates
+    # the existing edges instead of duplicating them. A vertex never references the same child twice.
+    df_scooters['~id'] = df_scooters['~from'].str.cat(df_scooters['~to'], sep='->')
+
+    return df_scooters
+
+
 def generate_scooter_edges(input_df, s3_bucket_name, s3_prefix, write_to_s3):
     """
     Generates, and optionally writes, scooters Edges dataset in Gremlin for Neptune format
@@ -181,31 +607,20 @@ def generate_scooter_edges(input_df, s3_bucket_name, s3_prefix, write_to_s3):
     :return: str
     """
     try:
-        # add Edge label. This can be changed to CASE-WHEN, to change it for every case:  
-        # - e.g. has_claim, has_fault, has_manufactures, etc.
-        input_df['~label'] = 'has'
-
-        # remove root vertices (no parent)
-        df_scooters = input_df[input_df.parent_id != 'None']
-
-        # rename columns only, to generate pseudo-columns for Gremlin loader
-        # - to invert graph direction, swap id and parent; e.g. {'~id': '~from', 'parent_id': '~to'}
-        df_scooters = df_scooters.rename({'~id': '~to', 'parent_id': '~from'}, axis=1)
-
-        # add random id, for the Neptune loader
-        df_scooters['~id'] = [uuid.uuid4() for _ in range(len(df_scooters.index))]
+        with metrics.timer('edge_derivation_ms'):
+            df_scooters = build_scooter_edges(input_df)
+        s3_edges_output = 's3://{}/{}/edges.csv'.format(s3_bucket_name,s3_prefix)
 
         if write_to_s3:
-            # Amazon S3 output path:
-            s3_edges_output = 's3://{}/{}/edges.csv'.format(s3_bucket_name,s3_prefix)
-
             # Storing data to s3; for local tests use boto3_session=boto3_session
-            wr.s3.to_csv(
-                df=df_scooters,
-                path=s3_edges_output,
-                dataset=False,
-                index=False
-            )
+            with metrics.timer('edges_write_ms'):
+                wr.s3.to_csv(
+                    df=df_scooters,
+                    path=s3_edges_output,
+                    dataset=False,
+                    index=False
+                )
+            metrics.put_metric('edges_write_rows', len(df_scooters.index))
 
         return {
             'statusCode': 200,
@@ -217,35 +632,635 @@ def generate_scooter_edges(input_df, s3_bucket_name, s3_prefix, write_to_s3):
         traceback.print_exc()
 
 
+def generate_scooter_chunks(number_of_scooters, number_of_parts_per_scooter, chunk_size=DATAGEN_CHUNK_SIZE, id_allocator=None, first_scooter_number=0):
+    """
+    Generator of scooters Vertices, in fixed-size chunks of scooters; i.e. only one chunk is kept in memory at a time.
+    - Every chunk draws from its own RNG stream, keyed by the seed and its first scooter number. 
+      The same seed, chunk_size (and shards) always generate the same dataset.
+    :param number_of_scooters: how many scooters we want to generate for this dummy data
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param chunk_size: how many scooters per chunk
+    :param id_allocator: optional ScooterIdAllocator, with the dataset's seed
+    :param first_scooter_number: global number of the first scooter; e.g. the first scooter of a shard
+
+    :return: iterator of Pandas dataframes with Vertices in Gremlin Neptune format
+    """
+    id_allocator = id_allocator if id_allocator is not None else ScooterIdAllocator()
+    first_scooter_number = int(first_scooter_number)
+    last_scooter_number = first_scooter_number + int(number_of_scooters)
+    chunk_size = max(int(chunk_size), 1)
+
+    for chunk_start in range(first_scooter_number, last_scooter_number, chunk_size):
+        rng = np.random.default_rng(np.random.SeedSequence(id_allocator.seed, spawn_key=(chunk_start,)))
+        yield generate_scooter_batch(min(chunk_size, last_scooter_number - chunk_start), number_of_parts_per_scooter, rng, id_allocator, chunk_start)
+
+
+def generate_event_chunks(number_of_scooters, number_of_parts_per_scooter, event_counters, dataset_generation, chunk_size=DATAGEN_CHUNK_SIZE, id_allocator=None, event_rates=None):
+    """
+    Generator of new events for the existing scooters of a delta, in fixed-size chunks of scooters; see generate_scooter_events.
+    - Every chunk draws from its own RNG stream, keyed by the seed, the dataset generation and its first scooter number.
+    :param number_of_scooters: how many existing scooters
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param event_counters: dict of event -> next event number; advanced in place
+    :param dataset_generation: generation number of this delta
+    :param chunk_size: how many scooters per chunk
+    :param id_allocator: ScooterIdAllocator, with the dataset's seed
+    :param event_rates: optional dict; see DEFAULT_DELTA_EVENT_RATES
+
+    :return: iterator of Pandas dataframes with Vertices in Gremlin Neptune format
+    """
+    chunk_size = max(int(chunk_size), 1)
+
+    for chunk_start in range(0, int(number_of_scooters), chunk_size):
+        rng = np.random.default_rng(np.random.SeedSequence(id_allocator.seed, spawn_key=(int(dataset_generation), chunk_start)))
+        yield generate_scooter_events(min(chunk_size, int(number_of_scooters) - chunk_start), number_of_parts_per_scooter, event_counters,
+                                      rng, id_allocator, chunk_start, event_rates)
+
+
+def dataset_file_name(dataset, shard_id=None, extension='csv', part_number=None):
+    """
+    Name of a generated file, within s3_prefix; e.g. vertices.csv, vertices-00003.csv for shard 3,
+    or vertices-00003-00002.csv.gz for the 2nd part file of shard 3
+    :param dataset: vertices or edges
+    :param shard_id: optional shard number, when the dataset is generated by parallel shards
+    :param extension: file extension; i.e. the output format, and compression if any
+    :param part_number: optional part number, when files are split by max_rows_per_file or max_bytes_per_file
+
+    :return: file name
+    """
+    name_parts = [dataset] + ['{:05d}'.format(int(number)) for number in (shard_id, part_number) if number is not None]
+
+    return '{}.{}'.format('-'.join(name_parts), extension)
+
+
+def shard_scooter_range(number_of_scooters, shard_count, shard_id):
+    """
+    Splits N scooters into K (almost) equal shards; the first shards take one extra scooter, if not divisible.
+    :param number_of_scooters: total number of scooters, across all shards
+    :param shard_count: number of shards
+    :param shard_id: shard number, from 0 to shard_count-1
+
+    :return: tuple with the first scooter number and the number of scooters of this shard
+    """
+    number_of_scooters, shard_count, shard_id = int(number_of_scooters), int(shard_count), int(shard_id)
+
+    if not 0 <= shard_id < shard_count:
+        raise ValueError('shard_id must be between 0 and {}, got {}'.format(shard_count - 1, shard_id))
+
+    shard_size, remainder = divmod(number_of_scooters, shard_count)
+    shard_start = shard_id * shard_size + min(shard_id, remainder)
+
+    return shard_start, shard_size + (1 if shard_id < remainder else 0)
+
+
+def effective_shard_count(number_of_scooters, shard_count):
+    """
+    Caps the number of shards at the number of scooters: a shard without scooters would write empty (header-less)
+    files, which the Neptune bulk loader rejects.
+    :param number_of_scooters: total number of scooters, across all shards
+    :param shard_count: requested number of shards
+
+    :return: number of shards, from 1 to shard_count
+    """
+    return max(1, min(int(shard_count), int(number_of_scooters)))
+
+
+def open_dataset_writer(dataset, s3_bucket_name, s3_prefix, shard_id=None, output_dir=None, s3_client=None, output_options=None):
+    """
+    Opens a streaming writer for the vertices or edges dataset; in S3, or in a local directory.
+    :param dataset: vertices or edges
+    :param shard_id: optional shard number; see dataset_file_name
+    :param output_dir: optional local directory; if set, the file is written there instead of S3
+    :param s3_client: optional boto3 S3 client, to share among writers
+    :param output_options: optional dict; see DEFAULT_OUTPUT_OPTIONS
+
+    :return: CsvDatasetWriter or ParquetDatasetWriter; wrapped in a RollingDatasetWriter (one per part file) and/or
+             a PartitionedDatasetWriter (one per ~label), depending on output_options
+    """
+    output_options = dict(DEFAULT_OUTPUT_OPTIONS, **(output_options or {}))
+    output_format = output_options['format']
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Output format must be one of {}, got {}'.format(OUTPUT_FORMATS, output_format))
+
+    if output_format == 'parquet':
+        compression = output_options['compression'] or 'snappy'
+        extension = 'parquet'
+    else:
+        compression = output_options['compression'] or 'none'
+        extension = 'csv.gz' if compression == 'gzip' else 'csv'
+
+    rolling = bool(output_options['max_rows_per_file'] or output_options['max_bytes_per_file'])
+
+    def open_writer(relative_path, part_size_bytes):
+        if output_dir:
+            sink = LocalFileUpload(os.path.join(output_dir, relative_path))
+        else:
+            sink = S3MultipartUpload(s3_bucket_name, '{}/{}'.format(s3_prefix, relative_path), part_size_bytes, s3_client)
+
+        if output_format == 'parquet':
+            return ParquetDatasetWriter(sink, compression)
+
+        return CsvDatasetWriter(sink, compression)
+
+    def open_files_writer(folder, part_size_bytes=S3_DEFAULT_PART_SIZE_BYTES):
+        if not rolling:
+            return open_writer(folder + dataset_file_name(dataset, shard_id, extension), part_size_bytes)
+
+        return RollingDatasetWriter(lambda part_number: open_writer(folder + dataset_file_name(dataset, shard_id, extension, part_number), part_size_bytes),
+                                    output_options['max_rows_per_file'],
+                                    output_options['max_bytes_per_file'])
+
+    if output_options['partition_by_label']:
+        # Many files open at once: keep the upload buffers small
+        return PartitionedDatasetWriter(lambda label: open_files_writer('{}/label={}/'.format(dataset, label), S3_MIN_PART_SIZE_BYTES))
+
+    return open_files_writer('')
+
+
+def stream_scooter_dataset(number_of_scooters, number_of_parts_per_scooter, s3_bucket_name, s3_prefix, write_to_s3, chunk_size=DATAGEN_CHUNK_SIZE, shard_id=None, output_dir=None, seed=None, first_scooter_number=0, asset_pools=None, output_options=None):
+    """
+    Generates, and optionally writes, scooters Vertices and Edges chunk by chunk; each chunk is streamed to
+    vertices.csv and edges.csv via S3 multipart uploads, so memory stays flat for any number of scooters.
+    - Shared vertices (see ScooterIdAllocator.shared_vertices) are written once, by the first (or single) shard; chunks
+      only write the edges that reference them.
+    :param number_of_scooters: how many scooters we want to generate for this dummy data
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param write_to_s3: boolean flag to write to s3
+    :param chunk_size: how many scooters to generate (and keep in memory) at a time
+    :param shard_id: optional shard number; files are then written as vertices-<shard>.csv and edges-<shard>.csv
+    :param output_dir: optional local directory; if set, files are written there instead of S3
+    :param seed: optional seed, for a reproducible dataset; see ScooterIdAllocator
+    :param first_scooter_number: global number of the first scooter; e.g. the first scooter of a shard
+    :param asset_pools: optional dict to override the pool size of shared assets; e.g. {"manufacturer": 20}
+    :param output_options: optional dict with the output format, compression, etc.; see DEFAULT_OUTPUT_OPTIONS
+
+    :return: dict with the seed, the number of vertices and edges generated, and the written files (if any)
+    """
+    id_allocator = ScooterIdAllocator(seed, asset_pools)
+
+    # Shared vertices, once per dataset
+    df_shared_vertices = id_allocator.shared_vertices() if shard_id is None or int(shard_id) == 0 else None
+    vertex_chunks = generate_scooter_chunks(number_of_scooters, number_of_parts_per_scooter, chunk_size, id_allocator, first_scooter_number)
+
+    dataset_counts = write_scooter_dataset(vertex_chunks, df_shared_vertices, s3_bucket_name, s3_prefix, write_to_s3 or bool(output_dir),
+                                           shard_id, output_dir, output_options)
+
+    return dict(seed=id_allocator.seed, **dataset_counts)
+
+
+def write_scooter_dataset(vertex_chunks, df_shared_vertices, s3_bucket_name, s3_prefix, write_output, shard_id=None, output_dir=None, output_options=None):
+    """
+    Derives the Edges of every chunk of Vertices, and streams both to the vertices and edges files; in S3, or in a local directory.
+    :param vertex_chunks: iterator of Vertices dataframes, one row per parent reference; e.g. generate_scooter_chunks
+    :param df_shared_vertices: optional dataframe of shared vertices, written first; see ScooterIdAllocator.shared_vertices
+    :param write_output: boolean flag to write the files; if False, vertices and edges are only counted
+    :param shard_id: optional shard number; see dataset_file_name
+    :param output_dir: optional local directory; if set, files are written there instead of S3
+    :param output_options: optional dict with the output format, compression, etc.; see DEFAULT_OUTPUT_OPTIONS
+
+    :return: dict with the number of vertices and edges, and the written files (if any)
+    """
+    vertices_writer = None
+    edges_writer = None
+
+    def write_chunk(dataset, writer, df):
+        # Timed per write; bytes are as uploaded, i.e. compressed if so
+        bytes_written = writer.bytes_written
+        with metrics.timer('{}_write_ms'.format(dataset)):
+            writer.write(df)
+
+        metrics.put_metric('{}_write_rows'.format(dataset), len(df.index))
+        metrics.put_metric('{}_write_bytes'.format(dataset), writer.bytes_written - bytes_written, 'Bytes')
+
+    dataset_counts = {'vertices': 0, 'edges': 0, 'files': []}
+
+    try:
+        if write_output:
+            s3_client = None if output_dir else get_s3_client()
+            vertices_writer = open_dataset_writer('vertices', s3_bucket_name, s3_prefix, shard_id, output_dir, s3_client, output_options)
+            edges_writer = open_dataset_writer('edges', s3_bucket_name, s3_prefix, shard_id, output_dir, s3_client, output_options)
+
+        if df_shared_vertices is not None:
+            dataset_counts['vertices'] += len(df_shared_vertices.index)
+
+            if write_output:
+                write_chunk('vertices', vertices_writer, df_shared_vertices)
+
+        for df_references in vertex_chunks:
+            with metrics.timer('edge_derivation_ms'):
+                df_edges = build_scooter_edges(df_references)
+
+            df_vertices = df_references[~df_references['~label'].isin(SHARED_VERTEX_LABELS)]
+            dataset_counts['vertices'] += len(df_vertices.index)
+            dataset_counts['edges'] += len(df_edges.index)
+
+            if write_output:
+                write_chunk('vertices', vertices_writer, df_vertices)
+                write_chunk('edges', edges_writer, df_edges)
+
+        if write_output:
+            for dataset, writer in (('vertices', vertices_writer), ('edges', edges_writer)):
+                # Uploads the last part, and completes the multipart upload
+                with metrics.timer('{}_close_ms'.format(dataset)):
+                    writer.close()
+                dataset_counts['files'] += writer.files
+
+        return dataset_counts
+
+    except Exception as e:
+        print('Error while streaming the scooters dataset: {}'.format(e))
+        traceback.print_exc()
+
+        # Do not leave incomplete multipart uploads (or files) behind
+        for writer in (vertices_writer, edges_writer):
+            if writer is not None:
+                writer.abort()
+
+        raise
+
+
+def stream_scooter_delta(manifest, number_of_new_scooters, s3_bucket_name, s3_prefix, write_to_s3, chunk_size=DATAGEN_CHUNK_SIZE, output_dir=None, asset_pools=None, event_rates=None, output_options=None):
+    """
+    Generates, and optionally writes, a delta on top of an existing dataset: new scooters (with their whole hierarchy),
+    new events for the existing scooters (see generate_scooter_events), and new shared pool members, if pools grew.
+    - Only the manifest of the previous run is read, not its dataset; the cost scales with the delta.
+    - Files are written under <s3_prefix>/delta-<generation>/ (see DELTA_FOLDER_NAME), for the Neptune bulk loader to
+      load that folder on top of the loaded dataset. New edges may reference vertices of the previous runs.
+    - New scooters are the same as if the previous runs had generated them; i.e. scooters are numbered on from the manifest.
+    :param manifest: dict with the manifest of the previous run; see dataset_manifest
+    :param number_of_new_scooters: how many scooters to add; defaults to DEFAULT_DELTA_GROWTH of the existing ones, if None
+    :param write_to_s3: boolean flag to write to s3
+    :param chunk_size: how many scooters to generate (and keep in memory) at a time
+    :param output_dir: optional local directory of the dataset; if set, files are written there instead of S3
+    :param asset_pools: optional dict to grow the pool size of shared assets; e.g. {"warehouse": 20}
+    :param event_rates: optional dict to override the share of existing scooters with a new event; see DEFAULT_DELTA_EVENT_RATES
+    :param output_options: optional dict with the output format, compression, etc.; defaults to those of the manifest
+
+    :return: tuple with a dict with the counts and written files of this delta, and the updated manifest; with the counts
+        and files of every run under its generations list (see DATASET_RUN_KEYS), and not on top
+    """
+    number_of_scooters = int(manifest['num_of_vehicles'])
+    number_of_parts_per_scooter = int(manifest['num_of_parts_per_vehicle'])
+    dataset_generation = int(manifest['dataset_generation']) + 1
+    event_counters = dict(manifest['event_counters'])
+
+    if number_of_new_scooters is None:
+        number_of_new_scooters = int(round(number_of_scooters * DEFAULT_DELTA_GROWTH))
+    number_of_new_scooters = int(number_of_new_scooters)
+
+    # Events of scooters in the base dataset are numbered after their scooter; deltas' events, from DELTA_EVENT_FIRST_NUMBER on
+    if number_of_scooters + number_of_new_scooters > DELTA_EVENT_FIRST_NUMBER:
+        raise ValueError('Too many scooters for incremental generation: up to {} are supported'.format(DELTA_EVENT_FIRST_NUMBER))
+
+    previous_id_allocator = ScooterIdAllocator(manifest['seed'], manifest['asset_pools'])
+    id_allocator = ScooterIdAllocator(manifest['seed'], dict(manifest['asset_pools'], **(asset_pools or {})))
+
+    for asset, pool_size in previous_id_allocator.asset_pools.items():
+        # Shared asset IDs are as wide as their pool needs: a pool cannot shrink, nor outgrow the width of its existing IDs
+        if id_allocator.pool_size(asset) < pool_size or id_allocator.shared_asset_ids(asset, 0) != previous_id_allocator.shared_asset_ids(asset, 0):
+            raise ValueError('The {} pool can only grow within the width of its IDs: {} members already, got {}'.format(asset, pool_size, id_allocator.pool_size(asset)))
+
+    # Events first, for existing scooters only; then the new scooters
+    vertex_chunks = itertools.chain(generate_event_chunks(number_of_scooters, number_of_parts_per_scooter, event_counters, dataset_generation, chunk_size, id_allocator, event_rates),
+                                    generate_scooter_chunks(number_of_new_scooters, number_of_parts_per_scooter, chunk_size, id_allocator, number_of_scooters))
+
+    delta_folder = DELTA_FOLDER_NAME.format(dataset_generation)
+    dataset_counts = write_scooter_dataset(vertex_chunks,
+                                           id_allocator.shared_vertices(previous_id_allocator.asset_pools),
+                                           s3_bucket_name,
+                                           '{}/{}'.format(s3_prefix, delta_folder),
+                                           write_to_s3 or bool(output_dir),
+                                           output_dir=os.path.join(output_dir, delta_folder) if output_dir else None,
+                                           output_options=output_options if output_options is not None else manifest.get('output_options'))
+    dataset_counts.update({'dataset_generation': dataset_generation, 'new_scooters': number_of_new_scooters})
+
+    # Counts and files of the previous run, if any, move next to those of every delta; only dataset-wide keys stay on top
+    generations = list(manifest.get('generations', []))
+    previous_run = {key: manifest[key] for key in DATASET_RUN_KEYS if key in manifest}
+    if previous_run:
+        generations.append(dict(previous_run, dataset_generation=int(manifest['dataset_generation'])))
+    generations.append(dict(dataset_counts))
+
+    updated_manifest = dict({key: value for key, value in manifest.items() if key not in DATASET_RUN_KEYS},
+                            num_of_vehicles=number_of_scooters + number_of_new_scooters,
+                            asset_pools=id_allocator.asset_pools,
+                            dataset_generation=dataset_generation,
+                            event_counters=event_counters,
+                            generations=generations)
+
+    return dataset_counts, updated_manifest
+
+
+def dataset_manifest(seed, number_of_scooters, number_of_parts_per_scooter, asset_pools=None, output_options=None):
+    """
+    Manifest of a new (base) dataset: what a delta needs to carry on from it; i.e. the seed, ID counters and shared pools.
+    See stream_scooter_delta
+    :param seed: the dataset's seed
+    :param number_of_scooters: total number of scooters, across all shards; i.e. the next scooter number
+    :param asset_pools: optional dict with the pool sizes overridden
+
+    :return: dict with the manifest
+    """
+    return {
+        'dataset_generation': 0,
+        'seed': int(seed),
+        'num_of_vehicles': int(number_of_scooters),
+        'num_of_parts_per_vehicle': int(number_of_parts_per_scooter),
+        'asset_pools': dict(SHARED_ASSET_POOLS, **(asset_pools or {})),
+        'event_counters': {event: DELTA_EVENT_FIRST_NUMBER for event in DEFAULT_DELTA_EVENT_RATES},
+        'output_options': output_options
+        }
+
+
+def read_dataset_manifest(s3_bucket_name, s3_prefix, output_dir=None, s3_client=None):
+    """
+    Reads the manifest of a dataset, at <s3_prefix>/manifest.json; or in a local directory.
+    :param output_dir: optional local directory; if set, the manifest is read there instead of S3
+    :param s3_client: optional boto3 S3 client
+
+    :return: dict with the manifest
+    """
+    if output_dir:
+        with open(os.path.join(output_dir, DATASET_MANIFEST_FILE_NAME)) as manifest_file:
+            return json.load(manifest_file)
+
+    s3_client = s3_client or get_s3_client()
+    response = s3_client.get_object(Bucket=s3_bucket_name, Key='{}/{}'.format(s3_prefix, DATASET_MANIFEST_FILE_NAME))
+
+    return json.loads(response['Body'].read())
+
+
+def write_dataset_manifest(manifest, s3_bucket_name, s3_prefix, output_dir=None, s3_client=None):
+    """
+    Writes the manifest of a dataset, at <s3_prefix>/manifest.json; or in a local directory.
+    :param manifest: dict with the manifest; see dataset_manifest
+    :param output_dir: optional local directory; if set, the manifest is written there instead of S3
+    :param s3_client: optional boto3 S3 client
+
+    :return: manifest path
+    """
+    sink = LocalFileUpload(os.path.join(output_dir, DATASET_MANIFEST_FILE_NAME)) if output_dir \
+        else S3MultipartUpload(s3_bucket_name, '{}/{}'.format(s3_prefix, DATASET_MANIFEST_FILE_NAME), s3_client=s3_client or get_s3_client())
+
+    sink.write(json.dumps(manifest, indent=4).encode('utf-8'))
+    sink.close()
+
+    return sink.path
+
+
+def bump_dataset_generation(parameter_name=None, ssm_client=None):
+    """
+    Starts a new dataset generation, for the query Lambda not to serve cached results of the previous dataset; i.e. a
+    unique value (not derived from the current one, which concurrent bumps would share) in an SSM parameter.
+    :param parameter_name: optional SSM parameter name; defaults to OS variable dataset_generation_parameter, set by the stack
+    :param ssm_client: optional boto3 SSM client
+
+    :return: new generation; None if there is no parameter (e.g. local runs) or it could not be written
+    """
+    parameter_name = parameter_name or os.environ.get('dataset_generation_parameter')
+    if not parameter_name:
+        return None
+
+    try:
+        generation = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S', time.gmtime()), uuid.uuid4().hex[:8])
+        (ssm_client or boto3.client('ssm')).put_parameter(Name=parameter_name, Value=generation, Type='String', Overwrite=True)
+
+        return generation
+
+    except Exception as e:
+        # The dataset is written; cached query results are refreshed on the next /refreshSchema call instead
+        print('Error while bumping the dataset generation: {}'.format(e))
+        traceback.print_exc()
+
+
+def invoke_scooter_shards(number_of_scooters, number_of_parts_per_scooter, shard_count, function_name, invoke_mode='lambda', chunk_size=DATAGEN_CHUNK_SIZE, seed=None, asset_pools=None, output_options=None):
+    """
+    Coordinator: splits the dataset into K shards and invokes one worker per shard, asynchronously.
+    - Every worker writes its own vertices-<shard>.csv and edges-<shard>.csv, under the same s3_prefix.
+    - Use invoke_mode='local' to run all workers in this process; e.g. against a local S3 stand-in (see s3_endpoint_url).
+    :param number_of_scooters: total number of scooters, across all shards
+    :param number_of_parts_per_scooter: how many parts per scooter
+    :param shard_count: number of shards, i.e. parallel Lambda invocations; see effective_shard_count
+    :param function_name: worker Lambda function name or ARN; usually this same function
+    :param invoke_mode: lambda or local
+    :param seed: optional seed; a random one is drawn if None. All shards must share it, for their IDs not to collide
+    :param asset_pools: optional dict to override the pool size of shared assets
+    :param output_options: optional dict with the output format, compression, etc.; see DEFAULT_OUTPUT_OPTIONS
+
+    :return: list with the worker event of every shard
+    """
+    shard_events = []
+    shard_count = effective_shard_count(number_of_scooters, shard_count)
+    seed = ScooterIdAllocator(seed).seed
+    lambda_client = boto3.client('lambda') if invoke_mode == 'lambda' else None
+
+    for shard_id in range(int(shard_count)):
+        shard_event = {
+            'shard_id': shard_id,
+            'shard_count': shard_count,
+            'num_of_vehicles': int(number_of_scooters),
+            'num_of_parts_per_vehicle': int(number_of_parts_per_scooter),
+            'chunk_size': int(chunk_size),
+            'seed': seed,
+            'asset_pools': asset_pools,
+            'output_options': output_options
+            }
+
+        if invoke_mode == 'local':
+            # In-process workers are part of this run's profile, if any: not profiled on their own
+            lambda_handler(dict(shard_event, profile=False), None)
+        else:
+            # InvocationType=Event: do not wait for the worker to finish
+            lambda_client.invoke(FunctionName=function_name, InvocationType='Event', Payload=json.dumps(shard_event).encode('utf-8'))
+
+        shard_events.append(shard_event)
+
+    return shard_events
+
+
+def profile_lambda_handler(event, context):
+    """
+    Runs lambda_handler under cProfile and tracemalloc, and writes the reports under s3://<bucket>/<s3_prefix>/_profile/,
+    or <datagen_output_dir>/_profile/ (OS variable); see datagen_profiler.py. Reports are written even if the run fails.
+    :param event: Lambda event
+
+    :return: lambda_handler response
+    """
+    shard_name = 'shard-{:05d}'.format(int(event['shard_id'])) if event.get('shard_id') is not None else 'run'
+    run_name = 'datagen-{}-{}'.format(shard_name, time.strftime('%Y%m%dT%H%M%S', time.gmtime()))
+
+    profiler = RunProfiler()
+
+    try:
+        with profiler:
+            return lambda_handler(dict(event, profile=False), context)
+
+    finally:
+        try:
+            output_dir = os.environ.get('datagen_output_dir') or None
+            report_paths = profiler.write(run_name, os.environ['s3_bucket_name'], os.environ['s3_prefix'], output_dir=output_dir,
+                                          s3_client=None if output_dir else get_s3_client())
+            print('Profile reports written to {}'.format(report_paths))
+
+        except Exception as e:
+            print('Error while writing the profile reports: {}'.format(e))
+            traceback.print_exc()
+
+
 # Run main
 def lambda_handler(event, context):
+    """
+    Event (optional) keys, to override the OS Input parameters or to generate the dataset in parallel shards:
+    - shard_count, without shard_id: coordinator; invokes shard_count workers of this same function. e.g. {"shard_count": 10}
+    - shard_id and shard_count: worker; generates and writes its own share of the scooters. Set by the coordinator.
+    - invoke_mode: lambda (default) or local, to run all shard workers in-process.
+    - num_of_vehicles, num_of_parts_per_vehicle, chunk_size.
+    - seed (or OS variable datagen_seed), for a reproducible dataset; asset_pools, e.g. {"manufacturer": 20, "warehouse": 5}.
+    - output_options (or OS variable datagen_output_format, for the format only); e.g. {"format": "parquet", "compression": "zstd"}.
+    - OS variable datagen_output_dir (no event key): files, and the manifest, are written to this local directory instead of S3.
+    - Once a run's manifest is written, the dataset generation (SSM parameter of OS variable dataset_generation_parameter)
+      is bumped; i.e. the query Lambda stops serving cached results of the previous dataset. See bump_dataset_generation.
+    - profile (or OS variable datagen_profile, e.g. to profile every shard worker): cProfile and tracemalloc reports,
+      under s3://<bucket>/<s3_prefix>/_profile/. e.g. {"profile": true}
+    - incremental: delta on top of the dataset at s3_prefix, per its manifest.json; i.e. new scooters and new events for
+      the existing ones, under s3://<bucket>/<s3_prefix>/delta-<generation>/. Always a single invocation.
+      num_of_new_vehicles (1% of the fleet if not set), asset_pools (to grow them) and event_rates are optional;
+      e.g. {"incremental": true, "num_of_new_vehicles": 5000, "event_rates": {"fault": 0.02}}
+    """
+    event = event or {}
+
+    # Opt-in profiling, via event key profile or OS variable datagen_profile; see profile_lambda_handler
+    if event.get('profile', os.environ.get('datagen_profile', 'false').lower() == 'true'):
+        return profile_lambda_handler(event, context)
+
     # OS Input parameters:
     input_s3_bucket_name = os.environ['s3_bucket_name']
     input_s3_prefix = os.environ['s3_prefix']
-    input_num_of_vehicles = os.environ['datagen_num_of_vehicles']
-    input_num_of_parts_per_vehicle = os.environ['datagen_num_of_parts_per_vehicle']
+    input_num_of_vehicles = event.get('num_of_vehicles', os.environ['datagen_num_of_vehicles'])
+    input_num_of_parts_per_vehicle = event.get('num_of_parts_per_vehicle', os.environ['datagen_num_of_parts_per_vehicle'])
+    input_chunk_size = event.get('chunk_size', os.environ.get('datagen_chunk_size', DATAGEN_CHUNK_SIZE))
+    input_shard_count = int(event.get('shard_count', 1))
+    input_shard_id = event.get('shard_id')
+    input_seed = event.get('seed', os.environ.get('datagen_seed') or None)
+    input_asset_pools = event.get('asset_pools')
+    input_output_options = event.get('output_options') or {'format': os.environ.get('datagen_output_format', 'csv')}
+    input_first_scooter_number = 0
+    metrics.set_context(shard_id=input_shard_id)
 
     # Hard-coded values, so user can test locally:
     input_print_tree_on_screen = False
     input_write_to_s3_flag = True
 
+    # Optional, local directory to write to instead of S3; e.g. local runs and tests
+    input_output_dir = os.environ.get('datagen_output_dir') or None
+    output_location = input_output_dir or f's3://{input_s3_bucket_name}/{input_s3_prefix}'
+
+    # Optional, local S3 stand-in (e.g. MinIO); see get_s3_client
+    if os.environ.get('s3_endpoint_url'):
+        wr.config.s3_endpoint_url = os.environ['s3_endpoint_url']
+
+    # Delta: only what is new since the previous run, per its manifest
+    if event.get('incremental'):
+        s3_client = get_s3_client()
+        manifest = read_dataset_manifest(input_s3_bucket_name, input_s3_prefix, output_dir=input_output_dir, s3_client=s3_client)
+        delta_counts, manifest = stream_scooter_delta(manifest=manifest,
+                                                      number_of_new_scooters=event.get('num_of_new_vehicles'),
+                                                      s3_bucket_name=input_s3_bucket_name,
+                                                      s3_prefix=input_s3_prefix,
+                                                      write_to_s3=input_write_to_s3_flag,
+                                                      chunk_size=input_chunk_size,
+                                                      output_dir=input_output_dir,
+                                                      asset_pools=input_asset_pools,
+                                                      event_rates=event.get('event_rates'),
+                                                      output_options=event.get('output_options'))
+        write_dataset_manifest(manifest, input_s3_bucket_name, input_s3_prefix, output_dir=input_output_dir, s3_client=s3_client)
+        bump_dataset_generation()
+        metrics.flush(dataset_generation=delta_counts['dataset_generation'], num_of_new_vehicles=delta_counts['new_scooters'])
+
+        return {
+                'statusCode': 200,
+                'body': json.dumps(f"""
+                                   OK: Graph delta {delta_counts['dataset_generation']} generated at {output_location}/{DELTA_FOLDER_NAME.format(delta_counts['dataset_generation'])}, 
+                                   with {delta_counts['new_scooters']} new scooters, 
+                                   {delta_counts['vertices']} vertices and {delta_counts['edges']} edges
+                                   """)
+                }
+
+    # Coordinator: fan-out the dataset generation across parallel invocations
+    if input_shard_count > 1 and input_shard_id is None:
+        shard_events = invoke_scooter_shards(number_of_scooters=input_num_of_vehicles,
+                                             number_of_parts_per_scooter=input_num_of_parts_per_vehicle,
+                                             shard_count=input_shard_count,
+                                             function_name=context.invoked_function_arn if context else None,
+                                             invoke_mode=event.get('invoke_mode', 'lambda'),
+                                             chunk_size=input_chunk_size,
+                                             seed=input_seed,
+                                             asset_pools=input_asset_pools,
+                                             output_options=input_output_options)
+        write_dataset_manifest(dataset_manifest(shard_events[0]['seed'], input_num_of_vehicles, input_num_of_parts_per_vehicle, input_asset_pools, input_output_options),
+                               input_s3_bucket_name, input_s3_prefix, output_dir=input_output_dir)
+        bump_dataset_generation()
+        metrics.put_metric('shards_invoked', len(shard_events))
+        metrics.flush(shard_count=input_shard_count)
+
+        return {
+                'statusCode': 202,
+                'body': json.dumps(f"""
+                                   OK: {len(shard_events)} shards invoked, writing to {output_location}, 
+                                   for {input_num_of_vehicles} scooters, 
+                                   each with {input_num_of_parts_per_vehicle} connected parts
+                                   """)
+                }
+
+    # Worker: generate this shard's share of scooters only
+    if input_shard_id is not None:
+        input_first_scooter_number, input_num_of_vehicles = shard_scooter_range(input_num_of_vehicles, input_shard_count, input_shard_id)
+
     # Generate data:
-    response_vertices = generate_scooter_vertices(number_of_scooters=input_num_of_vehicles, 
+    if input_print_tree_on_screen:
+        # In-memory generation, to show every scooter's tree on screen (AnyTree)
+        response_vertices = generate_scooter_vertices(number_of_scooters=input_num_of_vehicles, 
+                                                        number_of_parts_per_scooter=input_num_of_parts_per_vehicle, 
+                                                        show_tree_on_screen=input_print_tree_on_screen, 
+                                                        write_to_s3=input_write_to_s3_flag,
+                                                        s3_bucket_name=input_s3_bucket_name,
+                                                        s3_prefix=input_s3_prefix,
+                                                        seed=input_seed,
+                                                        asset_pools=input_asset_pools,
+                                                        chunk_size=input_chunk_size)
+
+        response_edges = generate_scooter_edges(input_df=response_vertices, 
+                                                        write_to_s3=input_write_to_s3_flag,
+                                                        s3_bucket_name=input_s3_bucket_name,
+                                                        s3_prefix=input_s3_prefix)
+    else:
+        # Streaming generation, chunk by chunk
+        response_dataset = stream_scooter_dataset(number_of_scooters=input_num_of_vehicles, 
                                                     number_of_parts_per_scooter=input_num_of_parts_per_vehicle, 
-                                                    show_tree_on_screen=input_print_tree_on_screen, 
                                                     write_to_s3=input_write_to_s3_flag,
                                                     s3_bucket_name=input_s3_bucket_name,
-                                                    s3_prefix=input_s3_prefix)
+                                                    s3_prefix=input_s3_prefix,
+                                                    chunk_size=input_chunk_size,
+                                                    shard_id=input_shard_id,
+                                                    output_dir=input_output_dir,
+                                                    seed=input_seed,
+                                                    first_scooter_number=input_first_scooter_number,
+                                                    asset_pools=input_asset_pools,
+                                                    output_options=input_output_options)
+
+        # Single run: the whole dataset is written, i.e. deltas can be generated on top of it
+        if input_shard_id is None:
+            write_dataset_manifest(dataset_manifest(response_dataset['seed'], input_num_of_vehicles, input_num_of_parts_per_vehicle, input_asset_pools, input_output_options),
+                                   input_s3_bucket_name, input_s3_prefix, output_dir=input_output_dir)
+            bump_dataset_generation()
+
+    metrics.flush(num_of_vehicles=input_num_of_vehicles, num_of_parts_per_vehicle=input_num_of_parts_per_vehicle)
 
-    response_edges = generate_scooter_edges(input_df=response_vertices, 
-                                                    write_to_s3=input_write_to_s3_flag,
-                                                    s3_bucket_name=input_s3_bucket_name,
-                                                    s3_prefix=input_s3_prefix)
-    
     return {
             'statusCode': 200,
             'body': json.dumps(f"""
-                               OK: Graph data generated at s3://{input_s3_bucket_name}/{input_s3_prefix}, 
+                               OK: Graph data generated at {output_location}, 
                                for {input_num_of_vehicles} scooters, 
                                each with {input_num_of_parts_per_vehicle} connected parts
                                """)
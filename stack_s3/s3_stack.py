@@ -1,6 +1,7 @@
 from aws_cdk import (
     Stack,
     aws_s3 as s3,
+    aws_ssm as ssm,
     RemovalPolicy,
     CfnOutput,
 )
@@ -18,3 +19,12 @@ class S3Stack(Stack):
 
         # Return bucket auto-generated name
         CfnOutput(self, "output-s3-bucket", value=self.bucket.bucket_arn, export_name="s3-bucket-arn")
+
+        # Dataset generation, shared by the data generator (bumps it once a run is written) and the query Lambda
+        # (bumps it on /refreshSchema; cached query results of previous generations are no longer served)
+        dataset_generation = ssm.StringParameter(self, "dataset_generation",
+                                                 string_value="0",
+                                                 description="Scooters graph dataset generation; bumped after each data generator run and bulk load")
+
+        # Return parameter auto-generated name
+        CfnOutput(self, "output-dataset-generation-parameter", value=dataset_generation.parameter_name, export_name="dataset-generation-parameter")
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from query_metrics import MetricsLogger
+
+"""
+LangChain objects for /askGraph, built once per Lambda container and reused across warm invocations:
+    - NeptuneGraph fetches the graph schema (labels, properties, relationships) from Neptune when created; the schema
+      is then kept for neptune_schema_ttl_seconds (OS variable), or until refresh_schema is called; e.g. after a new
+      bulk load, via the /refreshSchema API.
+    - The Bedrock LLM client and the NeptuneOpenCypherQAChain are built with the graph, and kept with it.
+    - LangChain is imported on first use, not at module load: its import tree takes most of the Lambda's cold start,
+      and only /askGraph needs it.
+    - The openCypher generated for every question is kept in a QuestionCache (see question_cache.py): a repeated
+      question skips the LLM entirely (both openCypher generation and answer phrasing), runs the cached query
+      directly and returns its results. Cached queries are scoped by Neptune endpoint and graph schema.
+"""
+
+# Get model inference parameters. Feel free to change the model and inference params.
+BEDROCK_MODEL_ID = 'anthropic.claude-v2:1'
+BEDROCK_MODEL_KWARGS = {
+    "max_tokens_to_sample": 512,
+    "temperature": 0,
+    "top_k": 250,
+    "top_p": 1,
+    "stop_sequences": ["\n\nHuman:"]
+    }
+
+# The schema only changes with a new bulk load
+DEFAULT_SCHEMA_TTL_SECONDS = 3600
+
+
+def bedrock_question_embeddings():
+    """
+    Embed function for semantic question matching, if OS variable question_cache_embeddings_model is set;
+    e.g. amazon.titan-embed-text-v1
+
+    :return: function that takes a question and returns its embedding, or None (exact matching only)
+    """
+    model_id = os.environ.get('question_cache_embeddings_model')
+
+    if not model_id:
+        return None
+
+    embeddings = []
+
+    def embed_question(question):
+        # Built on first use, i.e. the first /askGraph call
+        if not embeddings:
+            from langchain_community.embeddings import BedrockEmbeddings
+            embeddings.append(BedrockEmbeddings(model_id=model_id, region_name=os.environ.get('AWS_REGION')))
+
+        return embeddings[0].embed_query(question)
+
+    return embed_question
+
+
+class GraphQAChains:
+    """
+    Cache of NeptuneOpenCypherQAChain objects, per Neptune endpoint and region.
+    """
+
+    def __init__(self, schema_ttl_seconds=None, question_cache=None, metrics=None):
+        """
+        :param schema_ttl_seconds: how long a graph schema is reused; defaults to OS variable neptune_schema_ttl_seconds
+        :param question_cache: optional QuestionCache, of generated openCypher queries
+        :param metrics: optional MetricsLogger, for schema fetch, query and LLM call times
+        """
+        self.question_cache = question_cache
+        self.metrics = metrics if metrics is not None else MetricsLogger(enabled=False)
+        self.schema_ttl_seconds = float(schema_ttl_seconds if schema_ttl_seconds is not None
+                                        else os.environ.get('neptune_schema_ttl_seconds', DEFAULT_SCHEMA_TTL_SECONDS))
+
+        # (endpoint, region) -> {'graph': ..., 'chain': ..., 'schema_refreshed_at': ...}
+        self._chains = {}
+        self._lock = threading.Lock()
+
+    def chain(self, neptune_endpoint, region_name):
+        """
+        :param neptune_endpoint: writer or reader Neptune endpoint
+        :param region_name: Amazon Bedrock region
+
+        :return: NeptuneOpenCypherQAChain; built on first use, with its schema refreshed once the TTL is over
+        """
+        with self._lock:
+            cached_chain = self._chains.get((neptune_endpoint, region_name))
+
+            if cached_chain is None:
+                cached_chain = self._build_chain(neptune_endpoint, region_name)
+                self._chains[(neptune_endpoint, region_name)] = cached_chain
+
+            elif time.time() - cached_chain['schema_refreshed_at'] > self.schema_ttl_seconds:
+                self._refresh_schema(cached_chain)
+
+            return cached_chain['chain']
+
+    def ask(self, neptune_endpoint, region_name, question, prompt):
+        """
+        Answers a question, reusing the openCypher query of a previous (same, or similar) question if cached.
+        :param neptune_endpoint: writer or reader Neptune endpoint
+        :param region_name: Amazon Bedrock region
+        :param question: natural-language question; the cache key
+        :param prompt: question, wrapped in the model's prompt template
+
+        :return: answer phrased by the LLM; or, for a cached question, the JSON results of its query (no LLM call). str
+        """
+        chain = self.chain(neptune_endpoint, region_name)
+        question_scope = self._question_scope(neptune_endpoint, chain)
+        cached_query = self.question_cache.get(question, question_scope) if self.question_cache is not None else None
+
+        if cached_query is not None:
+            try:
+                with self.metrics.timer('query_execution_ms'):
+                    return json.dumps(chain.graph.query(cached_query), default=str)
+
+            except Exception as e:
+                # e.g. the schema changed: generate the query again
+                print('Error while running cached openCypher query, regenerating it: {}'.format(e))
+                self.question_cache.invalidate(question, question_scope)
+
+        # Both LLM calls (query generation and answer) and the query itself
+        with self.metrics.timer('llm_call_ms'):
+            chain_response = chain.invoke({chain.input_key: prompt})
+
+        if self.question_cache is not None:
+            self.question_cache.put(question, chain_response['intermediate_steps'][0]['query'], question_scope)
+
+        return chain_response[chain.output_key]
+
+    def refresh_schema(self, neptune_endpoint=None):
+        """
+        Fetches the graph schema again, for the chains already built; e.g. after a new bulk load.
+        :param neptune_endpoint: optional Neptune endpoint; all endpoints if None
+
+        :return: number of schemas refreshed
+        """
+        with self._lock:
+            cached_chains = [cached_chain for (endpoint, _), cached_chain in self._chains.items()
+                             if neptune_endpoint is None or endpoint == neptune_endpoint]
+
+            for cached_chain in cached_chains:
+                self._refresh_schema(cached_chain)
+
+            # Queries generated for the previous schema may not fit the new one
+            if cached_chains and self.question_cache is not None:
+                self.question_cache.invalidate()
+
+            return len(cached_chains)
+
+    def clear(self):
+        with self._lock:
+            self._chains = {}
+
+    def _build_chain(self, neptune_endpoint, region_name):
+        from langchain_community.graphs import NeptuneGraph
+        from langchain.chains import NeptuneOpenCypherQAChain
+        from langchain.llms.bedrock import Bedrock
+
+        # Model setup, using LangChain.
+        # - More at: https://python.langchain.com/docs/use_cases/graph/neptune_cypher_qa
+        with self.metrics.timer('schema_fetch_ms'):
+            graph = NeptuneGraph(host=neptune_endpoint, port=8182, use_https=True)
+        llm = Bedrock(
+            region_name=region_name,
+            model_id=BEDROCK_MODEL_ID,
+            model_kwargs=BEDROCK_MODEL_KWARGS
+        )
+        # Intermediate steps include the generated openCypher query; see ask
+        chain = NeptuneOpenCypherQAChain.from_llm(llm=llm, graph=graph, verbose=True, return_intermediate_steps=True)
+
+        return {'graph': graph, 'chain': chain, 'schema_refreshed_at': time.time()}
+
+    def _question_scope(self, neptune_endpoint, chain):
+        # Queries are generated from one graph's schema: cached per endpoint and schema, e.g. db-endpoint@3f2a9c1b7d4e
+        schema_hash = hashlib.sha256(str(chain.graph.get_schema).encode('utf-8')).hexdigest()[:12]
+
+        return '{}@{}'.format(neptune_endpoint, schema_hash)
+
+    def _refresh_schema(self, cached_chain):
+        try:
+            # The chain reads graph.get_schema on every call: refreshing the graph is enough
+            with self.metrics.timer('schema_fetch_ms'):
+                cached_chain['graph']._refresh_schema()
+
+        except Exception as e:
+            # Keep the previous schema; retried after another TTL
+            print('Error while refreshing the Neptune graph schema: {}'.format(e))
+            traceback.print_exc()
+
+        cached_chain['schema_refreshed_at'] = time.time()
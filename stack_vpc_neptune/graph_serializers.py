@@ -0,0 +1,156 @@
+import base64
+import datetime
+import decimal
+import enum
+import json
+import os
+import uuid
+from gremlin_python.structure.graph import Vertex, Edge, VertexProperty, Property, Path
+
+"""
+JSON serialization of Gremlin results (as deserialized from GraphSON/GraphBinary by gremlin_python), for API responses.
+    - Maps T.id / T.label keys (e.g. valueMap(true)) to "id" / "label", and Vertex, Edge, Path, etc. to plain objects.
+    - Results are encoded one by one, with no intermediate string passes, up to a size budget: API Gateway cannot
+      stream a Lambda response, so larger result sets are cut, and flagged as truncated.
+"""
+
+# Lambda sync responses are limited to 6 MB, incl. the JSON-escaped body: leave room for the escaping
+RESPONSE_MAX_BYTES = int(os.environ.get('response_max_bytes', 4 * 1024 * 1024))
+
+
+def to_json_value(value):
+    """
+    Converts a Gremlin result into JSON-serializable Python values, in one pass.
+    :param value: any Gremlin result; e.g. list of valueMap dicts, Vertex, Edge, Path
+
+    :return: dicts, lists, strings and numbers
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+
+    if isinstance(value, dict):
+        return {json_key(key): to_json_value(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [to_json_value(item) for item in value]
+
+    if isinstance(value, enum.Enum):
+        # e.g. T.id, T.label, Direction.OUT
+        return value.name
+
+    if isinstance(value, Vertex):
+        return element_to_json(value, {'type': 'vertex'})
+
+    if isinstance(value, Edge):
+        return element_to_json(value, {'type': 'edge', 'outV': to_json_value(value.outV.id), 'inV': to_json_value(value.inV.id)})
+
+    if isinstance(value, VertexProperty):
+        return element_to_json(value, {'type': 'vertex_property', 'value': to_json_value(value.value)})
+
+    if isinstance(value, Property):
+        return {'type': 'property', 'key': value.key, 'value': to_json_value(value.value)}
+
+    if isinstance(value, Path):
+        return {'type': 'path', 'labels': to_json_value(value.labels), 'objects': to_json_value(value.objects)}
+
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+
+    if isinstance(value, uuid.UUID):
+        return str(value)
+
+    return str(value)
+
+
+def json_key(key):
+    """
+    :param key: dict key of a Gremlin result; e.g. T.id, or a property name
+
+    :return: str
+    """
+    if isinstance(key, enum.Enum):
+        return key.name
+
+    return key if isinstance(key, str) else json.dumps(to_json_value(key))
+
+
+def element_to_json(element, fields):
+    """
+    :param element: Vertex, Edge or VertexProperty
+    :param fields: dict with the element-specific fields
+
+    :return: dict with the element's id, label and, if returned by the server, its properties
+    """
+    element_json = {'id': to_json_value(element.id), 'label': element.label}
+    element_json.update(fields)
+
+    if element.properties:
+        element_json['properties'] = to_json_value(element.properties)
+
+    return element_json
+
+
+def encode_results(results, max_bytes=RESPONSE_MAX_BYTES, offset=None, has_more=False):
+    """
+    Encodes Gremlin results as a JSON response body: {"results": [...], "count": n, "truncated": false}
+    :param results: list of Gremlin results
+    :param max_bytes: size budget of the body; results past it are left out, and "truncated" is set to true
+    :param offset: optional position of the first result, for paginated queries; adds "next_cursor" to the body,
+                   i.e. the offset of the next page, or null on the last page
+    :param has_more: boolean flag; True if there are more results after these ones
+
+    :return: str
+    """
+    encoded_results = []
+    body_bytes = 0
+    truncated = False
+
+    for result in results or []:
+        # ASCII-only output (ensure_ascii), so characters are bytes
+        encoded_result = json.dumps(to_json_value(result), separators=(',', ':'))
+        body_bytes += len(encoded_result) + 1
+
+        if body_bytes > max_bytes:
+            truncated = True
+            break
+
+        encoded_results.append(encoded_result)
+
+    body = '"results":[{}],"count":{},"truncated":{}'.format(','.join(encoded_results), len(encoded_results), json.dumps(truncated))
+
+    if offset is not None:
+        next_cursor = str(offset + len(encoded_results)) if truncated or has_more else None
+        body += ',"next_cursor":{}'.format(json.dumps(next_cursor))
+
+    return '{' + body + '}'
+
+
+def encode_results_by_key(results_by_key, max_bytes=RESPONSE_MAX_BYTES):
+    """
+    Encodes Gremlin results, keyed by e.g. asset code, as a JSON response body: {"results": {...}, "count": n, "truncated": false}
+    :param results_by_key: dict of Gremlin results
+    :param max_bytes: size budget of the body; keys past it are left out, and "truncated" is set to true
+
+    :return: str
+    """
+    encoded_results = []
+    body_bytes = 0
+    truncated = False
+
+    for key, result in results_by_key.items():
+        encoded_result = '{}:{}'.format(json.dumps(json_key(key)), json.dumps(to_json_value(result), separators=(',', ':')))
+        body_bytes += len(encoded_result) + 1
+
+        if body_bytes > max_bytes:
+            truncated = True
+            break
+
+        encoded_results.append(encoded_result)
+
+    return '{{"results":{{{}}},"count":{},"truncated":{}}}'.format(','.join(encoded_results), len(encoded_results), json.dumps(truncated))
@@ -1,13 +1,44 @@
 import json
+import re
+import time
 import traceback
-from langchain_community.graphs import NeptuneGraph
-from langchain.chains import NeptuneOpenCypherQAChain
-from langchain.llms.bedrock import Bedrock
-from gremlin_python.structure.graph import Graph
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.graph_traversal import __
-from gremlin_python import statics
-from gremlin_python.driver import client
+from gremlin_python.process.traversal import P, T
+from neptune_connections import NeptuneConnectionPool, NeptuneEndpointRouter
+from graph_serializers import encode_results, encode_results_by_key
+from graph_qa import GraphQAChains, bedrock_question_embeddings
+from question_cache import QuestionCache
+from result_cache import ResultCache, normalize_query, is_read_only_query, has_query_errors
+from query_metrics import MetricsLogger
+
+# Per-stage metrics, logged in CloudWatch EMF once per request; no-op outside Lambda. See query_metrics.py
+metrics = MetricsLogger()
+
+# Gremlin connections, kept open across warm invocations; opened on first use. See neptune_connections.py
+neptune_pool = NeptuneConnectionPool(metrics=metrics)
+
+# Read-only queries go to the reader endpoints (OS variable neptune_reader_endpoints), if any; the rest, to the
+# neptune_endpoint of the request
+neptune_router = NeptuneEndpointRouter(neptune_pool)
+
+# LangChain graph (incl. schema), LLM and chain for /askGraph, kept across warm invocations, with the openCypher
+# generated per question. See graph_qa.py and question_cache.py
+graph_qa_chains = GraphQAChains(question_cache=QuestionCache(embed=bedrock_question_embeddings()), metrics=metrics)
+
+# Response bodies of read-only queries, until the next bulk load (i.e. dataset generation). See result_cache.py
+result_cache = ResultCache()
+
+# /getScooter bounds: the subtree traversal stops at max_depth hops, and returns one page of vertices at a time
+SCOOTER_QUERY_DEFAULT_MAX_DEPTH = 6
+SCOOTER_QUERY_MAX_DEPTH_LIMIT = 12
+SCOOTER_QUERY_DEFAULT_PAGE_SIZE = 100
+SCOOTER_QUERY_PAGE_SIZE_LIMIT = 1000
+# /runQuery: max Gremlin queries per request, run concurrently
+RUN_QUERY_MAX_QUERIES = 20
+
+# /getScooters: max asset codes per request, resolved with one multi-start traversal
+BATCH_MAX_ASSET_CODES = 200
+PROPERTY_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_\-]+$')
 
 
 def ask_graph(llm_query, neptune_endpoint, region_name="us-west-2"):
@@ -19,26 +50,7 @@ def ask_graph(llm_query, neptune_endpoint, region_name="us-west-2"):
     @neptune_endpoint (type str):
         writer or reader Neptune endpoint are supported for this function. Port (optionally) hard-coded.
     """
-    # Get model inference parameters. Feel free to change the model and inference params.
-    model = 'anthropic.claude-v2:1'
-    model_kwargs = {
-        "max_tokens_to_sample": 512,
-        "temperature": 0, 
-        "top_k": 250, 
-        "top_p": 1, 
-        "stop_sequences": ["\n\nHuman:"] 
-        }
-
     try:
-        # Model setup, using LangChain. 
-        # - More at: https://python.langchain.com/docs/use_cases/graph/neptune_cypher_qa
-        graph = NeptuneGraph(host=neptune_endpoint, port=8182, use_https=True)
-        llm = Bedrock(
-            region_name=region_name,
-            model_id=model,
-            model_kwargs = model_kwargs
-        )
-
         # Create Prompt template. Remember this can change for every model. 
         prompt_template = f"""
             Human: Do not apologize and just respond the question directly.  
@@ -47,9 +59,9 @@ def ask_graph(llm_query, neptune_endpoint, region_name="us-west-2"):
 
             Assistant:"""
 
-        # Let's use NL to ask our LLM to traverse the graph
-        chain = NeptuneOpenCypherQAChain.from_llm(llm=llm, graph=graph, verbose=True)
-        llm_response = chain.run(prompt_template)
+        # Let's use NL to ask our LLM to traverse the graph. Model, graph schema and chain are built on first use
+        # (model and inference params at graph_qa.py); repeated questions reuse their cached openCypher query
+        llm_response = graph_qa_chains.ask(neptune_endpoint, region_name, question=llm_query, prompt=prompt_template)
 
         return llm_response
 
@@ -58,36 +70,159 @@ def ask_graph(llm_query, neptune_endpoint, region_name="us-west-2"):
         traceback.print_exc()
 
 
-def query_scooter_asset(scooter_asset_code, neptune_endpoint):
+def read_scooter_query_parameters(query_string_parameters):
+    """
+    Reads and validates the optional /getScooter parameters; raises ValueError on invalid values.
+
+    @query_string_parameters (type dict):
+        max_depth (hops from the asset), page_size, cursor (from a previous page's next_cursor), and
+        properties (comma-separated property names to return; e.g. name)
+
+    Returns a dict with max_depth, page_size, offset and properties
+    """
+    def read_int(name, default, limit, minimum=1):
+        value = query_string_parameters.get(name) or default
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError('{} must be an integer, got {}'.format(name, value))
+
+        if not minimum <= value <= limit:
+            raise ValueError('{} must be between {} and {}, got {}'.format(name, minimum, limit, value))
+
+        return value
+
+    properties = [name.strip() for name in (query_string_parameters.get('properties') or '').split(',') if name.strip()]
+    invalid_properties = [name for name in properties if not PROPERTY_NAME_PATTERN.match(name)]
+
+    if invalid_properties:
+        raise ValueError('Invalid property names: {}'.format(invalid_properties))
+
+    return {
+        'max_depth': read_int('max_depth', SCOOTER_QUERY_DEFAULT_MAX_DEPTH, SCOOTER_QUERY_MAX_DEPTH_LIMIT),
+        'page_size': read_int('page_size', SCOOTER_QUERY_DEFAULT_PAGE_SIZE, SCOOTER_QUERY_PAGE_SIZE_LIMIT),
+        'offset': read_int('cursor', 0, 2 ** 31, minimum=0),
+        'properties': properties
+    }
+
+
+def bounded_subtree(traversal, max_depth):
+    """
+    Appends the bounded subtree steps to a traversal: leaves (no more 'has' edges) or vertices at max_depth hops,
+    deduplicated; e.g. shared weather or fleet_owner vertices are returned once.
+
+    @traversal (type GraphTraversal):
+        traversal positioned on the asset vertex (or vertices); e.g. g.V(code), or __.start()
+
+    Returns the traversal
+    """
+    return traversal \
+        .repeat(__.out()) \
+        .until(__.or_(__.not_(__.out('has')), __.loops().is_(P.gte(max_depth)))) \
+        .dedup()
+
+
+def scooter_subtree(g, scooter_asset_code, max_depth, offset, limit, properties):
+    """
+    Bounded subtree of one asset (see bounded_subtree), as valueMap(True)
+
+    @g (type GraphTraversalSource):
+        traversal source, bound to a Neptune connection
+
+    @offset, @limit (type int):
+        range of vertices to return; i.e. one page. Vertices are ordered by id, for pages not to overlap or skip any
+
+    @properties (type list):
+        property names to return; all of them if empty
+
+    Returns a traversal
+    """
+    return bounded_subtree(g.V(scooter_asset_code), max_depth) \
+        .order().by(T.id) \
+        .range_(offset, offset + limit) \
+        .valueMap(True, *properties)
+
+
+def scooter_subtrees(g, scooter_asset_codes, max_depth, limit, properties):
+    """
+    Bounded subtrees of many assets, in one multi-start traversal: one {code, vertices} map per asset found
+
+    @scooter_asset_codes (type list):
+        asset codes; e.g. ['scooter-9999', 'part-9999']
+
+    @limit (type int):
+        max vertices per asset; the first ones by id, as for the first page of scooter_subtree
+
+    Returns a traversal
+    """
+    return g.V(*scooter_asset_codes) \
+        .project('code', 'vertices') \
+        .by(T.id) \
+        .by(bounded_subtree(__.start(), max_depth).order().by(T.id).limit(limit).valueMap(True, *properties).fold())
+
+
+def query_scooter_asset(scooter_asset_code, neptune_endpoint, max_depth=SCOOTER_QUERY_DEFAULT_MAX_DEPTH,
+                        page_size=SCOOTER_QUERY_DEFAULT_PAGE_SIZE, offset=0, properties=None):
     """
     @scooter_asset_code (type str):
         asset code; e.g. scooter-9999, part-9999, incident-9999, driver-9999
 
     @neptune_endpoint (type str):
         writer or reader Neptune endpoint are supported for this function. Port (optionally) hard-coded.
-    """
-    # Neptune settings:
-    graph = Graph()
-    statics.load_statics(globals())
 
+    @max_depth, @page_size, @offset, @properties:
+        traversal bounds and projection; see read_scooter_query_parameters
+
+    Returns a JSON body; i.e. {"results": [...], "count": n, "truncated": false, "next_cursor": "100"}, where
+    next_cursor is null on the last page. See graph_serializers.py
+    """
     try:
-        # Neptune connection, forcing port here:
-        remoteConn = DriverRemoteConnection('wss://{}:8182/gremlin'.format(neptune_endpoint),'g')
-        g = graph.traversal().withRemote(remoteConn)
+        # Run query, on the shared connection of a reader endpoint, if any (port hard-coded in neptune_connections.py).
+        # One extra vertex is fetched, to know whether there is a next page
+        query_response = neptune_router.run_traversal(
+            neptune_endpoint,
+            lambda g: scooter_subtree(g, scooter_asset_code, max_depth, offset, page_size + 1, properties or []).toList()
+        )
+
+        # valueMap(True) returns T.id and T.label keys: serialized as "id" and "label"
+        with metrics.timer('serialization_ms'):
+            return encode_results(query_response[:page_size], offset=offset, has_more=len(query_response) > page_size)
+
+    except Exception as e:
+        print('Error while querying Neptune: {}'.format(e))
+        traceback.print_exc()
+
 
-        # Run query:
-        query_response = g.V(scooter_asset_code).repeat(__.out()).until(not_(__.out('has'))).valueMap(True).toList()
+def query_scooter_assets(scooter_asset_codes, neptune_endpoint, max_depth=SCOOTER_QUERY_DEFAULT_MAX_DEPTH,
+                         page_size=SCOOTER_QUERY_DEFAULT_PAGE_SIZE, properties=None):
+    """
+    Batch version of query_scooter_asset: all the subtrees are resolved in one round trip to Neptune.
 
-        # Temporary workaround, to format response from Neptune. i.e. valueMap() returns non-dict keys; to investigate
-        # - To try: json.dumps(query_response, separators=(',', ':'), indent=4)
-        query_response = str(query_response).replace("<T", "'T").replace(">:", "':")
-        query_response = json.dumps(query_response, indent=4)
+    @scooter_asset_codes (type list):
+        asset codes; e.g. ['scooter-9999', 'part-9999']; up to BATCH_MAX_ASSET_CODES
 
-        # Close connection; see instead
-        remoteConn.close()
+    @neptune_endpoint (type str):
+        writer or reader Neptune endpoint are supported for this function. Port (optionally) hard-coded.
 
-        # Return to be enriched. Pending to remove multiple JSON casts.
-        return json.loads(query_response)
+    @max_depth, @page_size, @properties:
+        traversal bounds and projection, per asset; see read_scooter_query_parameters
+
+    Returns a JSON body, keyed by asset code; i.e. {"results": {"scooter-9999": {"vertices": [...], "truncated": false},
+    "unknown-code": null}, "count": n, "truncated": false}. See graph_serializers.py
+    """
+    try:
+        # One extra vertex per asset is fetched, to know whether its subtree was cut at page_size
+        query_response = neptune_router.run_traversal(
+            neptune_endpoint,
+            lambda g: scooter_subtrees(g, scooter_asset_codes, max_depth, page_size + 1, properties or []).toList()
+        )
+
+        subtrees = {code: None for code in scooter_asset_codes}
+        for subtree in query_response:
+            subtrees[subtree['code']] = {'vertices': subtree['vertices'][:page_size], 'truncated': len(subtree['vertices']) > page_size}
+
+        with metrics.timer('serialization_ms'):
+            return encode_results_by_key(subtrees)
 
     except Exception as e:
         print('Error while querying Neptune: {}'.format(e))
@@ -104,30 +239,44 @@ def run_gremlin_query(gremlin_query, neptune_endpoint):
 
     @neptune_endpoint (type str):
         writer or reader Neptune endpoint are supported for this function. Port (optionally) hard-coded
-    """
-    # Neptune settings:
-    graph = Graph()
-    statics.load_statics(globals())
 
+    Returns a JSON body; i.e. {"results": [...], "count": n, "truncated": false}. See graph_serializers.py
+    """
     try:
-        # Temporary feature for testing
-        gremlin_client = client.Client('wss://{}:8182/gremlin'.format(neptune_endpoint),'g')
+        # Run query, on the shared Neptune client. Temporary feature for testing
+        query_results = neptune_router.submit(neptune_endpoint, gremlin_query, read_only=is_read_only_query(gremlin_query))
+
+        # Vertices, edges, paths, T.id/T.label keys, etc. are mapped to plain JSON
+        with metrics.timer('serialization_ms'):
+            return encode_results(query_results)
+
+    except Exception as e:
+        print('Error while querying Neptune: {}'.format(e))
+        traceback.print_exc()
+
+
+def run_gremlin_queries(gremlin_queries, neptune_endpoint):
+    """
+    Temporary feature for testing: many open queries at once; e.g. counts per label. They are submitted concurrently,
+    up to neptune_query_concurrency (OS variable) at a time; see neptune_connections.py
+    - IMPORTANT: treat this (ApiGateway-IP-protected) function carefully, as it opens direct comms to the DB
 
-        # Run query:
-        query_submit = gremlin_client.submit(gremlin_query)
-        query_results = query_submit.all()
-        query_results = query_results.result()
+    @gremlin_queries (type list):
+        Gremlin queries; e.g. ["g.V().hasLabel('scooter').count()", "g.V().hasLabel('fault').count()"]
 
-        # Temporary workaround, to format response from Neptune. Fn valueMap() returns non-dict keys.
-        # - To keep testing; i.e. json.dumps(query_response, separators=(',', ':'), indent=4)
-        query_response = str(query_results).replace("<T", "'T").replace(">:", "':")
-        query_response = json.dumps(query_response, indent=4)
+    @neptune_endpoint (type str):
+        writer or reader Neptune endpoint are supported for this function. Port (optionally) hard-coded
 
-        # Close connection; see instead
-        gremlin_client.close()
+    Returns a JSON body, with one result per query, in order; i.e. {"results": [{"query": ..., "results": [...],
+    "error": null, "duration_ms": 12.3}, ...], "count": n, "truncated": false}. See graph_serializers.py
+    """
+    try:
+        # Run queries, on the shared Neptune client. Temporary feature for testing
+        query_responses = neptune_router.submit_many(neptune_endpoint, gremlin_queries,
+                                                     read_only=all(is_read_only_query(query) for query in gremlin_queries))
 
-        # Return to be enriched. Pending to remove multiple JSON casts.
-        return json.loads(query_response)
+        with metrics.timer('serialization_ms'):
+            return encode_results(query_responses)
 
     except Exception as e:
         print('Error while querying Neptune: {}'.format(e))
@@ -135,6 +284,9 @@ def run_gremlin_query(gremlin_query, neptune_endpoint):
 
 
 def lambda_handler(event, context):
+    started_at = time.perf_counter()
+    metrics.set_context(dimensions={'path': event['path']})
+
     # Input parameter for all functions:
     neptune_endpoint = event['queryStringParameters']['neptune_endpoint']
 
@@ -142,18 +294,71 @@ def lambda_handler(event, context):
     if event['path'] == '/getScooter':
         # Read input parameters
         scooter_asset_code = event['queryStringParameters']['scooter_asset_code']
+
+        try:
+            scooter_query_parameters = read_scooter_query_parameters(event['queryStringParameters'])
+
+            # Run query against Neptune database, unless cached for the current dataset generation
+            response = result_cache.get_or_run(
+                ['/getScooter', neptune_endpoint, scooter_asset_code, scooter_query_parameters],
+                lambda: query_scooter_asset(scooter_asset_code=scooter_asset_code, neptune_endpoint=neptune_endpoint, **scooter_query_parameters)
+            )
+            response_status = 201
+
+        except ValueError as e:
+            response = json.dumps('Error: {}'.format(e))
+            response_status = 400
     
-        # Run query against Neptune database
-        response = query_scooter_asset(scooter_asset_code=scooter_asset_code, neptune_endpoint=neptune_endpoint)
-        response_status = 201
-    
+    elif event['path'] == '/getScooters':
+        # Read input parameters; i.e. comma-separated asset codes
+        scooter_asset_codes = list(dict.fromkeys(code.strip() for code in event['queryStringParameters']['scooter_asset_codes'].split(',') if code.strip()))
+
+        try:
+            scooter_query_parameters = read_scooter_query_parameters(event['queryStringParameters'])
+            scooter_query_parameters.pop('offset')
+
+            if not 0 < len(scooter_asset_codes) <= BATCH_MAX_ASSET_CODES:
+                raise ValueError('scooter_asset_codes must have between 1 and {} codes, got {}'.format(BATCH_MAX_ASSET_CODES, len(scooter_asset_codes)))
+
+            # Run query against Neptune database, unless cached for the current dataset generation
+            response = result_cache.get_or_run(
+                ['/getScooters', neptune_endpoint, scooter_asset_codes, scooter_query_parameters],
+                lambda: query_scooter_assets(scooter_asset_codes=scooter_asset_codes, neptune_endpoint=neptune_endpoint, **scooter_query_parameters)
+            )
+            response_status = 201
+
+        except ValueError as e:
+            response = json.dumps('Error: {}'.format(e))
+            response_status = 400
+
     elif event['path'] == '/runQuery':
-        # Read input parameters
+        # Read input parameters; repeat gremlin_query to run many queries at once
         gremlin_query = event['queryStringParameters']['gremlin_query']
-
-        # Run query against Neptune database
-        response = run_gremlin_query(gremlin_query=gremlin_query, neptune_endpoint=neptune_endpoint)
-        response_status = 202
+        gremlin_queries = (event.get('multiValueQueryStringParameters') or {}).get('gremlin_query') or [gremlin_query]
+
+        if len(gremlin_queries) > RUN_QUERY_MAX_QUERIES:
+            response = json.dumps('Error: up to {} gremlin_query parameters, got {}'.format(RUN_QUERY_MAX_QUERIES, len(gremlin_queries)))
+            response_status = 400
+
+        elif len(gremlin_queries) > 1:
+            # Run queries concurrently against Neptune database, unless cached for the current dataset generation
+            response = result_cache.get_or_run(
+                ['/runQuery', neptune_endpoint, [normalize_query(query) for query in gremlin_queries]],
+                lambda: run_gremlin_queries(gremlin_queries=gremlin_queries, neptune_endpoint=neptune_endpoint),
+                cacheable=all(is_read_only_query(query) for query in gremlin_queries),
+                # Failed queries (e.g. timeouts) are transient: not cached
+                cache_if=lambda body: not has_query_errors(body)
+            )
+            response_status = 202
+
+        else:
+            # Run query against Neptune database, unless cached for the current dataset generation; writes are never cached
+            response = result_cache.get_or_run(
+                ['/runQuery', neptune_endpoint, normalize_query(gremlin_query)],
+                lambda: run_gremlin_query(gremlin_query=gremlin_query, neptune_endpoint=neptune_endpoint),
+                cacheable=is_read_only_query(gremlin_query)
+            )
+            response_status = 202
 
     elif event['path'] == '/askGraph':
         # Read input parameters
@@ -162,12 +367,23 @@ def lambda_handler(event, context):
         # Run query against Neptune database. Confirm default region.
         response = ask_graph(llm_query=nl_question, neptune_endpoint=neptune_endpoint)
         response_status = 203
+
+    elif event['path'] == '/refreshSchema':
+        # Run after a new bulk load: the next /askGraph calls use the new graph schema, and cached query results
+        # of the previous dataset generation are no longer served, by any Lambda container
+        refreshed_schemas = graph_qa_chains.refresh_schema(neptune_endpoint=neptune_endpoint)
+        dataset_generation = result_cache.generation.bump()
+        response = json.dumps({'refreshed_schemas': refreshed_schemas, 'dataset_generation': dataset_generation})
+        response_status = 200
     
     else:
         # Better response call to be added
         response = json.dumps('Error: method name does not exist. Confirm names at the docs!')
         response_status = 400
     
+    metrics.put_metric('request_ms', round((time.perf_counter() - started_at) * 1000, 3), 'Milliseconds')
+    metrics.flush(status_code=response_status)
+
     # Return headers to allow CORS access, for localhost testing; source: https://go.aws/3UiTS5X
     return {
             'statusCode': response_status,
@@ -0,0 +1,415 @@
+import os
+import threading
+import time
+import traceback
+from gremlin_python.driver import client
+from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
+from gremlin_python.driver.protocol import GremlinServerError
+from gremlin_python.process.anonymous_traversal import traversal
+from query_metrics import MetricsLogger
+from result_cache import is_read_only_query
+
+"""
+Gremlin connections to Neptune, reused across warm invocations of the query Lambda function.
+    - Connections are opened lazily, on first use, and cached per Neptune endpoint at module level; steady-state
+      requests only pay for the traversal, not for the TLS + WebSocket handshake.
+    - Sockets can go stale while the Lambda environment is frozen: idle connections are health-checked before reuse,
+      and a request that fails on a broken connection is retried once, on a fresh one. Writes are only retried if
+      they failed before being sent; otherwise they may have run already.
+    - Pool sizing, via OS variables: neptune_pool_size (WebSocket connections per endpoint; 1 is enough for one
+      request at a time), neptune_query_concurrency (max Gremlin query strings in flight at once; see submit_many),
+      neptune_max_workers (driver threads), neptune_health_check_seconds (idle time before a health check).
+      The driver opens connections lazily, on first write.
+    - Read-only requests can be balanced across reader endpoints, with a writer fallback; see NeptuneEndpointRouter.
+"""
+
+# Neptune port; same for writer and reader endpoints
+NEPTUNE_PORT = int(os.environ.get('neptune_port', 8182))
+# wss for Neptune; ws for a local Gremlin Server, e.g. the load-test harness (see query_load_harness.py)
+NEPTUNE_URL_SCHEME = os.environ.get('neptune_url_scheme', 'wss')
+DEFAULT_POOL_SIZE = 1
+DEFAULT_QUERY_CONCURRENCY = 4
+DEFAULT_HEALTH_CHECK_SECONDS = 60
+HEALTH_CHECK_TIMEOUT_SECONDS = 5
+HEALTH_CHECK_QUERY = 'g.inject(0)'
+
+
+class NeptuneConnectionPool:
+    """
+    Lazily created Gremlin connections, per Neptune endpoint:
+    - a DriverRemoteConnection, for traversals (see run_traversal)
+    - a Client, for Gremlin query strings (see submit)
+    """
+
+    def __init__(self, pool_size=None, max_workers=None, health_check_seconds=None, max_retries=1, query_concurrency=None, metrics=None):
+        """
+        :param pool_size: WebSocket connections per endpoint and kind; defaults to OS variable neptune_pool_size, or 1
+        :param query_concurrency: max concurrent Gremlin query strings per endpoint, i.e. client connections; defaults
+                                  to OS variable neptune_query_concurrency, or 4
+        :param max_workers: driver worker threads; defaults to OS variable neptune_max_workers, or the driver default
+        :param health_check_seconds: idle time after which connections are checked before reuse; 0 to always check
+        :param max_retries: how many times a request is retried on a fresh connection, after a connection failure
+        :param metrics: optional MetricsLogger, for connection acquisition and query execution times
+        """
+        self.pool_size = int(pool_size or os.environ.get('neptune_pool_size') or DEFAULT_POOL_SIZE)
+        self.query_concurrency = int(query_concurrency or os.environ.get('neptune_query_concurrency') or DEFAULT_QUERY_CONCURRENCY)
+        self.max_workers = int(max_workers or os.environ.get('neptune_max_workers') or 0) or None
+        self.health_check_seconds = float(health_check_seconds if health_check_seconds is not None
+                                          else os.environ.get('neptune_health_check_seconds', DEFAULT_HEALTH_CHECK_SECONDS))
+        self.max_retries = int(max_retries)
+        self.metrics = metrics if metrics is not None else MetricsLogger(enabled=False)
+
+        # endpoint -> {'remote_connection': ..., 'client': ..., 'last_used': ...}
+        self._endpoints = {}
+        self._lock = threading.RLock()
+
+    def remote_connection(self, neptune_endpoint):
+        """
+        :param neptune_endpoint: writer or reader Neptune endpoint
+
+        :return: DriverRemoteConnection, shared by all traversals on this endpoint
+        """
+        return self._connection(neptune_endpoint, 'remote_connection')
+
+    def client(self, neptune_endpoint):
+        """
+        :param neptune_endpoint: writer or reader Neptune endpoint
+
+        :return: gremlin_python Client, shared by all Gremlin query strings on this endpoint
+        """
+        return self._connection(neptune_endpoint, 'client')
+
+    def run_traversal(self, neptune_endpoint, run, read_only=True):
+        """
+        Runs a traversal on the endpoint's shared connection; retried on a fresh connection if the connection fails.
+        :param neptune_endpoint: writer or reader Neptune endpoint
+        :param run: function that takes a traversal source (g) and returns the traversal results; e.g. toList()
+        :param read_only: boolean flag; False for traversals that write to the graph, which are then never retried
+
+        :return: traversal results
+        """
+        return self._with_retries(neptune_endpoint, 'remote_connection', lambda remote_connection: run(traversal().withRemote(remote_connection)),
+                                  retry=lambda: read_only)
+
+    def submit(self, neptune_endpoint, gremlin_query, bindings=None):
+        """
+        Runs a Gremlin query string on the endpoint's shared client; retried on a fresh connection if the connection fails.
+        :param neptune_endpoint: writer or reader Neptune endpoint
+        :param gremlin_query: Gremlin query; e.g. g.V().hasLabel('scooter').limit(5)
+        :param bindings: optional dict of query parameters
+
+        :return: list with all the results
+        """
+        read_only = is_read_only_query(gremlin_query)
+        request_state = {'sent': False}
+
+        def request(gremlin_client):
+            request_state['sent'] = False
+            # Returns once the request is written to the socket: a failure before that is safe to retry, even for writes
+            result_set = gremlin_client.submit(gremlin_query, bindings)
+            request_state['sent'] = True
+
+            return result_set.all().result()
+
+        return self._with_retries(neptune_endpoint, 'client', request, retry=lambda: read_only or not request_state['sent'])
+
+    def submit_many(self, neptune_endpoint, gremlin_queries, raise_connection_errors=False):
+        """
+        Runs many Gremlin query strings concurrently, via the client's async interface; up to query_concurrency at
+        a time (i.e. the client's connections), so wall-clock time is about the slowest query's, not the sum.
+        A failed query does not fail the others.
+        :param neptune_endpoint: writer or reader Neptune endpoint
+        :param gremlin_queries: list of Gremlin queries
+        :param raise_connection_errors: boolean flag to raise the first connection failure (not a query error), after
+                                        all queries are done; e.g. for NeptuneEndpointRouter to fail over to the writer
+
+        :return: list with one dict per query, in order: {'query', 'results', 'error', 'duration_ms'}
+        """
+        with self.metrics.timer('connection_acquisition_ms'):
+            self._check_idle(neptune_endpoint, 'client')
+            gremlin_client = self.client(neptune_endpoint)
+
+        started_at = time.perf_counter()
+        responses = []
+        connection_error = None
+
+        for gremlin_query in gremlin_queries:
+            response = {'query': gremlin_query, 'results': None, 'error': None, 'started_at': time.perf_counter(), 'finished_at': None}
+            responses.append(response)
+
+            try:
+                # Blocks while all the client's connections are busy; i.e. the concurrency limit
+                future_results = gremlin_client.submit_async(gremlin_query).result().all()
+                future_results.add_done_callback(lambda _, response=response: response.update(finished_at=time.perf_counter()))
+                response['future_results'] = future_results
+
+            except Exception as e:
+                response['error'] = str(e)
+                if connection_error is None and not isinstance(e, GremlinServerError):
+                    connection_error = e
+
+        for response in responses:
+            future_results = response.pop('future_results', None)
+
+            try:
+                if future_results is not None:
+                    response['results'] = future_results.result()
+
+            except Exception as e:
+                response['error'] = str(e)
+                if connection_error is None and not isinstance(e, GremlinServerError):
+                    connection_error = e
+
+            finished_at = response.pop('finished_at') or time.perf_counter()
+            response['duration_ms'] = round((finished_at - response.pop('started_at')) * 1000, 3)
+
+        self.metrics.put_metric('query_execution_ms', round((time.perf_counter() - started_at) * 1000, 3), 'Milliseconds')
+
+        if connection_error is not None:
+            # Reopened on next use
+            self.reset(neptune_endpoint)
+
+            if raise_connection_errors:
+                raise connection_error
+        else:
+            self._touch(neptune_endpoint)
+
+        return responses
+
+    def health_check(self, neptune_endpoint, kind='client'):
+        """
+        Runs a trivial query on one of the endpoint's connections. Broken connections are closed, to be reopened on next use.
+        :param neptune_endpoint: writer or reader Neptune endpoint
+        :param kind: client (Gremlin query strings) or remote_connection (traversals); opened if not yet
+
+        :return: True if the endpoint answered, False otherwise
+        """
+        try:
+            connection = self._connection(neptune_endpoint, kind)
+
+            if kind == 'remote_connection':
+                connection.submit_async(traversal().withRemote(connection).inject(0).bytecode).result(timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+            else:
+                connection.submit(HEALTH_CHECK_QUERY).all().result(timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+
+            return True
+
+        except Exception as e:
+            print('Neptune health check failed, reconnecting: {}'.format(e))
+            self.reset(neptune_endpoint)
+            return False
+
+    def reset(self, neptune_endpoint=None):
+        """
+        Closes the connections of an endpoint (or of all endpoints, if None); they are reopened on next use.
+        :param neptune_endpoint: optional writer or reader Neptune endpoint
+        """
+        with self._lock:
+            neptune_endpoints = list(self._endpoints) if neptune_endpoint is None else [neptune_endpoint]
+
+            for endpoint in neptune_endpoints:
+                connections = self._endpoints.pop(endpoint, {})
+
+                for kind in ('remote_connection', 'client'):
+                    if connections.get(kind) is not None:
+                        try:
+                            connections[kind].close()
+                        except Exception as e:
+                            # Already broken; nothing else to release
+                            print('Error while closing Neptune connection: {}'.format(e))
+
+    def close(self):
+        self.reset()
+
+    def _connection(self, neptune_endpoint, kind):
+        with self._lock:
+            connections = self._endpoints.setdefault(neptune_endpoint, {'last_used': time.time()})
+
+            if connections.get(kind) is None:
+                url = '{}://{}:{}/gremlin'.format(NEPTUNE_URL_SCHEME, neptune_endpoint, NEPTUNE_PORT)
+
+                if kind == 'remote_connection':
+                    connections[kind] = DriverRemoteConnection(url, 'g', pool_size=self.pool_size, max_workers=self.max_workers)
+                else:
+                    # One connection per concurrent query; see submit_many
+                    connections[kind] = client.Client(url, 'g', pool_size=max(self.pool_size, self.query_concurrency), max_workers=self.max_workers)
+
+            return connections[kind]
+
+    def _check_idle(self, neptune_endpoint, kind):
+        # Checks the connection about to be used, if open; a new one does not need a check
+        with self._lock:
+            connections = self._endpoints.get(neptune_endpoint) or {}
+            idle_seconds = time.time() - connections['last_used'] if connections.get(kind) is not None else 0
+
+        if idle_seconds > self.health_check_seconds:
+            self.health_check(neptune_endpoint, kind)
+
+    def _touch(self, neptune_endpoint):
+        with self._lock:
+            if neptune_endpoint in self._endpoints:
+                self._endpoints[neptune_endpoint]['last_used'] = time.time()
+
+    def _with_retries(self, neptune_endpoint, kind, request, retry=None):
+        # retry: optional function that returns False if a failed request must not be run again; e.g. a sent write
+        acquisition_started_at = time.perf_counter()
+        self._check_idle(neptune_endpoint, kind)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Incl. idle health check, and reconnection after a failure; the driver opens sockets on first write
+                connection = self._connection(neptune_endpoint, kind)
+                self.metrics.put_metric('connection_acquisition_ms', round((time.perf_counter() - acquisition_started_at) * 1000, 3), 'Milliseconds')
+
+                with self.metrics.timer('query_execution_ms'):
+                    response = request(connection)
+
+                self._touch(neptune_endpoint)
+                return response
+
+            except GremlinServerError:
+                # The query failed, not the connection
+                raise
+
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+
+                if retry is not None and not retry():
+                    # Not run again, e.g. a write that may have run; the broken connection is reopened on next use
+                    self.reset(neptune_endpoint)
+                    raise
+
+                print('Neptune connection failed, reconnecting: {}'.format(e))
+                traceback.print_exc()
+                self.metrics.put_metric('connection_retries', 1)
+                self.reset(neptune_endpoint)
+                acquisition_started_at = time.perf_counter()
+
+
+class NeptuneEndpointRouter:
+    """
+    Routes read-only requests across Neptune reader endpoints (the cluster reader endpoint, or a list of replica
+    endpoints), and everything else to the writer endpoint; each endpoint has its own connections, in the pool.
+    - Balancing: round_robin, or least_outstanding (fewest requests in flight; i.e. concurrent /runQuery queries).
+    - A reader whose connection fails is marked unhealthy for unhealthy_seconds, and the request fails over to the writer.
+    - Reader endpoints, via OS variable neptune_reader_endpoints (comma-separated); without them, all requests go to
+      the writer.
+    """
+
+    BALANCING_MODES = ['round_robin', 'least_outstanding']
+
+    def __init__(self, pool, reader_endpoints=None, balancing=None, unhealthy_seconds=None):
+        """
+        :param pool: NeptuneConnectionPool
+        :param reader_endpoints: optional list of reader endpoints; defaults to OS variable neptune_reader_endpoints
+        :param balancing: round_robin (default) or least_outstanding; OS variable neptune_read_balancing
+        :param unhealthy_seconds: how long a failed reader is skipped; OS variable neptune_unhealthy_seconds, or 30
+        """
+        if reader_endpoints is None:
+            reader_endpoints = [endpoint.strip() for endpoint in os.environ.get('neptune_reader_endpoints', '').split(',') if endpoint.strip()]
+
+        self.pool = pool
+        self.reader_endpoints = list(reader_endpoints)
+        self.balancing = balancing or os.environ.get('neptune_read_balancing') or 'round_robin'
+        self.unhealthy_seconds = float(unhealthy_seconds if unhealthy_seconds is not None
+                                       else os.environ.get('neptune_unhealthy_seconds', 30))
+
+        if self.balancing not in self.BALANCING_MODES:
+            raise ValueError('Balancing must be one of {}, got {}'.format(self.BALANCING_MODES, self.balancing))
+
+        self._next_reader = 0
+        self._outstanding = {endpoint: 0 for endpoint in self.reader_endpoints}
+        self._unhealthy_until = {}
+        self._lock = threading.Lock()
+
+    def run_traversal(self, neptune_endpoint, run, read_only=True):
+        """
+        See NeptuneConnectionPool.run_traversal
+        :param neptune_endpoint: writer endpoint; reads go to a reader endpoint, if any is healthy
+        :param read_only: boolean flag; False for traversals that write to the graph
+        """
+        return self._route(neptune_endpoint, read_only, lambda endpoint: self.pool.run_traversal(endpoint, run, read_only))
+
+    def submit(self, neptune_endpoint, gremlin_query, bindings=None, read_only=False):
+        """
+        See NeptuneConnectionPool.submit
+        :param neptune_endpoint: writer endpoint; reads go to a reader endpoint, if any is healthy
+        :param read_only: boolean flag; True for queries without write steps (see result_cache.is_read_only_query)
+        """
+        return self._route(neptune_endpoint, read_only, lambda endpoint: self.pool.submit(endpoint, gremlin_query, bindings))
+
+    def submit_many(self, neptune_endpoint, gremlin_queries, read_only=False):
+        """
+        See NeptuneConnectionPool.submit_many
+        :param neptune_endpoint: writer endpoint; reads go to a reader endpoint, if any is healthy
+        :param read_only: boolean flag; True if none of the queries writes to the graph
+        """
+        # Connection failures of a reader are raised, for _route to fail over; the writer's are per query, as usual
+        return self._route(neptune_endpoint, read_only,
+                           lambda endpoint: self.pool.submit_many(endpoint, gremlin_queries, raise_connection_errors=endpoint != neptune_endpoint))
+
+    def check_readers(self):
+        """
+        Health-checks every reader endpoint; failed ones are marked unhealthy.
+
+        :return: dict of reader endpoint -> True if healthy
+        """
+        health = {endpoint: self.pool.health_check(endpoint) for endpoint in self.reader_endpoints}
+
+        for endpoint, healthy in health.items():
+            if healthy:
+                self._unhealthy_until.pop(endpoint, None)
+            else:
+                self._mark_unhealthy(endpoint)
+
+        return health
+
+    def reader_endpoint(self):
+        """
+        :return: next healthy reader endpoint, as per the balancing mode; None if there is none
+        """
+        with self._lock:
+            now = time.time()
+            healthy_readers = [endpoint for endpoint in self.reader_endpoints if self._unhealthy_until.get(endpoint, 0) <= now]
+
+            if not healthy_readers:
+                return None
+
+            if self.balancing == 'least_outstanding':
+                return min(healthy_readers, key=lambda endpoint: self._outstanding[endpoint])
+
+            reader = healthy_readers[self._next_reader % len(healthy_readers)]
+            self._next_reader += 1
+
+            return reader
+
+    def _route(self, neptune_endpoint, read_only, request):
+        reader = self.reader_endpoint() if read_only else None
+
+        if reader is None or reader == neptune_endpoint:
+            return request(neptune_endpoint)
+
+        with self._lock:
+            self._outstanding[reader] = self._outstanding.get(reader, 0) + 1
+
+        try:
+            return request(reader)
+
+        except GremlinServerError:
+            # The query failed, not the reader
+            raise
+
+        except Exception as e:
+            print('Neptune reader {} failed, failing over to the writer: {}'.format(reader, e))
+            self._mark_unhealthy(reader)
+
+            return request(neptune_endpoint)
+
+        finally:
+            with self._lock:
+                self._outstanding[reader] -= 1
+
+    def _mark_unhealthy(self, neptune_endpoint):
+        with self._lock:
+            self._unhealthy_until[neptune_endpoint] = time.time() + self.unhealthy_seconds
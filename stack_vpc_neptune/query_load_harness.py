@@ -0,0 +1,353 @@
+import argparse
+import csv
+import glob
+import gzip
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gremlin_python.driver import client
+import neptune_connections
+import lambda_function
+from graph_qa import GraphQAChains
+from question_cache import QuestionCache
+
+"""
+Offline load-test harness for the query Lambda function, against a local Gremlin Server (TinkerGraph) instead of
+Neptune; e.g. to benchmark connection or serialization changes before they ship.
+    - Seeds the graph from the data generator's CSV files (vertices*.csv[.gz] and edges*.csv[.gz]; not partitioned).
+    - Drives lambda_handler with synthetic API Gateway events, for /getScooter, /runQuery and /askGraph, at a given
+      concurrency and (optional) request rate; /askGraph uses a stubbed LLM, with a fixed latency, and Gremlin instead
+      of openCypher (Gremlin Server has no openCypher).
+    - Reports p50/p95/p99 latency, throughput and error rate per endpoint.
+
+    Usage (from this directory); Gremlin Server, with string IDs allowed (the default TinkerGraph only accepts long IDs):
+    $ docker run -p 8182:8182 \
+        -v $PWD/tinkergraph-load-test.properties:/opt/gremlin-server/conf/tinkergraph-empty.properties \
+        tinkerpop/gremlin-server:3.7.2
+    $ python query_load_harness.py --data-dir ../stack_lambda_datagen/data --requests 2000 --concurrency 8 --rate 200
+"""
+
+DEFAULT_ENDPOINT_MIX = {'getScooter': 6, 'runQuery': 3, 'askGraph': 1}
+SEED_BATCH_SIZE = 100
+
+# Synthetic requests
+RUN_QUERY_QUERIES = ["g.V().hasLabel('scooter').count()", "g.V().groupCount().by(label)", "g.E().count()"]
+ASK_GRAPH_QUESTIONS = ['How many scooters do I have?', 'How many scooters are there?', 'Which scooters had a fault?']
+# Query the stubbed LLM "generates" for every question
+STUB_GENERATED_QUERY = "g.V().hasLabel('scooter').count()"
+
+
+class StubGraph:
+    """
+    Stand-in for LangChain's NeptuneGraph: queries and schema fetches go to the local Gremlin Server.
+    """
+
+    def __init__(self, pool, neptune_endpoint):
+        self.pool = pool
+        self.neptune_endpoint = neptune_endpoint
+        self._refresh_schema()
+
+    def query(self, query):
+        return self.pool.submit(self.neptune_endpoint, query)
+
+    @property
+    def get_schema(self):
+        return str(self.schema)
+
+    def _refresh_schema(self):
+        self.schema = self.query('g.V().label().dedup()')
+
+
+class StubAnswerChain:
+    """
+    Stand-in for the LLM chain that phrases the answer, from the query results.
+    """
+    output_key = 'text'
+
+    def __init__(self, llm_latency_seconds):
+        self.llm_latency_seconds = llm_latency_seconds
+
+    def invoke(self, inputs):
+        time.sleep(self.llm_latency_seconds)
+        return {self.output_key: 'Answer: {}'.format(inputs['context'])}
+
+
+class StubQAChain:
+    """
+    Stand-in for NeptuneOpenCypherQAChain: one (stubbed) LLM call to generate the query, one to phrase the answer.
+    """
+    input_key = 'query'
+    output_key = 'result'
+
+    def __init__(self, graph, llm_latency_seconds):
+        self.graph = graph
+        self.qa_chain = StubAnswerChain(llm_latency_seconds)
+        self.llm_latency_seconds = llm_latency_seconds
+
+    def invoke(self, inputs):
+        time.sleep(self.llm_latency_seconds)
+        context = self.graph.query(STUB_GENERATED_QUERY)
+        answer = self.qa_chain.invoke({'question': inputs[self.input_key], 'context': context})
+
+        return {self.output_key: answer[self.qa_chain.output_key], 'intermediate_steps': [{'query': STUB_GENERATED_QUERY}, {'context': context}]}
+
+
+class StubGraphQAChains(GraphQAChains):
+    """
+    GraphQAChains with a stubbed LLM, on the local Gremlin Server; caching as in the Lambda function.
+    """
+
+    def __init__(self, pool, llm_latency_seconds, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+        self.llm_latency_seconds = llm_latency_seconds
+
+    def _build_chain(self, neptune_endpoint, region_name):
+        graph = StubGraph(self.pool, neptune_endpoint)
+
+        return {'graph': graph, 'chain': StubQAChain(graph, self.llm_latency_seconds), 'schema_refreshed_at': time.time()}
+
+
+def read_dataset_rows(data_dir, dataset):
+    """
+    Generator of the rows of the generated CSV files of a dataset; e.g. vertices-00000.csv.gz, vertices-00001.csv.gz
+    :param data_dir: local directory of the data generator output; see datagen_local.py
+    :param dataset: vertices or edges
+
+    :return: dicts, one per row
+    """
+    file_paths = sorted(glob.glob(os.path.join(data_dir, '{}*.csv'.format(dataset))) + glob.glob(os.path.join(data_dir, '{}*.csv.gz'.format(dataset))))
+
+    for file_path in file_paths:
+        with (gzip.open(file_path, 'rt', newline='') if file_path.endswith('.gz') else open(file_path, newline='')) as csv_file:
+            yield from csv.DictReader(csv_file)
+
+
+def seed_queries(rows, dataset):
+    """
+    Batches of Gremlin scripts, with bindings, that add the rows of a dataset; one script per SEED_BATCH_SIZE rows.
+    Rows are deduplicated by ~id; e.g. shared vertices written by every shard, or merged files next to their parts.
+    :param rows: dicts; see read_dataset_rows
+    :param dataset: vertices or edges
+
+    :return: generator of (script, bindings, number of rows)
+    """
+    seen_ids = set()
+    steps, bindings = [], {}
+
+    for row in rows:
+        if row['~id'] in seen_ids:
+            continue
+        seen_ids.add(row['~id'])
+
+        i = len(steps)
+        bindings.update({'l{}'.format(i): row['~label'], 'i{}'.format(i): row['~id']})
+
+        if dataset == 'vertices':
+            step = '.addV(l{0}).property(T.id, i{0})'.format(i)
+            for j, (name, value) in enumerate((name, value) for name, value in row.items() if not name.startswith('~') and value):
+                bindings.update({'k{}_{}'.format(i, j): name, 'v{}_{}'.format(i, j): value})
+                step += '.property(k{0}_{1}, v{0}_{1})'.format(i, j)
+        else:
+            bindings.update({'f{}'.format(i): row['~from'], 't{}'.format(i): row['~to']})
+            step = '.V(f{0}).addE(l{0}).to(__.V(t{0})).property(T.id, i{0})'.format(i)
+
+        steps.append(step)
+
+        if len(steps) == SEED_BATCH_SIZE:
+            yield 'g' + ''.join(steps) + '.count()', bindings, len(steps)
+            steps, bindings = [], {}
+
+    if steps:
+        yield 'g' + ''.join(steps) + '.count()', bindings, len(steps)
+
+
+def seed_graph(gremlin_client, data_dir):
+    """
+    Loads the generated dataset into the local Gremlin Server; vertices first, then edges.
+
+    :return: dict with the number of vertices and edges added, and a sample of scooter asset codes
+    """
+    counts = {}
+    scooter_asset_codes = []
+
+    for dataset in ('vertices', 'edges'):
+        rows = read_dataset_rows(data_dir, dataset)
+
+        if dataset == 'vertices':
+            def sample_scooters(rows):
+                for row in rows:
+                    if row['~label'] == 'scooter' and len(scooter_asset_codes) < 1000:
+                        scooter_asset_codes.append(row['~id'])
+                    yield row
+
+            rows = sample_scooters(rows)
+
+        counts[dataset] = 0
+        for script, bindings, number_of_rows in seed_queries(rows, dataset):
+            try:
+                gremlin_client.submit(script, bindings).all().result()
+            except Exception as e:
+                # e.g. Expected an id that is convertible to Long but received class java.lang.String
+                if 'convertible to Long' in str(e):
+                    raise RuntimeError('Gremlin Server rejected the string IDs of the dataset; start it with '
+                                       'tinkergraph-load-test.properties (see usage)') from e
+                raise
+            counts[dataset] += number_of_rows
+
+    counts['scooter_asset_codes'] = scooter_asset_codes
+
+    return counts
+
+
+def synthetic_event(endpoint, neptune_endpoint, scooter_asset_codes, rng):
+    """
+    :param endpoint: getScooter, runQuery or askGraph
+    :param neptune_endpoint: Gremlin Server host
+    :param scooter_asset_codes: asset codes to pick from, for /getScooter
+
+    :return: API Gateway event
+    """
+    query_string_parameters = {'neptune_endpoint': neptune_endpoint}
+
+    if endpoint == 'getScooter':
+        query_string_parameters['scooter_asset_code'] = rng.choice(scooter_asset_codes or ['scooter-unknown'])
+    elif endpoint == 'runQuery':
+        query_string_parameters['gremlin_query'] = rng.choice(RUN_QUERY_QUERIES)
+    elif endpoint == 'askGraph':
+        query_string_parameters['llm_query'] = rng.choice(ASK_GRAPH_QUESTIONS)
+    else:
+        raise ValueError('Unknown endpoint: {}'.format(endpoint))
+
+    return {'path': '/' + endpoint, 'queryStringParameters': query_string_parameters}
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile
+    :param sorted_values: list of numbers, sorted
+    :param percent: e.g. 95
+
+    :return: number, or None if there are no values
+    """
+    if not sorted_values:
+        return None
+
+    return sorted_values[max(int(math.ceil(percent / 100 * len(sorted_values))) - 1, 0)]
+
+
+def latency_report(samples, wall_seconds):
+    """
+    :param samples: list of (endpoint, latency in ms, boolean flag; True if successful)
+    :param wall_seconds: duration of the whole run
+
+    :return: dict of endpoint (and "total") -> requests, errors, error_rate, throughput_rps, p50_ms, p95_ms, p99_ms
+    """
+    report = {}
+    endpoints = sorted(set(endpoint for endpoint, _, _ in samples))
+
+    for endpoint in endpoints + ['total']:
+        endpoint_samples = [sample for sample in samples if endpoint in ('total', sample[0])]
+        latencies = sorted(latency for _, latency, _ in endpoint_samples)
+        errors = sum(1 for _, _, ok in endpoint_samples if not ok)
+
+        report[endpoint] = {
+            'requests': len(endpoint_samples),
+            'errors': errors,
+            'error_rate': round(errors / len(endpoint_samples), 4) if endpoint_samples else 0.0,
+            'throughput_rps': round(len(endpoint_samples) / wall_seconds, 1) if wall_seconds else None,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99)
+            }
+
+    return report
+
+
+def run_load_test(handler, events, concurrency=8, rate=None):
+    """
+    Invokes the handler with every event; open loop if rate is set, i.e. event i starts at i / rate seconds,
+    or as soon as one of the concurrency workers is free.
+    :param handler: Lambda handler; e.g. lambda_function.lambda_handler
+    :param events: list of (endpoint, API Gateway event)
+    :param concurrency: number of concurrent invocations
+    :param rate: optional target requests per second, across all endpoints
+
+    :return: latency report; see latency_report
+    """
+    start_time = time.perf_counter()
+
+    def invoke(i, endpoint, event):
+        if rate:
+            time.sleep(max(start_time + i / rate - time.perf_counter(), 0))
+
+        invoked_at = time.perf_counter()
+        try:
+            response = handler(event, None)
+            ok = response['statusCode'] < 400 and response['body'] is not None
+
+        except Exception as e:
+            print('Error while invoking {}: {}'.format(endpoint, e))
+            ok = False
+
+        return endpoint, round((time.perf_counter() - invoked_at) * 1000, 3), ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(invoke, i, endpoint, event) for i, (endpoint, event) in enumerate(events)]
+        samples = [future.result() for future in futures]
+
+    return latency_report(samples, time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-tests the query Lambda function against a local Gremlin Server.')
+    parser.add_argument('--data-dir', default=None, help='data generator output, to seed the graph with; skip seeding if not set')
+    parser.add_argument('--gremlin-host', default='localhost', help='Gremlin Server host; passed as neptune_endpoint')
+    parser.add_argument('--gremlin-port', type=int, default=8182, help='Gremlin Server port')
+    parser.add_argument('--url-scheme', default='ws', help='ws, or wss for a TLS-enabled Gremlin Server')
+    parser.add_argument('--requests', type=int, default=1000, help='total number of requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent invocations')
+    parser.add_argument('--rate', type=float, default=None, help='target requests per second; as fast as possible if not set')
+    parser.add_argument('--mix', type=json.loads, default=DEFAULT_ENDPOINT_MIX, help='endpoint weights; e.g. \'{"getScooter": 1}\'')
+    parser.add_argument('--llm-latency-ms', type=float, default=500, help='latency of each stubbed LLM call')
+    parser.add_argument('--result-cache', action='store_true', help='enable the result cache; off by default, to measure Gremlin round trips')
+    parser.add_argument('--seed', type=int, default=None, help='seed, for a reproducible request sequence')
+    parser.add_argument('--output', default=None, help='optional JSON file for the report')
+    args = parser.parse_args()
+
+    # The Lambda function connects to the local Gremlin Server, instead of Neptune
+    neptune_connections.NEPTUNE_URL_SCHEME = args.url_scheme
+    neptune_connections.NEPTUNE_PORT = args.gremlin_port
+    lambda_function.graph_qa_chains = StubGraphQAChains(lambda_function.neptune_pool, args.llm_latency_ms / 1000, question_cache=QuestionCache())
+    lambda_function.result_cache.enabled = args.result_cache
+
+    scooter_asset_codes = []
+    if args.data_dir:
+        gremlin_client = client.Client('{}://{}:{}/gremlin'.format(args.url_scheme, args.gremlin_host, args.gremlin_port), 'g')
+        try:
+            seed_counts = seed_graph(gremlin_client, args.data_dir)
+        finally:
+            gremlin_client.close()
+
+        scooter_asset_codes = seed_counts.pop('scooter_asset_codes')
+        print('Seeded {} vertices and {} edges'.format(seed_counts['vertices'], seed_counts['edges']))
+
+    rng = random.Random(args.seed)
+    endpoints = rng.choices(list(args.mix), weights=list(args.mix.values()), k=args.requests)
+    events = [(endpoint, synthetic_event(endpoint, args.gremlin_host, scooter_asset_codes, rng)) for endpoint in endpoints]
+
+    report = run_load_test(lambda_function.lambda_handler, events, args.concurrency, args.rate)
+    lambda_function.neptune_pool.close()
+
+    print(json.dumps(report, indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import json
+import math
+import os
+import re
+import threading
+import traceback
+from collections import OrderedDict
+
+"""
+Cache of natural-language questions to the openCypher queries generated for them by the LLM, for /askGraph.
+    - Questions are normalized (case, spacing, trailing punctuation) before lookup; e.g. "How many scooters do I have?"
+      and "how many scooters do i have" share an entry.
+    - Entries are scoped, e.g. by Neptune endpoint and graph schema: a query generated from one graph's schema is only
+      served for that same graph; see GraphQAChains.ask in graph_qa.py
+    - Optional semantic matching: with an embed function (e.g. Amazon Titan embeddings, via Bedrock), a question also
+      matches a cached one whose embedding is at least similarity_threshold close (cosine).
+    - Size-bounded, least recently used entries are evicted first. Kept in memory; optionally also in a local JSON file
+      (e.g. under /tmp, which outlives warm invocations), to survive cold starts on a build box or in tests.
+    - Queries that write to the graph are never cached.
+"""
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+WRITE_QUERY_PATTERN = re.compile(r'\b(CREATE|MERGE|DELETE|DETACH|SET|REMOVE|DROP|LOAD)\b', re.IGNORECASE)
+
+
+def normalize_question(question):
+    """
+    :param question: natural-language question; e.g. " How many  scooters do I have? "
+
+    :return: normalized question; e.g. "how many scooters do i have"
+    """
+    return re.sub(r'\s+', ' ', question.strip().lower()).rstrip(' ?!.')
+
+
+def question_key(question, scope=None):
+    """
+    :param question: natural-language question
+    :param scope: optional scope; e.g. db-endpoint@3f2a9c1b7d4e
+
+    :return: cache key; e.g. "db-endpoint@3f2a9c1b7d4e how many scooters do i have"
+    """
+    normalized_question = normalize_question(question)
+
+    return normalized_question if scope is None else '{} {}'.format(scope, normalized_question)
+
+
+def cosine_similarity(vector_a, vector_b):
+    dot_product = sum(a * b for a, b in zip(vector_a, vector_b))
+    norms = math.sqrt(sum(a * a for a in vector_a)) * math.sqrt(sum(b * b for b in vector_b))
+
+    return dot_product / norms if norms else 0.0
+
+
+class QuestionCache:
+    """
+    Scope and normalized question -> {'query': openCypher, 'embedding': optional vector, 'scope': ...}; LRU-ordered.
+    """
+
+    def __init__(self, max_entries=None, embed=None, similarity_threshold=None, file_path=None):
+        """
+        :param max_entries: max cached questions; defaults to OS variable question_cache_max_entries, or 256
+        :param embed: optional function that takes a question and returns its embedding (list of floats)
+        :param similarity_threshold: min cosine similarity for a semantic hit; OS variable question_cache_similarity_threshold
+        :param file_path: optional local JSON file, to persist the cache; OS variable question_cache_file
+        """
+        self.max_entries = int(max_entries or os.environ.get('question_cache_max_entries') or DEFAULT_MAX_ENTRIES)
+        self.embed = embed
+        self.similarity_threshold = float(similarity_threshold or os.environ.get('question_cache_similarity_threshold')
+                                          or DEFAULT_SIMILARITY_THRESHOLD)
+        self.file_path = file_path if file_path is not None else os.environ.get('question_cache_file')
+        self.stats = {'hits': 0, 'semantic_hits': 0, 'misses': 0, 'evictions': 0}
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, question, scope=None):
+        """
+        :param question: natural-language question
+        :param scope: optional scope; only entries of the same scope match, incl. semantic matches
+
+        :return: cached openCypher query, or None
+        """
+        key = question_key(question, scope)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._entries[key]['query']
+
+        if self.embed is not None and self._entries:
+            embedding = self._embed(question)
+
+            with self._lock:
+                similarities = [(cosine_similarity(embedding, entry['embedding']), cached_key)
+                                for cached_key, entry in self._entries.items()
+                                if embedding and entry.get('embedding') and entry.get('scope') == scope]
+
+                if similarities:
+                    similarity, cached_key = max(similarities)
+
+                    if similarity >= self.similarity_threshold:
+                        self._entries.move_to_end(cached_key)
+                        self.stats['semantic_hits'] += 1
+                        return self._entries[cached_key]['query']
+
+        self.stats['misses'] += 1
+
+        return None
+
+    def put(self, question, query, scope=None):
+        """
+        :param question: natural-language question
+        :param query: openCypher query generated for it; not cached if it writes to the graph
+        :param scope: optional scope; e.g. the Neptune endpoint and graph schema the query was generated from
+
+        :return: True if cached
+        """
+        if not query or WRITE_QUERY_PATTERN.search(query):
+            return False
+
+        key = question_key(question, scope)
+        embedding = self._embed(question) if self.embed is not None else None
+
+        with self._lock:
+            self._entries[key] = {'query': query, 'embedding': embedding, 'scope': scope}
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+            self._save()
+
+        return True
+
+    def invalidate(self, question=None, scope=None):
+        """
+        Drops one question, or all of them if None; e.g. when a cached query fails, or the schema changes.
+        :param question: optional natural-language question
+        :param scope: optional scope of the question
+        """
+        with self._lock:
+            if question is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(question_key(question, scope), None)
+
+            self._save()
+
+    def _embed(self, question):
+        try:
+            return self.embed(normalize_question(question))
+
+        except Exception as e:
+            # Exact matching still works
+            print('Error while embedding question: {}'.format(e))
+            traceback.print_exc()
+
+    def _load(self):
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+
+        try:
+            with open(self.file_path) as cache_file:
+                self._entries = OrderedDict(json.load(cache_file))
+
+        except Exception as e:
+            print('Error while loading the question cache, starting empty: {}'.format(e))
+            self._entries = OrderedDict()
+
+    def _save(self):
+        if not self.file_path:
+            return
+
+        temp_file_path = self.file_path + '.tmp'
+        with open(temp_file_path, 'w') as cache_file:
+            json.dump(list(self._entries.items()), cache_file)
+
+        os.replace(temp_file_path, self.file_path)
@@ -0,0 +1,217 @@
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+"""
+Result cache for read-only queries (/getScooter, /getScooters, /runQuery): the graph only changes with a new bulk load.
+    - Keys are the normalized query text (or asset codes) and parameters; values are encoded response bodies.
+    - Every entry is tagged with the dataset generation it was read from. The generation is bumped by the data
+      generator once a run's manifest is written, and by /refreshSchema after a load (see DatasetGeneration); the
+      container that bumps it stops serving the previous generation's results at once.
+      Other Lambda containers read it from SSM at most every dataset_generation_check_seconds (OS variable; 30 by
+      default, set by the stack): they may serve the previous generation's results for up to that long. Set it to 0
+      to read the generation on every cached request, at the cost of one SSM call each.
+    - Queries that write to the graph bypass the cache; so do bodies with failed queries (see has_query_errors).
+    - Backends: in-process LRU (default; kept across warm invocations). A shared backend (e.g. Redis) only needs get/set.
+"""
+
+DEFAULT_MAX_ENTRIES = 1024
+# How long the generation is trusted before it is read again from SSM; i.e. the staleness bound of other containers
+DEFAULT_GENERATION_CHECK_SECONDS = 30
+
+# Gremlin steps that write to the graph
+GREMLIN_WRITE_STEPS_PATTERN = re.compile(r'\b(addV|addE|property|drop|mergeV|mergeE|io)\s*\(')
+# Quoted string literals, kept as is by normalize_query
+STRING_LITERAL_PATTERN = re.compile(r'''('(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")''')
+
+
+def normalize_query(query):
+    """
+    Collapses the whitespace of a query, outside of string literals; e.g. "g.V()\n    .count()" -> "g.V() .count()"
+    :param query: Gremlin query
+
+    :return: str
+    """
+    parts = STRING_LITERAL_PATTERN.split(query.strip())
+
+    # Odd parts are string literals
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+
+
+def is_read_only_query(query):
+    """
+    :param query: Gremlin query
+
+    :return: False if the query has steps that write to the graph; e.g. addV, property, drop
+    """
+    return not any(GREMLIN_WRITE_STEPS_PATTERN.search(part) for part in STRING_LITERAL_PATTERN.split(query)[::2])
+
+
+def has_query_errors(body):
+    """
+    :param body: JSON response body with one result per query; see run_gremlin_queries in lambda_function.py
+
+    :return: True if any query failed; e.g. a timeout or a broken connection, which must not be cached
+    """
+    return any(response.get('error') for response in json.loads(body).get('results', []))
+
+
+class LRUBackend:
+    """
+    In-process, size-bounded backend; least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = int(max_entries)
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def new_dataset_generation():
+    """
+    :return: unique generation; e.g. 20261018T101500-1a2b3c4d. Not derived from the current one, so that concurrent
+             bumps (e.g. the data generator and /refreshSchema) never end up with the same generation
+    """
+    return '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S', time.gmtime()), uuid.uuid4().hex[:8])
+
+
+class DatasetGeneration:
+    """
+    Dataset generation; i.e. an ID of the data loaded. Kept in an SSM parameter if OS variable
+    dataset_generation_parameter is set, so that all Lambda containers (and the data generator) share it; in memory otherwise.
+    """
+
+    def __init__(self, parameter_name=None, check_seconds=None, ssm_client=None):
+        """
+        :param parameter_name: optional SSM parameter name; e.g. /scooters-graph/dataset-generation
+        :param check_seconds: how long a generation read from SSM is trusted; OS variable dataset_generation_check_seconds
+        :param ssm_client: optional boto3 SSM client
+        """
+        self.parameter_name = parameter_name if parameter_name is not None else os.environ.get('dataset_generation_parameter')
+        self.check_seconds = float(check_seconds if check_seconds is not None
+                                   else os.environ.get('dataset_generation_check_seconds', DEFAULT_GENERATION_CHECK_SECONDS))
+        self.ssm_client = ssm_client
+
+        self._generation = '0'
+        self._checked_at = None
+
+    def current(self):
+        """
+        :return: current generation; str
+        """
+        if self.parameter_name and (self._checked_at is None or time.time() - self._checked_at > self.check_seconds):
+            try:
+                response = self._ssm().get_parameter(Name=self.parameter_name)
+                self._generation = response['Parameter']['Value']
+
+            except Exception as e:
+                # Keep the last known generation; checked again later
+                print('Error while reading the dataset generation: {}'.format(e))
+                traceback.print_exc()
+
+            self._checked_at = time.time()
+
+        return self._generation
+
+    def bump(self):
+        """
+        Starts a new generation; e.g. after a new bulk load. All cached results become stale.
+
+        :return: new generation; str
+        """
+        generation = new_dataset_generation()
+
+        if self.parameter_name:
+            self._ssm().put_parameter(Name=self.parameter_name, Value=generation, Type='String', Overwrite=True)
+
+        self._generation = generation
+        self._checked_at = time.time()
+
+        return generation
+
+    def _ssm(self):
+        if self.ssm_client is None:
+            # boto3 is imported on first use, to keep it out of the cold start of uncached paths
+            import boto3
+            self.ssm_client = boto3.client('ssm')
+
+        return self.ssm_client
+
+
+class ResultCache:
+    """
+    Response bodies of read-only queries, tagged with the dataset generation.
+    """
+
+    def __init__(self, backend=None, generation=None, enabled=None):
+        """
+        :param backend: optional backend with get(key) and set(key, value); defaults to an LRUBackend of
+                        result_cache_max_entries (OS variable) entries
+        :param generation: optional DatasetGeneration
+        :param enabled: boolean flag; defaults to OS variable result_cache_enabled, or True
+        """
+        self.backend = backend if backend is not None else LRUBackend(os.environ.get('result_cache_max_entries') or DEFAULT_MAX_ENTRIES)
+        self.generation = generation if generation is not None else DatasetGeneration()
+        self.enabled = enabled if enabled is not None else os.environ.get('result_cache_enabled', 'true').lower() == 'true'
+        self.stats = {'hits': 0, 'misses': 0, 'bypasses': 0}
+
+    def get_or_run(self, key_parts, run, cacheable=True, cache_if=None):
+        """
+        Returns the cached response body for a query, or runs the query and caches its body.
+        :param key_parts: JSON-serializable values identifying the query; e.g. [path, endpoint, normalized query]
+        :param run: function that runs the query and returns its response body; None (i.e. an error) is not cached
+        :param cacheable: boolean flag; False for queries that write to the graph
+        :param cache_if: optional function that takes the response body, and returns False if it must not be cached;
+                         e.g. not has_query_errors(body)
+
+        :return: response body
+        """
+        if not (self.enabled and cacheable):
+            self.stats['bypasses'] += 1
+            return run()
+
+        key = json.dumps(key_parts, sort_keys=True, separators=(',', ':'))
+        generation = self.generation.current()
+        cached = self.backend.get(key)
+
+        if cached is not None and cached['generation'] == generation:
+            self.stats['hits'] += 1
+            return cached['body']
+
+        self.stats['misses'] += 1
+        body = run()
+
+        if body is not None and (cache_if is None or cache_if(body)):
+            self.backend.set(key, {'generation': generation, 'body': body})
+
+        return body
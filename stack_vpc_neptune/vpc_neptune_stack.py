@@ -16,6 +16,7 @@ from aws_cdk import (
     aws_lambda_python_alpha as _alambda,
     aws_lambda as _lambda,
     aws_apigateway as apigateway,
+    aws_ssm as ssm,
 )
 
 class VpcNeptuneStack(Stack):
@@ -157,6 +158,12 @@ class VpcNeptuneStack(Stack):
         @ Lambda fn creation - DB Queries:
         """
 
+        # Fetch dataset generation (see S3 stack), bumped by the data generator and after each bulk load (see
+        # refreshSchema API): cached query results of previous generations are no longer served
+        dataset_generation = ssm.StringParameter.from_string_parameter_attributes(self, "DatasetGeneration",
+                                                                                  parameter_name=Fn.import_value("dataset-generation-parameter"),
+                                                                                  simple_name=True)
+
         # Create DB Query function
         lambda_fn = _alambda.PythonFunction(
             self,
@@ -168,9 +175,20 @@ class VpcNeptuneStack(Stack):
             index="lambda_function.py",
             handler="lambda_handler",
             timeout=Duration.seconds(600),
-            memory_size=2048
+            memory_size=2048,
+            environment={
+                "dataset_generation_parameter": dataset_generation.parameter_name,
+                # Other containers may serve the previous generation's cached results for up to this long; 0 to never
+                "dataset_generation_check_seconds": input_metadata.get('lambda_query_generation_check_seconds') or '30',
+                # Read-only queries are balanced across the read replicas, via the cluster reader endpoint
+                "neptune_reader_endpoints": db_cluster.cluster_read_endpoint.hostname
+            }
         )
 
+        # Grant Lambda to read and bump the dataset generation
+        dataset_generation.grant_read(lambda_fn)
+        dataset_generation.grant_write(lambda_fn)
+
         # Grant Lambda to access Amazon Bedrock
         lambda_fn.add_to_role_policy(iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
@@ -234,9 +252,24 @@ class VpcNeptuneStack(Stack):
         rest_get_scooter.add_method("GET", api_get_scooters,
                             request_parameters={
                                  "method.request.querystring.scooter_asset_code": True,
-                                 "method.request.querystring.neptune_endpoint": True
+                                 "method.request.querystring.neptune_endpoint": True,
+                                 "method.request.querystring.max_depth": False,
+                                 "method.request.querystring.page_size": False,
+                                 "method.request.querystring.cursor": False,
+                                 "method.request.querystring.properties": False
                                  })
         
+        # Add GET method, to query many Scooters at once, by comma-separated asset code ids:
+        rest_get_scooters = api.root.add_resource('getScooters')
+        rest_get_scooters.add_method("GET", api_get_scooters,
+                            request_parameters={
+                                 "method.request.querystring.scooter_asset_codes": True,
+                                 "method.request.querystring.neptune_endpoint": True,
+                                 "method.request.querystring.max_depth": False,
+                                 "method.request.querystring.page_size": False,
+                                 "method.request.querystring.properties": False
+                                 })
+
         # Add GET method, to run open Gremlin queries:
         rest_run_query = api.root.add_resource('runQuery')
         rest_run_query.add_method("GET", api_get_scooters,
@@ -250,6 +283,13 @@ class VpcNeptuneStack(Stack):
         rest_ask_graph.add_method("GET", api_get_scooters,
                             request_parameters={
                                  "method.request.querystring.llm_query": True,
+                                 "method.request.querystring.neptune_endpoint": True
+                                 })
+
+        # Add GET method, to refresh the graph schema used by askGraph; e.g. after a new bulk load
+        rest_refresh_schema = api.root.add_resource('refreshSchema')
+        rest_refresh_schema.add_method("GET", api_get_scooters,
+                            request_parameters={
                                  "method.request.querystring.neptune_endpoint": True
                                  })               
                                  
@@ -1,23 +1,460 @@
+import gzip
+import io
+import json
 import os
 import sys
+import tempfile
 import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'stack_lambda_datagen'))
+import lambda_function
+import datagen_local
+import datagen_benchmark
+import datagen_metrics
+import datagen_profiler
+from datagen_writers import S3MultipartUpload, CsvDatasetWriter
+
+
+class FakeS3Client:
+    """
+    In-memory stand-in for the boto3 S3 client calls used by the streaming writers
+    """
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.uploads[Key] = []
+        return {'UploadId': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId].append(Body)
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.objects[Key] = b''.join(self.uploads.pop(UploadId))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
 
 
 class TestLambdaFunction(unittest.TestCase):
     def test_lambda_function(self):
-        pass
-        # TODO: implement unit tests for lambda_function.py
-        # self.assertEqual(1, 1)
+        df = lambda_function.generate_scooter_batch(200, 5, rng=np.random.default_rng(7))
+
+        self.assertEqual(list(df.columns), ['~label', '~id', 'parent_id', 'name'])
+        self.assertEqual((df['~label'] == 'scooter').sum(), 200)
+        self.assertEqual(df['~label'].str.startswith('part_').sum(), 200 * 5)
+
+        # Every non-root vertex points to a generated parent
+        children = df[df.parent_id != 'None']
+        self.assertTrue(children.parent_id.isin(set(df['~id'])).all())
+
+    def test_tree_matches_batch_for_the_same_seed(self):
+        trees = [lambda_function.generate_scooter_tree(3, False, lambda_function.ScooterIdAllocator(seed=42), scooter_number) for scooter_number in range(3)]
+        chunks = lambda_function.generate_scooter_chunks(3, 3, chunk_size=1, id_allocator=lambda_function.ScooterIdAllocator(seed=42))
+        self.assertEqual(trees, [chunk.to_dict('records') for chunk in chunks])
+
+        # Shared assets come from the pools
+        manufacturers = set(lambda_function.ScooterIdAllocator(seed=42).shared_vertices()['~id'])
+        self.assertTrue(all(record['~id'] in manufacturers for tree in trees for record in tree if record['~label'] == 'manufacturer'))
+
+        # Show-tree path: the same vertices as the streamed dataset
+        with mock.patch('builtins.print'):
+            df_tree = lambda_function.generate_scooter_vertices(250, 3, None, None, write_to_s3=False, show_tree_on_screen=True, seed=42, chunk_size=100)
+        with tempfile.TemporaryDirectory() as output_dir:
+            lambda_function.stream_scooter_dataset(250, 3, None, None, write_to_s3=False, chunk_size=100, output_dir=output_dir, seed=42)
+            df_vertices = pd.read_csv(os.path.join(output_dir, 'vertices.csv'))
+
+        # Shared vertices are written once by the stream, for every pool member: compared on the other vertices only
+        unique_tree_vertices = df_tree[~df_tree['~label'].isin(lambda_function.SHARED_VERTEX_LABELS)]
+        unique_vertices = df_vertices[~df_vertices['~label'].isin(lambda_function.SHARED_VERTEX_LABELS)]
+        self.assertEqual(sorted(unique_tree_vertices['~id']), sorted(unique_vertices['~id']))
+
+    def test_batch_matches_tree_probabilities(self):
+        number_of_scooters, number_of_parts_per_scooter = 20000, 3
+        batch = lambda_function.generate_scooter_batch(number_of_scooters, number_of_parts_per_scooter, rng=np.random.default_rng(7))
+        label_rates = batch['~label'].value_counts() / number_of_scooters
+        id_rates = batch['~id'].value_counts() / number_of_scooters
+
+        # Per scooter, as the if/elif chains of randomize_chances() checks
+        in_transit, in_transit_without_weather = 3 / 4, 1 / 4
+        warehouse, parking_station, maintenance_center, back_on_streets = [p * in_transit_without_weather for p in lambda_function.cascade_probabilities([10, 2, 10])]
+        sunny, cloudy, rainy = [p * in_transit for p in lambda_function.cascade_probabilities([3, 2])]
+        expected_label_rates = {
+            'scooter': 1, 'driver': 1, 'payment_method': 1, 'fleet_owner': 1,
+            'incident': 1 / 11, 'legal_case': 1 / 11,
+            'manufacturer': number_of_parts_per_scooter, 'legal_warranty': number_of_parts_per_scooter,
+            'in_transit_journey': in_transit + back_on_streets,
+            'weather_sunny': sunny, 'weather_cloudy': cloudy, 'weather_rainy': rainy,
+            'warehouse': warehouse, 'parking_station': parking_station, 'maintenance_center': maintenance_center,
+            'fault': 1 / 5, 'warranty': 1 / 5, 'claim_fault': 1 / 25
+        }
+        expected_id_rates = dict(zip(lambda_function.PAYMENT_METHOD_VERTICES, lambda_function.cascade_probabilities([4, 3, 3])))
+        expected_id_rates.update(zip(lambda_function.FLEET_OWNER_VERTICES, lambda_function.cascade_probabilities([4, 3])))
+
+        for label, expected_rate in expected_label_rates.items():
+            self.assertAlmostEqual(label_rates.get(label, 0), expected_rate, delta=0.015, msg=label)
+        for vertex_id, expected_rate in expected_id_rates.items():
+            self.assertAlmostEqual(id_rates.get(vertex_id, 0), expected_rate, delta=0.015, msg=vertex_id)
+        for part_label in lambda_function.PART_LABELS:
+            self.assertAlmostEqual(label_rates.get(part_label, 0), number_of_parts_per_scooter / len(lambda_function.SCOOTER_PARTS), delta=0.015, msg=part_label)
+
+    def test_generate_scooter_chunks_is_reproducible(self):
+        first_run = pd.concat(lambda_function.generate_scooter_chunks(300, 2, chunk_size=100, id_allocator=lambda_function.ScooterIdAllocator(seed=42)))
+        second_run = pd.concat(lambda_function.generate_scooter_chunks(300, 2, chunk_size=100, id_allocator=lambda_function.ScooterIdAllocator(seed=42)))
+
+        pd.testing.assert_frame_equal(first_run, second_run)
+
+    def test_scooter_ids_do_not_collide_across_shards(self):
+        id_allocator = lambda_function.ScooterIdAllocator(seed=42, asset_pools={'manufacturer': 3})
+        shards = [pd.concat(lambda_function.generate_scooter_chunks(count, 4, 50, id_allocator, start))
+                  for start, count in (lambda_function.shard_scooter_range(500, 3, shard_id) for shard_id in range(3))]
+        df = pd.concat(shards)
+
+        # Only shared vertices (pools, weather, payment methods, fleet owners) may repeat
+        shared_labels = ['manufacturer', 'warehouse', 'parking_station', 'maintenance_center', 'weather_sunny', 'weather_cloudy',
+                         'weather_rainy', 'payment_method', 'fleet_owner']
+        unique_vertices = df[~df['~label'].isin(shared_labels)]
+        self.assertFalse(unique_vertices['~id'].duplicated().any())
+        self.assertEqual(df[df['~label'] == 'manufacturer']['~id'].nunique(), 3)
+
+    def test_shared_vertices_are_written_once(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            lambda_function.stream_scooter_dataset(300, 3, None, None, False, chunk_size=100, output_dir=output_dir, seed=42)
+            df_vertices = pd.read_csv(os.path.join(output_dir, 'vertices.csv'))
+            df_edges = pd.read_csv(os.path.join(output_dir, 'edges.csv'))
+
+        self.assertFalse(df_vertices['~id'].duplicated().any())
+        self.assertEqual((df_vertices['~label'] == 'fleet_owner').sum(), len(lambda_function.FLEET_OWNER_VERTICES))
+
+        # Every scooter still has its fleet owner, as an edge
+        self.assertEqual(df_edges['~to'].str.startswith('fleet_owner-').sum(), 300)
+        self.assertTrue(df_edges['~to'].isin(set(df_vertices['~id'])).all())
+
+    def test_generate_scooter_tree(self):
+        records = lambda_function.generate_scooter_tree(4, False)
+        ids = set(record['~id'] for record in records)
+
+        self.assertEqual(records[0]['parent_id'], 'None')
+        self.assertEqual(sum(record['~label'].startswith('part_') for record in records), 4)
+        self.assertTrue(all(record['parent_id'] in ids for record in records[1:]))
+
+        # The tree is only built, and printed, on request
+        with mock.patch('builtins.print') as mock_print:
+            tree_records = lambda_function.generate_scooter_tree(4, True)
+        self.assertEqual(mock_print.call_count, len(tree_records))
+
+    def test_cascade_probabilities(self):
+        np.testing.assert_allclose(lambda_function.cascade_probabilities([4, 3]), [1 / 5, 1 / 5, 3 / 5])
+        self.assertAlmostEqual(sum(lambda_function.LOCATION_PROBABILITIES), 1.0)
     
+    def test_generate_scooter_chunks(self):
+        chunks = list(lambda_function.generate_scooter_chunks(250, 2, chunk_size=100))
+
+        self.assertEqual([(chunk['~label'] == 'scooter').sum() for chunk in chunks], [100, 100, 50])
+
+    def test_s3_multipart_csv_writer(self):
+        s3_client = FakeS3Client()
+        df = lambda_function.generate_scooter_batch(100, 2)
+
+        # Force one part per chunk; the CSV header is written only once
+        with CsvDatasetWriter(S3MultipartUpload('bucket', 'data/vertices.csv', s3_client=s3_client)) as writer:
+            writer.sink.part_size_bytes = 1
+            writer.write(df)
+            writer.write(df)
+
+        csv_lines = s3_client.objects['data/vertices.csv'].decode('utf-8').splitlines()
+        self.assertEqual(csv_lines[0], '~label,~id,parent_id,name')
+        self.assertEqual(len(csv_lines), 1 + 2 * len(df.index))
+        self.assertEqual(writer.rows_written, 2 * len(df.index))
+        self.assertEqual(s3_client.uploads, {})
+
+    def test_generate_local_dataset(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            manifest = datagen_local.generate_local_dataset(60, 2, output_dir, workers=2, seed=7, merge=True)
+
+            with open(os.path.join(output_dir, 'vertices.csv')) as vertices_file:
+                vertices_lines = vertices_file.read().splitlines()
+            with open(os.path.join(output_dir, 'edges.csv')) as edges_file:
+                edges_header = edges_file.readline().strip()
+            file_names = sorted(os.listdir(output_dir))
+
+        self.assertEqual([shard['scooters'] for shard in manifest['shards']], [30, 30])
+        self.assertEqual(len(vertices_lines), 1 + manifest['vertices'])
+        self.assertEqual(vertices_lines[0], '~label,~id,parent_id,name')
+        self.assertEqual(edges_header, '~label,~to,~from,name,~id')
+
+        # Merged files only: a bulk load of the directory loads every row once
+        self.assertEqual(file_names, ['edges.csv', 'manifest.json', 'vertices.csv'])
+        self.assertEqual([file['rows'] for file in manifest['files']], [manifest['vertices'], manifest['edges']])
+        self.assertRaises(ValueError, datagen_local.generate_local_dataset, 60, 2, output_dir, merge=True, output_options={'format': 'parquet'})
+
+    def test_parquet_output(self):
+        output_options = {'format': 'parquet', 'compression': 'zstd', 'partition_by_label': True}
+        with tempfile.TemporaryDirectory() as output_dir:
+            dataset_counts = lambda_function.stream_scooter_dataset(40, 2, None, None, False, chunk_size=15, output_dir=output_dir,
+                                                                    seed=3, output_options=output_options)
+            df_scooters = pd.read_parquet(os.path.join(output_dir, 'vertices', 'label=scooter', 'vertices.parquet'))
+            df_edges = pd.concat([pd.read_parquet(file['path']) for file in dataset_counts['files'] if '/edges/' in file['path']])
+
+        self.assertEqual(len(df_scooters.index), 40)
+        self.assertEqual(set(df_scooters['~label']), {'scooter'})
+        self.assertTrue(isinstance(df_scooters['~label'].dtype, pd.CategoricalDtype))
+        self.assertEqual(len(df_edges.index), dataset_counts['edges'])
+        self.assertEqual(sum(file['rows'] for file in dataset_counts['files']), dataset_counts['vertices'] + dataset_counts['edges'])
+
+    def test_gzip_part_files(self):
+        output_options = {'compression': 'gzip', 'max_rows_per_file': 1000}
+        with tempfile.TemporaryDirectory() as output_dir:
+            dataset_counts = lambda_function.stream_scooter_dataset(200, 2, None, None, False, chunk_size=70, shard_id=1,
+                                                                    output_dir=output_dir, seed=5, output_options=output_options)
+            file_names = sorted(os.listdir(output_dir))
+            df_edges = pd.concat([pd.read_csv(os.path.join(output_dir, file_name)) for file_name in file_names if file_name.startswith('edges')])
+            with gzip.open(os.path.join(output_dir, 'vertices-00001-00001.csv.gz'), 'rt') as vertices_file:
+                vertices_header = vertices_file.readline().strip()
+
+        self.assertIn('edges-00001-00001.csv.gz', file_names)
+        # Parts are numbered from 1 on
+        self.assertIn('vertices-00001-00002.csv.gz', file_names)
+        self.assertFalse(any(file_name.endswith('-00000.csv.gz') for file_name in file_names))
+        self.assertEqual(vertices_header, '~label,~id,parent_id,name')
+        self.assertEqual(len(df_edges.index), dataset_counts['edges'])
+        self.assertTrue(all(file['rows'] <= 1000 for file in dataset_counts['files']))
+        self.assertEqual(len([file for file in dataset_counts['files'] if file['path'].endswith('edges-00001-00001.csv.gz')]), 1)
+
+    def test_edge_ids_are_deterministic(self):
+        df_vertices = lambda_function.generate_scooter_batch(300, 4, rng=np.random.default_rng(11), id_allocator=lambda_function.ScooterIdAllocator(11))
+        df_edges = lambda_function.build_scooter_edges(df_vertices)
+        df_edges_again = lambda_function.build_scooter_edges(df_vertices)
+
+        self.assertTrue(df_edges['~id'].is_unique)
+        self.assertEqual(df_edges['~id'].iloc[0], '{}->{}'.format(df_edges['~from'].iloc[0], df_edges['~to'].iloc[0]))
+        self.assertEqual(list(df_edges['~id']), list(df_edges_again['~id']))
+
     def test_lambda_handler(self):
-        pass
-        # TODO: implement unit tests for lambda_handler
-        # self.assertEqual(1, 1)
-    
+        with tempfile.TemporaryDirectory() as output_dir, \
+                mock.patch.dict(os.environ, {'s3_bucket_name': 'bucket', 's3_prefix': 'data', 'datagen_num_of_vehicles': '120',
+                                             'datagen_num_of_parts_per_vehicle': '2', 'datagen_output_dir': output_dir}), \
+                mock.patch('lambda_function.get_s3_client', side_effect=AssertionError('S3 is not used')):
+            response = lambda_function.lambda_handler({'seed': 5, 'chunk_size': 50}, None)
+
+            self.assertEqual(response['statusCode'], 200)
+            self.assertIn(output_dir, json.loads(response['body']))
+            self.assertEqual(sorted(os.listdir(output_dir)), ['edges.csv', 'manifest.json', 'vertices.csv'])
+
+            df_vertices = pd.read_csv(os.path.join(output_dir, 'vertices.csv'))
+            df_edges = pd.read_csv(os.path.join(output_dir, 'edges.csv'))
+            with open(os.path.join(output_dir, 'manifest.json')) as manifest_file:
+                manifest = json.load(manifest_file)
+
+        self.assertEqual((df_vertices['~label'] == 'scooter').sum(), 120)
+        self.assertTrue(df_vertices['~id'].is_unique)
+        self.assertTrue(set(df_edges['~from']).issubset(set(df_vertices['~id'])))
+        self.assertTrue(set(df_edges['~to']).issubset(set(df_vertices['~id'])))
+        self.assertEqual(manifest['seed'], 5)
+
+    def test_lambda_handler_bumps_dataset_generation(self):
+        ssm_client = mock.Mock()
+
+        with tempfile.TemporaryDirectory() as output_dir, \
+                mock.patch.dict(os.environ, {'s3_bucket_name': 'bucket', 's3_prefix': 'data', 'datagen_num_of_vehicles': '20',
+                                             'datagen_num_of_parts_per_vehicle': '2', 'datagen_output_dir': output_dir,
+                                             'dataset_generation_parameter': 'dataset-generation'}), \
+                mock.patch('lambda_function.boto3.client', return_value=ssm_client):
+            lambda_function.lambda_handler({}, None)
+            lambda_function.lambda_handler({}, None)
+
+        # Unique generations, not read-modify-write
+        (first_call, second_call) = ssm_client.put_parameter.call_args_list
+        self.assertEqual(first_call.kwargs['Name'], 'dataset-generation')
+        self.assertNotEqual(first_call.kwargs['Value'], second_call.kwargs['Value'])
+        ssm_client.get_parameter.assert_not_called()
+
+    def test_shard_scooter_range(self):
+        shards = [lambda_function.shard_scooter_range(1001, 4, shard_id) for shard_id in range(4)]
+
+        self.assertEqual(shards, [(0, 251), (251, 250), (501, 250), (751, 250)])
+        self.assertRaises(ValueError, lambda_function.shard_scooter_range, 1001, 4, 4)
+
+    @mock.patch.dict(os.environ, {'s3_bucket_name': 'bucket', 's3_prefix': 'data', 'datagen_num_of_vehicles': '90', 'datagen_num_of_parts_per_vehicle': '2'})
     def test_lambda_handler_event(self):
-        pass
-        # TODO: implement unit tests for lambda_handler_event
-        # self.assertEqual(1, 1)
+        s3_client = FakeS3Client()
+
+        with mock.patch('lambda_function.get_s3_client', return_value=s3_client):
+            response = lambda_function.lambda_handler({'shard_count': 3, 'invoke_mode': 'local'}, None)
+
+        self.assertEqual(response['statusCode'], 202)
+        self.assertEqual(sorted(s3_client.objects), ['data/edges-00000.csv', 'data/edges-00001.csv', 'data/edges-00002.csv', 'data/manifest.json',
+                                                     'data/vertices-00000.csv', 'data/vertices-00001.csv', 'data/vertices-00002.csv'])
+
+        # Every shard generates its own share of scooters
+        scooters = sum(body.decode('utf-8').count('\nscooter,') for key, body in s3_client.objects.items() if 'vertices' in key)
+        self.assertEqual(scooters, 90)
+
+    @mock.patch.dict(os.environ, {'s3_bucket_name': 'bucket', 's3_prefix': 'data', 'datagen_num_of_vehicles': '2', 'datagen_num_of_parts_per_vehicle': '2'})
+    def test_lambda_handler_skips_empty_shards(self):
+        s3_client = FakeS3Client()
+
+        with mock.patch('lambda_function.get_s3_client', return_value=s3_client):
+            response = lambda_function.lambda_handler({'shard_count': 5, 'invoke_mode': 'local'}, None)
+
+        # 2 scooters: 2 shards, i.e. no empty (header-less) files
+        self.assertEqual(response['statusCode'], 202)
+        self.assertEqual(sorted(s3_client.objects), ['data/edges-00000.csv', 'data/edges-00001.csv', 'data/manifest.json',
+                                                     'data/vertices-00000.csv', 'data/vertices-00001.csv'])
+        self.assertTrue(all(body.startswith(b'~') for body in s3_client.objects.values() if not body.startswith(b'{')))
+
+    def test_benchmark_tier(self):
+        metrics = datagen_benchmark.benchmark_tier('1k', number_of_parts_per_scooter=2, chunk_size=300, output_options={'compression': 'gzip'})
+
+        self.assertEqual(metrics['scooters'], 1000)
+        self.assertGreater(metrics['vertices'], 1000 * 3)
+        self.assertGreater(metrics['output_mb'], 0)
+        self.assertEqual((metrics['chunk_size'], metrics['output_options']['compression']), (300, 'gzip'))
+        self.assertGreater(metrics['vertices_per_second'], 0)
+        self.assertGreater(metrics['tracemalloc_peak_mb'], 0)
+
+    def test_benchmark_regressions(self):
+        settings = {'parts_per_scooter': 10, 'chunk_size': 10000, 'output_options': {'format': 'csv'}}
+        baseline = {'10k': dict(settings, vertices_per_second=500000.0, peak_rss_mb=300.0, tracemalloc_peak_mb=100.0)}
+        results = {'10k': dict(settings, vertices_per_second=380000.0, peak_rss_mb=330.0, tracemalloc_peak_mb=130.0)}
+
+        regressions = datagen_benchmark.compare_to_baseline(results, baseline, max_regression=0.2)
+
+        self.assertEqual([regression.split(' ')[1] for regression in regressions], ['vertices_per_second', 'tracemalloc_peak_mb'])
+        self.assertEqual(datagen_benchmark.compare_to_baseline(results, baseline, max_regression=0.5), [])
+
+        # Other number of parts: not comparable
+        self.assertEqual(datagen_benchmark.compare_to_baseline(results, {'10k': dict(baseline['10k'], parts_per_scooter=5)}), [])
+        self.assertEqual(datagen_benchmark.compare_to_baseline(results, {'10k': dict(baseline['10k'], output_options={'format': 'parquet'})}), [])
+
+    def test_emf_metrics(self):
+        log_lines = []
+        metrics = datagen_metrics.MetricsLogger(enabled=True, emit=log_lines.append)
+
+        with mock.patch.object(lambda_function, 'metrics', metrics), tempfile.TemporaryDirectory() as output_dir:
+            lambda_function.stream_scooter_dataset(250, 2, None, None, False, chunk_size=100, output_dir=output_dir, seed=7)
+            metrics.flush(shard_id=None)
+
+        log_line = json.loads(log_lines[0])
+        metric_units = {metric['Name']: metric['Unit'] for metric in log_line['_aws']['CloudWatchMetrics'][0]['Metrics']}
+
+        self.assertEqual(log_line['_aws']['CloudWatchMetrics'][0]['Namespace'], datagen_metrics.METRICS_NAMESPACE)
+        self.assertEqual(metric_units['vertices_write_bytes'], 'Bytes')
+        self.assertEqual(metric_units['edge_derivation_ms'], 'Milliseconds')
+        # One value per chunk
+        self.assertEqual(len(log_line['vertex_generation_ms']), 3)
+        self.assertEqual(len(log_line['dataframe_build_ms']), 3)
+        self.assertEqual(sum(log_line['edges_write_rows']), sum(log_line['vertices_generated']) - 250)
+        self.assertIn('vertices_close_ms', log_line)
+
+    def test_emf_metrics_flush_at_100_values(self):
+        log_lines = []
+        metrics = datagen_metrics.MetricsLogger(enabled=True, emit=log_lines.append)
+        metrics.set_context(shard_id=3)
+
+        for i in range(150):
+            metrics.put_metric('vertices_write_rows', i)
+        metrics.flush()
+
+        self.assertEqual([len(json.loads(log_line)['vertices_write_rows']) for log_line in log_lines], [100, 50])
+        self.assertEqual([json.loads(log_line)['shard_id'] for log_line in log_lines], [3, 3])
+
+    @mock.patch.dict(os.environ, {'s3_bucket_name': 'bucket', 's3_prefix': 'data', 'datagen_num_of_vehicles': '50', 'datagen_num_of_parts_per_vehicle': '2'})
+    def test_lambda_handler_profile(self):
+        s3_client = FakeS3Client()
+
+        with mock.patch('lambda_function.get_s3_client', return_value=s3_client):
+            response = lambda_function.lambda_handler({'profile': True}, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        profile_keys = sorted(key for key in s3_client.objects if key.startswith('data/_profile/'))
+        self.assertEqual([key.rsplit('.', 1)[-1] for key in profile_keys], ['txt', 'pstats'])
+
+        report = s3_client.objects[profile_keys[0]].decode('utf-8')
+        self.assertIn('stream_scooter_dataset', report)
+        self.assertIn('allocations at the highest checkpoint', report)
+        self.assertIn('data/vertices.csv', s3_client.objects)
+
+    def test_lambda_handler_profile_local(self):
+        with tempfile.TemporaryDirectory() as output_dir, \
+                mock.patch.dict(os.environ, {'s3_bucket_name': 'bucket', 's3_prefix': 'data', 'datagen_num_of_vehicles': '20',
+                                             'datagen_num_of_parts_per_vehicle': '2', 'datagen_output_dir': output_dir}), \
+                mock.patch('lambda_function.get_s3_client', side_effect=AssertionError('S3 is not used')):
+            response = lambda_function.lambda_handler({'profile': True}, None)
+            profile_files = os.listdir(os.path.join(output_dir, datagen_profiler.PROFILE_FOLDER))
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(sorted(file_name.rsplit('.', 1)[-1] for file_name in profile_files), ['pstats', 'txt'])
+
+    def test_scooter_delta(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            manifest = datagen_local.generate_local_dataset(300, 3, output_dir, workers=2, seed=13)
+            datagen_local.generate_local_delta(output_dir, 30, chunk_size=100, asset_pools={'warehouse': 12}, event_rates={'fault': 0.1})
+            updated_manifest = datagen_local.generate_local_delta(output_dir, 0, chunk_size=100)
+
+            df_base = pd.concat([pd.read_csv(file['path']) for shard in manifest['shards'] for file in shard['files'] if 'vertices' in file['path']])
+            df_deltas = [pd.read_csv(os.path.join(output_dir, 'delta-0000{}'.format(generation), 'vertices.csv')) for generation in (1, 2)]
+            df_delta_edges = pd.read_csv(os.path.join(output_dir, 'delta-00001', 'edges.csv'))
+
+        ids = pd.concat([df_base['~id']] + [df_delta['~id'] for df_delta in df_deltas])
+        self.assertTrue(ids.is_unique)
+        self.assertEqual((df_deltas[0]['~label'] == 'scooter').sum(), 30)
+
+        # New events hang from existing parts, new scooters' faults from their own; new pool members are written once
+        df_faults = df_deltas[0][df_deltas[0]['~label'] == 'fault']
+        self.assertTrue(df_faults.parent_id.isin(set(ids)).all())
+        self.assertGreater(df_faults.parent_id.isin(set(df_base['~id'])).sum(), 0)
+        self.assertTrue(set(df_delta_edges['~from']).issubset(set(ids)))
+        self.assertEqual(sorted(df_deltas[0][df_deltas[0]['~label'] == 'warehouse']['~id']), ['warehouse-K', 'warehouse-L'])
+        self.assertFalse((df_deltas[1]['~label'] == 'warehouse').any())
+
+        self.assertEqual(updated_manifest['dataset_generation'], 2)
+        self.assertEqual(updated_manifest['num_of_vehicles'], 330)
+        # Counters advance by the new events only, i.e. not by the faults of new scooters
+        event_faults = sum((df_delta['~label'].eq('fault') & ~df_delta.parent_id.isin(set(df_delta['~id']))).sum() for df_delta in df_deltas)
+        self.assertEqual(updated_manifest['event_counters']['fault'], lambda_function.DELTA_EVENT_FIRST_NUMBER + event_faults)
+        # Counts of every run are kept per generation, the base run's included; none is left on top to pass for the current one
+        self.assertEqual([run['dataset_generation'] for run in updated_manifest['generations']], [0, 1, 2])
+        self.assertEqual(updated_manifest['generations'][0]['shards'], manifest['shards'])
+        self.assertEqual(updated_manifest['generations'][2]['new_scooters'], 0)
+        self.assertFalse(set(lambda_function.DATASET_RUN_KEYS) & set(updated_manifest))
+
+        # Pools cannot shrink
+        self.assertRaises(ValueError, lambda_function.stream_scooter_delta, updated_manifest, 0, None, None, False, asset_pools={'warehouse': 5})
+
+    @mock.patch.dict(os.environ, {'s3_bucket_name': 'bucket', 's3_prefix': 'data', 'datagen_num_of_vehicles': '100', 'datagen_num_of_parts_per_vehicle': '2'})
+    def test_lambda_handler_incremental(self):
+        s3_client = FakeS3Client()
+
+        with mock.patch('lambda_function.get_s3_client', return_value=s3_client):
+            lambda_function.lambda_handler({'seed': 21}, None)
+            response = lambda_function.lambda_handler({'incremental': True, 'num_of_new_vehicles': 10}, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertIn('data/delta-00001/vertices.csv', s3_client.objects)
+        self.assertIn('data/delta-00001/edges.csv', s3_client.objects)
+
+        manifest = json.loads(s3_client.objects['data/manifest.json'])
+        self.assertEqual((manifest['seed'], manifest['dataset_generation'], manifest['num_of_vehicles']), (21, 1, 110))
+        self.assertEqual([(run['dataset_generation'], run['new_scooters']) for run in manifest['generations']], [(1, 10)])
+        self.assertEqual(s3_client.objects['data/delta-00001/vertices.csv'].decode('utf-8').count('\nscooter,'), 10)
+
+    def test_profiler_checkpoint_without_profiler(self):
+        # No running profiler: nothing to snapshot
+        self.assertEqual(datagen_profiler._active_profilers, [])
+        datagen_profiler.profiler_checkpoint()
 
 
 if __name__ == '__main__':
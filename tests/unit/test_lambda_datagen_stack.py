@@ -0,0 +1,45 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from stack_lambda_datagen.lambda_datagen_stack import ScootersDataStack
+
+
+def datagen_stack_template():
+    # No bundling, i.e. no Docker needed to synthesize
+    app = core.App(context={'aws:cdk:bundling-stacks': []})
+    stack = ScootersDataStack(app, "ScootersDataStack", input_metadata={'s3_prefix_scooters_data_loc': 'data',
+                                                                        'lambda_datagen_num_vehicles': '100',
+                                                                        'lambda_datagen_num_parts': '10'})
+    return assertions.Template.from_stack(stack)
+
+
+def test_datagen_function_can_invoke_itself():
+    template = datagen_stack_template()
+
+    template.has_resource_properties("AWS::Lambda::Function", {"FunctionName": "ScootersDataStack-datagen"})
+    # The coordinator invokes its own (maybe qualified, i.e. :<version or alias>) ARN
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {
+            "Statement": assertions.Match.array_with([assertions.Match.object_like({
+                "Action": "lambda:InvokeFunction",
+                "Effect": "Allow",
+                "Resource": [
+                    {"Fn::Join": ["", assertions.Match.array_with([assertions.Match.string_like_regexp(":function:ScootersDataStack-datagen$")])]},
+                    {"Fn::Join": ["", assertions.Match.array_with([assertions.Match.string_like_regexp(":function:ScootersDataStack-datagen:\\*$")])]}
+                    ]
+                })])
+            }
+        })
+
+
+def test_datagen_function_can_bump_dataset_generation():
+    template = datagen_stack_template()
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({"dataset_generation_parameter": {"Fn::ImportValue": "dataset-generation-parameter"}})}
+        })
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {
+            "Statement": assertions.Match.array_with([assertions.Match.object_like({"Action": "ssm:PutParameter", "Effect": "Allow"})])
+            }
+        })
@@ -0,0 +1,642 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest import mock
+
+from gremlin_python.driver.protocol import GremlinServerError
+from gremlin_python.process.traversal import T
+from gremlin_python.structure.graph import Graph, Vertex, Edge, Path
+
+QUERY_LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'stack_vpc_neptune')
+
+# Both Lambda functions are named lambda_function.py: load this one under its own module name, and do not leave its
+# directory on sys.path, for the data generator tests to import theirs
+sys.path.insert(0, QUERY_LAMBDA_DIR)
+import neptune_connections
+import graph_serializers
+import graph_qa
+import question_cache
+import result_cache
+import query_metrics
+spec = importlib.util.spec_from_file_location('query_lambda_function', os.path.join(QUERY_LAMBDA_DIR, 'lambda_function.py'))
+query_lambda_function = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(query_lambda_function)
+# The load-test harness imports the query Lambda function as lambda_function
+datagen_lambda_function = sys.modules.get('lambda_function')
+sys.modules['lambda_function'] = query_lambda_function
+import query_load_harness
+if datagen_lambda_function is not None:
+    sys.modules['lambda_function'] = datagen_lambda_function
+else:
+    del sys.modules['lambda_function']
+sys.path.remove(QUERY_LAMBDA_DIR)
+
+
+class FakeResultSet:
+    def __init__(self, results):
+        self.results = results
+
+    def all(self):
+        return self
+
+    def result(self, timeout=None):
+        if isinstance(self.results, Exception):
+            raise self.results
+        return self.results
+
+
+class FakeClient:
+    """
+    Stand-in for gremlin_python's Client; answers queries from a list of responses (or exceptions)
+    """
+    instances = []
+    responses = []
+
+    def __init__(self, url, traversal_source, **kwargs):
+        self.url = url
+        self.kwargs = kwargs
+        self.closed = False
+        FakeClient.instances.append(self)
+
+    def submit(self, gremlin_query, bindings=None):
+        if gremlin_query == neptune_connections.HEALTH_CHECK_QUERY:
+            return FakeResultSet([0])
+        return FakeResultSet(FakeClient.responses.pop(0))
+
+    def submit_async(self, gremlin_query, bindings=None):
+        # Queries are 'g.V().sleep(<seconds>)', or fail
+        result_set = mock.Mock()
+        result_set.all.return_value = self.executor.submit(self._run, gremlin_query)
+        write_future = Future()
+        write_future.set_result(result_set)
+        return write_future
+
+    def close(self):
+        self.closed = True
+
+    @property
+    def executor(self):
+        if not hasattr(self, '_executor'):
+            self._executor = ThreadPoolExecutor(max_workers=self.kwargs['pool_size'])
+        return self._executor
+
+    @staticmethod
+    def _run(gremlin_query):
+        if 'sleep' not in gremlin_query:
+            raise GremlinServerError({'code': 597, 'message': 'bad query', 'attributes': {}})
+        time.sleep(float(gremlin_query.split('(')[-1].rstrip(')')))
+        return [gremlin_query]
+
+
+class TestNeptuneConnectionPool(unittest.TestCase):
+    def setUp(self):
+        FakeClient.instances = []
+        FakeClient.responses = []
+        patcher = mock.patch('neptune_connections.client.Client', FakeClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connections_are_reused(self):
+        pool = neptune_connections.NeptuneConnectionPool(pool_size=2, query_concurrency=1)
+        FakeClient.responses = [[1], [2]]
+
+        self.assertEqual(pool.submit('db-endpoint', 'g.V().count()'), [1])
+        self.assertEqual(pool.submit('db-endpoint', 'g.E().count()'), [2])
+        self.assertEqual(len(FakeClient.instances), 1)
+        self.assertEqual(FakeClient.instances[0].url, 'wss://db-endpoint:8182/gremlin')
+        self.assertEqual(FakeClient.instances[0].kwargs['pool_size'], 2)
+
+    def test_reconnects_after_connection_failure(self):
+        pool = neptune_connections.NeptuneConnectionPool()
+        FakeClient.responses = [ConnectionResetError('socket closed'), [3]]
+
+        self.assertEqual(pool.submit('db-endpoint', 'g.V().count()'), [3])
+        self.assertEqual(len(FakeClient.instances), 2)
+        self.assertTrue(FakeClient.instances[0].closed)
+
+    def test_sent_writes_are_not_retried(self):
+        pool = neptune_connections.NeptuneConnectionPool()
+        FakeClient.responses = [ConnectionResetError('socket closed'), [3]]
+
+        # Sent, then the connection dropped: the write may have run
+        with self.assertRaises(ConnectionResetError):
+            pool.submit('db-endpoint', "g.addV('scooter')")
+        self.assertEqual(FakeClient.responses, [[3]])
+        self.assertTrue(FakeClient.instances[0].closed)
+
+        # Not sent: safe to retry
+        with mock.patch.object(FakeClient, 'submit', side_effect=[ConnectionResetError('socket closed'), FakeResultSet(['v'])]):
+            self.assertEqual(pool.submit('db-endpoint', "g.addV('scooter')"), ['v'])
+
+    def test_query_errors_are_not_retried(self):
+        pool = neptune_connections.NeptuneConnectionPool()
+        FakeClient.responses = [GremlinServerError({'code': 597, 'message': 'bad query', 'attributes': {}})]
+
+        with self.assertRaises(GremlinServerError):
+            pool.submit('db-endpoint', 'g.V(')
+        self.assertEqual(len(FakeClient.instances), 1)
+
+    def test_submit_many_runs_queries_concurrently(self):
+        pool = neptune_connections.NeptuneConnectionPool(query_concurrency=3)
+        gremlin_queries = ['g.V().sleep(0.3)', 'g.V().sleep(0.3)', 'g.V(', 'g.V().sleep(0.3)']
+
+        started_at = time.perf_counter()
+        responses = pool.submit_many('db-endpoint', gremlin_queries)
+        duration = time.perf_counter() - started_at
+
+        self.assertLess(duration, 0.6)
+        self.assertEqual([response['query'] for response in responses], gremlin_queries)
+        self.assertEqual(responses[0]['results'], ['g.V().sleep(0.3)'])
+        self.assertIn('bad query', responses[2]['error'])
+        self.assertGreaterEqual(responses[1]['duration_ms'], 300)
+        self.assertEqual(len(FakeClient.instances), 1)
+
+    def test_health_check(self):
+        pool = neptune_connections.NeptuneConnectionPool(health_check_seconds=0)
+        FakeClient.responses = [[1]]
+
+        self.assertTrue(pool.health_check('db-endpoint'))
+        self.assertEqual(pool.submit('db-endpoint', 'g.V().count()'), [1])
+
+        pool.close()
+        self.assertTrue(FakeClient.instances[0].closed)
+
+    def test_idle_check_uses_the_connection_in_use(self):
+        pool = neptune_connections.NeptuneConnectionPool(health_check_seconds=0)
+        remote_connection = mock.Mock()
+
+        with mock.patch('neptune_connections.DriverRemoteConnection', return_value=remote_connection):
+            pool.run_traversal('db-endpoint', lambda g: [1])
+            time.sleep(0.01)
+            self.assertEqual(pool.run_traversal('db-endpoint', lambda g: [2]), [2])
+
+        # The traversal connection was checked; no client was opened just for the check
+        remote_connection.submit_async.assert_called_once()
+        self.assertEqual(FakeClient.instances, [])
+
+
+class TestNeptuneEndpointRouter(unittest.TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.pool.submit.side_effect = lambda endpoint, gremlin_query, bindings=None: [endpoint]
+
+    def test_reads_are_balanced_round_robin(self):
+        router = neptune_connections.NeptuneEndpointRouter(self.pool, reader_endpoints=['reader-1', 'reader-2'])
+
+        endpoints = [router.submit('writer', 'g.V().count()', read_only=True)[0] for _ in range(4)]
+
+        self.assertEqual(endpoints, ['reader-1', 'reader-2', 'reader-1', 'reader-2'])
+        self.assertEqual(router.submit('writer', "g.addV('scooter')")[0], 'writer')
+
+    def test_least_outstanding_reader(self):
+        router = neptune_connections.NeptuneEndpointRouter(self.pool, reader_endpoints=['reader-1', 'reader-2'],
+                                                           balancing='least_outstanding')
+        router._outstanding['reader-1'] = 2
+
+        self.assertEqual(router.submit('writer', 'g.V().count()', read_only=True), ['reader-2'])
+
+    def test_unhealthy_reader_fails_over_to_writer(self):
+        router = neptune_connections.NeptuneEndpointRouter(self.pool, reader_endpoints=['reader-1'], unhealthy_seconds=60)
+        self.pool.submit.side_effect = lambda endpoint, gremlin_query, bindings=None: \
+            [endpoint] if endpoint == 'writer' else (_ for _ in ()).throw(ConnectionRefusedError('reader down'))
+
+        self.assertEqual(router.submit('writer', 'g.V().count()', read_only=True), ['writer'])
+        self.assertIsNone(router.reader_endpoint())
+        self.assertEqual(router._outstanding['reader-1'], 0)
+
+        # Query errors are the query's, not the reader's
+        self.pool.submit.side_effect = GremlinServerError({'code': 597, 'message': 'bad query', 'attributes': {}})
+        router._unhealthy_until.clear()
+        with self.assertRaises(GremlinServerError):
+            router.submit('writer', 'g.V(', read_only=True)
+        self.assertEqual(router.reader_endpoint(), 'reader-1')
+
+    def test_multi_query_read_fails_over_from_dead_reader(self):
+        class DeadReaderClient(FakeClient):
+            def submit_async(self, gremlin_query, bindings=None):
+                if 'reader-1' in self.url:
+                    raise ConnectionRefusedError('reader down')
+                return super().submit_async(gremlin_query, bindings)
+
+        gremlin_queries = ['g.V().sleep(0)', 'g.V().sleep(0.01)']
+        with mock.patch('neptune_connections.client.Client', DeadReaderClient):
+            pool = neptune_connections.NeptuneConnectionPool(query_concurrency=2)
+            router = neptune_connections.NeptuneEndpointRouter(pool, reader_endpoints=['reader-1'], unhealthy_seconds=60)
+            responses = router.submit_many('writer', gremlin_queries, read_only=True)
+
+        self.assertEqual([response['error'] for response in responses], [None, None])
+        self.assertEqual([response['results'] for response in responses], [[gremlin_query] for gremlin_query in gremlin_queries])
+        self.assertIsNone(router.reader_endpoint())
+        self.assertNotIn('reader-1', pool._endpoints)
+
+    def test_no_reader_endpoints(self):
+        with mock.patch.dict(os.environ, {'neptune_reader_endpoints': ''}):
+            router = neptune_connections.NeptuneEndpointRouter(self.pool)
+
+        self.assertEqual(router.submit('writer', 'g.V().count()', read_only=True), ['writer'])
+
+
+class TestGraphSerializers(unittest.TestCase):
+    def test_value_map_keys(self):
+        value_map = {T.id: 'scooter-7QK2ZD', T.label: 'scooter', 'name': ['scooter-7QK2ZD']}
+
+        self.assertEqual(graph_serializers.to_json_value(value_map), {'id': 'scooter-7QK2ZD', 'label': 'scooter', 'name': ['scooter-7QK2ZD']})
+
+    def test_graph_elements(self):
+        scooter, part = Vertex('scooter-1', 'scooter'), Vertex('part-1', 'part_brakes')
+        path = Path([{'a'}, set()], [scooter, Edge('scooter-1->part-1', scooter, 'has', part), part])
+
+        path_json = graph_serializers.to_json_value(path)
+        self.assertEqual(path_json['labels'], [['a'], []])
+        self.assertEqual(path_json['objects'][1], {'id': 'scooter-1->part-1', 'label': 'has', 'type': 'edge', 'outV': 'scooter-1', 'inV': 'part-1'})
+        self.assertEqual(path_json['objects'][2], {'id': 'part-1', 'label': 'part_brakes', 'type': 'vertex'})
+
+    def test_encode_results_is_truncated_to_max_bytes(self):
+        results = [{T.id: 'part-{}'.format(i), T.label: 'part'} for i in range(100)]
+
+        body = json.loads(graph_serializers.encode_results(results))
+        truncated_body = json.loads(graph_serializers.encode_results(results, max_bytes=500))
+
+        self.assertEqual((body['count'], body['truncated']), (100, False))
+        self.assertEqual(body['results'][0], {'id': 'part-0', 'label': 'part'})
+        self.assertTrue(truncated_body['truncated'])
+        self.assertEqual(truncated_body['count'], len(truncated_body['results']))
+        self.assertLess(truncated_body['count'], 100)
+
+
+class TestGraphQAChains(unittest.TestCase):
+    def setUp(self):
+        patchers = [mock.patch('langchain_community.graphs.NeptuneGraph'), mock.patch('langchain.llms.bedrock.Bedrock'),
+                    mock.patch('langchain.chains.NeptuneOpenCypherQAChain')]
+        self.neptune_graph, self.bedrock, self.qa_chain = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_chain_is_built_once(self):
+        graph_qa_chains = graph_qa.GraphQAChains(schema_ttl_seconds=3600)
+
+        chain = graph_qa_chains.chain('db-endpoint', 'us-west-2')
+        self.assertIs(graph_qa_chains.chain('db-endpoint', 'us-west-2'), chain)
+        self.assertEqual(self.neptune_graph.call_count, 1)
+        self.assertEqual(self.bedrock.call_count, 1)
+        self.neptune_graph.return_value._refresh_schema.assert_not_called()
+
+    def test_schema_refresh(self):
+        graph_qa_chains = graph_qa.GraphQAChains(schema_ttl_seconds=0)
+        graph_qa_chains.chain('db-endpoint', 'us-west-2')
+
+        with mock.patch('graph_qa.time.time', return_value=graph_qa.time.time() + 1):
+            graph_qa_chains.chain('db-endpoint', 'us-west-2')
+        self.assertEqual(self.neptune_graph.return_value._refresh_schema.call_count, 1)
+
+        self.assertEqual(graph_qa_chains.refresh_schema('db-endpoint'), 1)
+        self.assertEqual(graph_qa_chains.refresh_schema('other-endpoint'), 0)
+        self.assertEqual(self.neptune_graph.return_value._refresh_schema.call_count, 2)
+        self.assertEqual(self.neptune_graph.call_count, 1)
+
+    def test_cached_question_skips_query_generation(self):
+        graph_qa_chains = graph_qa.GraphQAChains(question_cache=question_cache.QuestionCache())
+        chain = self.qa_chain.from_llm.return_value
+        chain.input_key, chain.output_key, chain.qa_chain.output_key = 'query', 'result', 'text'
+        chain.invoke.return_value = {'result': '42 scooters', 'intermediate_steps': [{'query': 'MATCH (s:scooter) RETURN count(s)'}, {'context': []}]}
+        chain.graph.query.return_value = [{'count(s)': 42}]
+
+        self.assertEqual(graph_qa_chains.ask('db-endpoint', 'us-west-2', 'How many scooters?', 'prompt'), '42 scooters')
+        # A hit makes no LLM call at all: the cached query's results are the answer
+        self.assertEqual(graph_qa_chains.ask('db-endpoint', 'us-west-2', 'how many scooters', 'prompt'), '[{"count(s)": 42}]')
+        self.assertEqual(chain.invoke.call_count, 1)
+        chain.qa_chain.invoke.assert_not_called()
+        chain.graph.query.assert_called_once_with('MATCH (s:scooter) RETURN count(s)')
+
+    def test_failed_cached_query_is_regenerated(self):
+        graph_qa_chains = graph_qa.GraphQAChains(question_cache=question_cache.QuestionCache())
+        chain = self.qa_chain.from_llm.return_value
+        chain.input_key, chain.output_key = 'query', 'result'
+        chain.invoke.return_value = {'result': '42 scooters', 'intermediate_steps': [{'query': 'MATCH (s:scooter) RETURN count(s)'}, {'context': []}]}
+        graph_qa_chains.ask('db-endpoint', 'us-west-2', 'How many scooters?', 'prompt')
+
+        # The cached query fails (e.g. the schema changed): generated again, once
+        chain.graph.query.side_effect = Exception('Unknown label')
+        self.assertEqual(graph_qa_chains.ask('db-endpoint', 'us-west-2', 'How many scooters?', 'prompt'), '42 scooters')
+        self.assertEqual(chain.invoke.call_count, 2)
+
+        # The regenerated query is cached again; hits need no LLM, e.g. while Bedrock throttles
+        chain.graph.query.side_effect = None
+        chain.graph.query.return_value = [{'count(s)': 42}]
+        chain.invoke.side_effect = Exception('ThrottlingException')
+        self.assertEqual(graph_qa_chains.ask('db-endpoint', 'us-west-2', 'How many scooters?', 'prompt'), '[{"count(s)": 42}]')
+
+    def test_cached_questions_are_scoped_by_endpoint_and_schema(self):
+        graph_qa_chains = graph_qa.GraphQAChains(question_cache=question_cache.QuestionCache())
+        chain = self.qa_chain.from_llm.return_value
+        chain.input_key, chain.output_key = 'query', 'result'
+        chain.invoke.return_value = {'result': '42 scooters', 'intermediate_steps': [{'query': 'MATCH (s:scooter) RETURN count(s)'}, {'context': []}]}
+        chain.graph.get_schema = 'Node properties: scooter'
+
+        graph_qa_chains.ask('db-endpoint', 'us-west-2', 'How many scooters?', 'prompt')
+        graph_qa_chains.ask('other-endpoint', 'us-west-2', 'How many scooters?', 'prompt')
+        self.assertEqual(chain.invoke.call_count, 2)
+
+        # New schema, e.g. after a bulk load: the query is generated again
+        chain.graph.get_schema = 'Node properties: scooter, part'
+        graph_qa_chains.ask('db-endpoint', 'us-west-2', 'How many scooters?', 'prompt')
+        self.assertEqual(chain.invoke.call_count, 3)
+        chain.graph.query.assert_not_called()
+
+
+class TestQuestionCache(unittest.TestCase):
+    def test_normalized_questions_hit(self):
+        cache = question_cache.QuestionCache(max_entries=2)
+        cache.put('How many scooters do I have?', 'MATCH (s:scooter) RETURN count(s)')
+
+        self.assertEqual(cache.get('  how many   scooters do i have '), 'MATCH (s:scooter) RETURN count(s)')
+        self.assertIsNone(cache.get('which parts have faults?'))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (1, 1))
+
+        cache.put('How many scooters do I have?', 'MATCH (s:scooter) RETURN count(s) AS n', scope='db-endpoint@1')
+        self.assertEqual(cache.get('how many scooters do i have', scope='db-endpoint@1'), 'MATCH (s:scooter) RETURN count(s) AS n')
+        self.assertIsNone(cache.get('how many scooters do i have', scope='db-endpoint@2'))
+
+    def test_semantic_hit(self):
+        embeddings = {'how many scooters do i have': [1.0, 0.0], 'how many scooters are there': [0.99, 0.05], 'list drivers': [0.0, 1.0]}
+        cache = question_cache.QuestionCache(embed=embeddings.get, similarity_threshold=0.95)
+        cache.put('How many scooters do I have?', 'MATCH (s:scooter) RETURN count(s)')
+
+        self.assertEqual(cache.get('How many scooters are there?'), 'MATCH (s:scooter) RETURN count(s)')
+        self.assertIsNone(cache.get('List drivers'))
+        self.assertEqual(cache.stats['semantic_hits'], 1)
+
+    def test_eviction_and_write_queries(self):
+        cache = question_cache.QuestionCache(max_entries=2)
+        for i in range(3):
+            cache.put('question {}'.format(i), 'MATCH (n) RETURN n LIMIT {}'.format(i))
+
+        self.assertFalse(cache.put('delete all', 'MATCH (n) DETACH DELETE n'))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('question 0'))
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            file_path = os.path.join(cache_dir, 'question_cache.json')
+            question_cache.QuestionCache(file_path=file_path).put('How many scooters?', 'MATCH (s:scooter) RETURN count(s)')
+
+            self.assertEqual(question_cache.QuestionCache(file_path=file_path).get('how many scooters'), 'MATCH (s:scooter) RETURN count(s)')
+
+
+class TestResultCache(unittest.TestCase):
+    def test_normalize_query(self):
+        self.assertEqual(result_cache.normalize_query(" g.V('scooter  1')\n    .count() "), "g.V('scooter  1') .count()")
+
+    def test_write_queries_are_not_read_only(self):
+        self.assertTrue(result_cache.is_read_only_query("g.V().has('name', 'drop()').count()"))
+        self.assertFalse(result_cache.is_read_only_query("g.V('scooter-1').drop()"))
+        self.assertFalse(result_cache.is_read_only_query("g.addV('scooter').property(T.id, 'scooter-1')"))
+
+    def test_generation_invalidates_results(self):
+        cache = result_cache.ResultCache(backend=result_cache.LRUBackend(2), generation=result_cache.DatasetGeneration(parameter_name=''), enabled=True)
+        run = mock.Mock(side_effect=['body-1', 'body-2', 'body-3'])
+
+        self.assertEqual(cache.get_or_run(['/runQuery', 'g.V().count()'], run), 'body-1')
+        self.assertEqual(cache.get_or_run(['/runQuery', 'g.V().count()'], run), 'body-1')
+        cache.generation.bump()
+        self.assertEqual(cache.get_or_run(['/runQuery', 'g.V().count()'], run), 'body-2')
+        self.assertEqual(cache.get_or_run(['/runQuery', "g.V('x').drop()"], run, cacheable=False), 'body-3')
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 2, 'bypasses': 1})
+
+    def test_bodies_with_failed_queries_are_not_cached(self):
+        cache = result_cache.ResultCache(backend=result_cache.LRUBackend(2), generation=result_cache.DatasetGeneration(parameter_name=''), enabled=True)
+        failed_body = json.dumps({'results': [{'query': 'g.V().count()', 'results': [3], 'error': None},
+                                              {'query': 'g.E().count()', 'results': None, 'error': 'timeout'}]})
+        run = mock.Mock(side_effect=[failed_body, failed_body])
+        cache_if = lambda body: not result_cache.has_query_errors(body)
+
+        cache.get_or_run(['/runQuery', ['g.V().count()', 'g.E().count()']], run, cache_if=cache_if)
+        cache.get_or_run(['/runQuery', ['g.V().count()', 'g.E().count()']], run, cache_if=cache_if)
+
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(len(cache.backend), 0)
+        self.assertFalse(result_cache.has_query_errors(json.dumps({'results': [{'error': None}]})))
+
+    def test_generation_is_shared_via_ssm(self):
+        ssm_client = mock.Mock()
+        ssm_client.get_parameter.return_value = {'Parameter': {'Value': '7'}}
+        generation = result_cache.DatasetGeneration(parameter_name='/scooters/generation', check_seconds=60, ssm_client=ssm_client)
+
+        self.assertEqual(generation.current(), '7')
+        self.assertEqual(generation.current(), '7')
+        self.assertEqual(ssm_client.get_parameter.call_count, 1)
+
+        # Unique, not read-modify-write: concurrent bumps never end up with the same generation
+        bumped = generation.bump()
+        self.assertNotIn(bumped, ('7', '8', generation.bump()))
+        self.assertEqual(generation.current(), ssm_client.put_parameter.call_args.kwargs['Value'])
+        ssm_client.put_parameter.assert_any_call(Name='/scooters/generation', Value=bumped, Type='String', Overwrite=True)
+        self.assertEqual(ssm_client.get_parameter.call_count, 1)
+
+
+class TestLambdaFunction(unittest.TestCase):
+    def test_cold_start_imports(self):
+        # python -X importtime: one line per imported module, with its self and cumulative import time, in us
+        import_times = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import lambda_function'], cwd=QUERY_LAMBDA_DIR,
+                                      capture_output=True, text=True, check=True).stderr
+        cumulative_times = {line.split('|')[2].strip(): int(line.split('|')[1]) for line in import_times.splitlines()[1:]
+                            if line.startswith('import time:')}
+
+        # LangChain (only used by /askGraph) and boto3 are imported on first use
+        print('lambda_function import: {:.0f} ms'.format(cumulative_times['lambda_function'] / 1000))
+        self.assertEqual([module for module in cumulative_times if module.split('.')[0] in ('langchain', 'langchain_community', 'boto3')], [])
+
+    def test_lambda_handler_unknown_path(self):
+        response = query_lambda_function.lambda_handler({'path': '/unknown', 'queryStringParameters': {'neptune_endpoint': 'db-endpoint'}}, None)
+
+        self.assertEqual(response['statusCode'], 400)
+        self.assertEqual(response['headers']['Access-Control-Allow-Origin'], '*')
+
+    def test_scooter_subtree_is_bounded(self):
+        traversal = query_lambda_function.scooter_subtree(Graph().traversal(), 'scooter-1', 4, 200, 101, ['name'])
+        steps = [instruction[0] for instruction in traversal.bytecode.step_instructions]
+
+        # Ordered by id before paging: Gremlin does not guarantee the traversal order
+        self.assertEqual(steps, ['V', 'repeat', 'until', 'dedup', 'order', 'by', 'range', 'valueMap'])
+        self.assertEqual(traversal.bytecode.step_instructions[5], ['by', T.id])
+        self.assertEqual(traversal.bytecode.step_instructions[6], ['range', 200, 301])
+        self.assertEqual(traversal.bytecode.step_instructions[7], ['valueMap', True, 'name'])
+
+    def test_get_scooter_pages(self):
+        event = {'path': '/getScooter', 'queryStringParameters': {'neptune_endpoint': 'db-endpoint', 'scooter_asset_code': 'scooter-1',
+                                                                  'page_size': '2', 'cursor': '4', 'properties': 'name'}}
+        vertices = [{T.id: 'part-{}'.format(i), T.label: 'part'} for i in range(3)]
+
+        with mock.patch.object(query_lambda_function.neptune_pool, 'run_traversal', return_value=vertices) as run_traversal:
+            response = query_lambda_function.lambda_handler(event, None)
+            last_response = query_lambda_function.lambda_handler(dict(event, queryStringParameters=dict(event['queryStringParameters'], page_size='3')), None)
+
+        body = json.loads(response['body'])
+        self.assertEqual(response['statusCode'], 201)
+        self.assertEqual((body['count'], body['next_cursor']), (2, '6'))
+        self.assertEqual(json.loads(last_response['body'])['next_cursor'], None)
+        self.assertEqual(run_traversal.call_count, 2)
+
+    def test_get_scooters_batch(self):
+        event = {'path': '/getScooters', 'queryStringParameters': {'neptune_endpoint': 'db-endpoint', 'page_size': '1',
+                                                                   'scooter_asset_codes': 'scooter-1, scooter-2,scooter-1,unknown-1'}}
+        subtrees = [{'code': 'scooter-1', 'vertices': [{T.id: 'part-1', T.label: 'part'}, {T.id: 'part-2', T.label: 'part'}]},
+                    {'code': 'scooter-2', 'vertices': [{T.id: 'part-3', T.label: 'part'}]}]
+
+        with mock.patch.object(query_lambda_function.neptune_pool, 'run_traversal', return_value=subtrees) as run_traversal:
+            response = query_lambda_function.lambda_handler(event, None)
+
+        body = json.loads(response['body'])
+        self.assertEqual(response['statusCode'], 201)
+        self.assertEqual(run_traversal.call_count, 1)
+        self.assertEqual(list(body['results']), ['scooter-1', 'scooter-2', 'unknown-1'])
+        self.assertEqual(body['results']['scooter-1'], {'vertices': [{'id': 'part-1', 'label': 'part'}], 'truncated': True})
+        self.assertEqual(body['results']['scooter-2']['truncated'], False)
+        self.assertIsNone(body['results']['unknown-1'])
+
+    def test_scooter_subtrees_is_one_traversal(self):
+        traversal = query_lambda_function.scooter_subtrees(Graph().traversal(), ['scooter-1', 'scooter-2'], 4, 11, [])
+
+        self.assertEqual(traversal.bytecode.step_instructions[0], ['V', 'scooter-1', 'scooter-2'])
+        self.assertEqual([instruction[0] for instruction in traversal.bytecode.step_instructions], ['V', 'project', 'by', 'by'])
+        subtree_steps = [instruction[0] for instruction in traversal.bytecode.step_instructions[3][1].step_instructions]
+        self.assertEqual(subtree_steps[-5:], ['order', 'by', 'limit', 'valueMap', 'fold'])
+
+    def test_get_scooter_invalid_parameters(self):
+        for parameters in ({'max_depth': '100'}, {'page_size': 'ten'}, {'properties': 'name,bad property'}):
+            query_string_parameters = dict({'neptune_endpoint': 'db-endpoint', 'scooter_asset_code': 'scooter-1'}, **parameters)
+            response = query_lambda_function.lambda_handler({'path': '/getScooter', 'queryStringParameters': query_string_parameters}, None)
+
+            self.assertEqual(response['statusCode'], 400)
+
+    def test_run_many_gremlin_queries(self):
+        gremlin_queries = ["g.V().hasLabel('scooter').count()", "g.V().hasLabel('fault').count()"]
+        event = {'path': '/runQuery', 'queryStringParameters': {'neptune_endpoint': 'db-endpoint', 'gremlin_query': gremlin_queries[-1]},
+                 'multiValueQueryStringParameters': {'neptune_endpoint': ['db-endpoint'], 'gremlin_query': gremlin_queries}}
+        query_responses = [{'query': query, 'results': [i], 'error': None, 'duration_ms': 1.0} for i, query in enumerate(gremlin_queries)]
+
+        with mock.patch.object(query_lambda_function.neptune_router, 'reader_endpoint', return_value='reader-endpoint'), \
+                mock.patch.object(query_lambda_function.neptune_pool, 'submit_many', return_value=query_responses) as submit_many:
+            response = query_lambda_function.lambda_handler(event, None)
+
+        # Read-only queries go to a reader
+        submit_many.assert_called_once_with('reader-endpoint', gremlin_queries, raise_connection_errors=True)
+        self.assertEqual(response['statusCode'], 202)
+        self.assertEqual([result['results'] for result in json.loads(response['body'])['results']], [[0], [1]])
+
+    def test_run_gremlin_query(self):
+        with mock.patch.object(query_lambda_function.neptune_pool, 'submit', return_value=[{T.id: 'scooter-1', T.label: 'scooter'}]):
+            response = query_lambda_function.lambda_handler({'path': '/runQuery', 'queryStringParameters': {'neptune_endpoint': 'db-endpoint', 'gremlin_query': 'g.V().limit(1).valueMap(true)'}}, None)
+
+        self.assertEqual(response['statusCode'], 202)
+        self.assertEqual(json.loads(response['body'])['results'], [{'id': 'scooter-1', 'label': 'scooter'}])
+
+    def test_emf_metrics(self):
+        log_lines = []
+        gremlin_client = mock.Mock()
+        gremlin_client.submit.return_value = FakeResultSet([7])
+        metrics = query_lambda_function.metrics
+        event = {'path': '/runQuery', 'queryStringParameters': {'neptune_endpoint': 'db-endpoint', 'gremlin_query': "g.V().hasLabel('claim').count()"}}
+
+        with mock.patch.object(metrics, 'enabled', True), mock.patch.object(metrics, 'emit', log_lines.append), \
+                mock.patch.object(query_lambda_function.neptune_pool, '_connection', return_value=gremlin_client), \
+                mock.patch.object(query_lambda_function.result_cache, 'enabled', False):
+            query_lambda_function.lambda_handler(event, None)
+
+        log_line = json.loads(log_lines[0])
+        directive = log_line['_aws']['CloudWatchMetrics'][0]
+
+        self.assertEqual(directive['Dimensions'], [['FunctionName', 'path']])
+        self.assertEqual(log_line['path'], '/runQuery')
+        self.assertEqual(log_line['status_code'], 202)
+        self.assertEqual({metric['Name'] for metric in directive['Metrics']},
+                         {'connection_acquisition_ms', 'query_execution_ms', 'serialization_ms', 'request_ms'})
+
+    def test_emf_metrics_flush_at_100_values_keeps_dimensions(self):
+        log_lines = []
+        metrics = query_metrics.MetricsLogger(enabled=True, emit=log_lines.append)
+        metrics.set_context(dimensions={'path': '/runQuery'})
+
+        for i in range(150):
+            metrics.put_metric('query_execution_ms', i, 'Milliseconds')
+        metrics.flush(status_code=202)
+
+        # Next request, without a context
+        metrics.put_metric('request_ms', 1, 'Milliseconds')
+        metrics.flush()
+
+        auto_flushed, flushed, next_request = [json.loads(log_line) for log_line in log_lines]
+        self.assertEqual(auto_flushed['_aws']['CloudWatchMetrics'][0]['Dimensions'], [['FunctionName', 'path']])
+        self.assertEqual((auto_flushed['path'], len(auto_flushed['query_execution_ms'])), ('/runQuery', 100))
+        self.assertEqual(flushed['_aws']['CloudWatchMetrics'][0]['Dimensions'], [['FunctionName', 'path']])
+        self.assertEqual((flushed['path'], flushed['status_code']), ('/runQuery', 202))
+        self.assertEqual(next_request['_aws']['CloudWatchMetrics'][0]['Dimensions'], [['FunctionName']])
+
+    def test_metrics_are_off_outside_lambda(self):
+        # No AWS_LAMBDA_FUNCTION_NAME, nor metrics_enabled
+        with mock.patch.dict(os.environ, clear=True):
+            metrics = query_metrics.MetricsLogger(emit=self.fail)
+
+        with metrics.timer('query_execution_ms'):
+            metrics.put_metric('connection_retries', 1)
+        metrics.flush()
+
+
+class TestQueryLoadHarness(unittest.TestCase):
+    def test_seed_queries(self):
+        rows = [{'~label': 'scooter', '~id': 'scooter-1', 'parent_id': 'None', 'name': 'scooter'},
+                {'~label': 'weather', '~id': 'weather_sunny-ws1', 'parent_id': '', 'name': 'weather_sunny'},
+                {'~label': 'weather', '~id': 'weather_sunny-ws1', 'parent_id': '', 'name': 'weather_sunny'}]
+
+        (script, bindings, number_of_rows), = list(query_load_harness.seed_queries(rows, 'vertices'))
+
+        self.assertEqual(number_of_rows, 2)
+        self.assertEqual(script, 'g.addV(l0).property(T.id, i0).property(k0_0, v0_0).property(k0_1, v0_1)'
+                                 '.addV(l1).property(T.id, i1).property(k1_0, v1_0).count()')
+        self.assertEqual(bindings['i1'], 'weather_sunny-ws1')
+
+        edges = [{'~from': 'scooter-1', '~to': 'part-1', '~label': 'has', '~id': 'scooter-1->part-1'}]
+        (script, bindings, _), = list(query_load_harness.seed_queries(edges, 'edges'))
+        self.assertEqual(script, 'g.V(f0).addE(l0).to(__.V(t0)).property(T.id, i0).count()')
+
+    def test_run_load_test_report(self):
+        def handler(event, context):
+            time.sleep(0.01)
+            return {'statusCode': 400 if event['queryStringParameters'].get('scooter_asset_code') == 'scooter-bad' else 201, 'body': '{}'}
+
+        rng = query_load_harness.random.Random(1)
+        events = [(endpoint, query_load_harness.synthetic_event(endpoint, 'localhost', ['scooter-1'], rng)) for endpoint in ['getScooter', 'runQuery'] * 10]
+        events.append(('getScooter', query_load_harness.synthetic_event('getScooter', 'localhost', ['scooter-bad'], rng)))
+
+        report = query_load_harness.run_load_test(handler, events, concurrency=4, rate=200)
+
+        self.assertEqual(report['total']['requests'], 21)
+        self.assertEqual(report['getScooter']['errors'], 1)
+        self.assertEqual(report['runQuery']['error_rate'], 0.0)
+        self.assertGreaterEqual(report['getScooter']['p50_ms'], 10)
+        self.assertLessEqual(report['total']['p50_ms'], report['total']['p99_ms'])
+
+    def test_stub_llm_answers_from_the_graph(self):
+        pool = mock.Mock()
+        pool.submit.return_value = [42]
+        chains = query_load_harness.StubGraphQAChains(pool, llm_latency_seconds=0, question_cache=question_cache.QuestionCache())
+
+        self.assertEqual(chains.ask('localhost', 'us-west-2', 'How many scooters?', 'prompt'), 'Answer: [42]')
+        # Cached question: the query's results, no (stubbed) LLM call
+        self.assertEqual(chains.ask('localhost', 'us-west-2', 'how many scooters', 'prompt'), '[42]')
+        self.assertEqual(chains.question_cache.stats['hits'], 1)
+
+    def test_percentile(self):
+        self.assertEqual(query_load_harness.percentile(list(range(1, 101)), 95), 95)
+        self.assertIsNone(query_load_harness.percentile([], 50))
+
+
+if __name__ == '__main__':
+    unittest.main()